@@ -0,0 +1,354 @@
+"""ヘッドレス実行用のコマンドライン
+
+    python main.py send --camera 0 --port 8000 --quality 85 --renditions main,360p
+    python main.py receive 192.168.1.10 --sink vcam --sink record
+    python main.py replay recordings/*.mjpg --speed max
+
+GUI（customtkinter/Tk）は読み込まず、各サブコマンドは必要なモジュールだけを遅延インポートする。
+"""
+import argparse
+import signal
+import sys
+import threading
+
+
+def _install_signal_handlers(stop_event):
+    """SIGINT/SIGTERM（WindowsではCtrl+Breakも）で停止イベントを立てる"""
+    def handler(signum, frame):
+        stop_event.set()
+
+    for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+        sig = getattr(signal, name, None)
+        if sig is not None:
+            signal.signal(sig, handler)
+
+
+def run_send(args):
+    from sender.camera import Camera
+    from sender.server import StreamServer
+    from sender.renditions import parse_renditions, parse_crop_preset
+    from sender.encoders import JpegOptions
+    from utils.stats import RateMeter
+
+    renditions = parse_renditions(args.renditions) + [parse_crop_preset(p) for p in args.crop_preset or []]
+    jpeg_options = JpegOptions(quality=args.quality, subsampling=args.subsampling,
+                               progressive=args.progressive, optimize=args.optimize,
+                               restart_interval=args.restart_interval)
+    stop_event = threading.Event()
+    _install_signal_handlers(stop_event)
+
+    pipeline = None
+    if args.workers:
+        # キャプチャ・エンコードと配信を別プロセスで動かす（このプロセスは制御と録画のみ）
+        from sender.workers import WorkerSender
+        server = WorkerSender(args.camera, port=args.port, renditions=renditions,
+                              max_bitrate=_mbps(args.max_mbps), client_bitrate=_mbps(args.client_mbps),
+                              encoder=args.encoder, jpeg_options=jpeg_options, shared_memory=not args.no_shm,
+                              filters=args.filter, filter_budget=args.filter_budget,
+                              on_failure=lambda message: stop_event.set())
+        camera = None
+    else:
+        pipeline = _filter_pipeline(args)
+        camera = Camera(camera_id=args.camera, encoder=args.encoder, jpeg_options=jpeg_options, filters=pipeline)
+        camera.start()
+        server = StreamServer(camera, port=args.port, renditions=renditions,
+                              max_bitrate=_mbps(args.max_mbps), client_bitrate=_mbps(args.client_mbps),
+                              shared_memory=not args.no_shm)
+    recorder = None
+    try:
+        server.start()
+        camera = server.camera
+        if args.record:
+            from utils.recorder import StreamRecorder
+            recorder = StreamRecorder(args.record, prefix="sender")
+            recorder.start()
+            camera.add_listener(recorder.write)
+
+        meter = RateMeter()
+        # 無期限待機はWindowsでCtrl+Cを受け付けないため、統計なしでも定期的に起床する
+        while not stop_event.wait(args.stats_interval if args.stats_interval > 0 else 1.0):
+            if args.stats_interval <= 0:
+                continue
+            stats = server.get_stats()
+            if not stats:
+                continue
+            rates = meter.rates(frames=stats["frames_sent"], bytes=stats["bytes_sent"])
+            filters = pipeline.describe() if pipeline else getattr(server, "capture_stats", {}).get("filters")
+            print(f"[send] capture {camera.fps:5.1f} fps  encode {camera.encode_ms:5.1f} ms  "
+                  f"clients {stats['clients']}  out {rates['frames']:6.1f} fps  "
+                  f"{rates['bytes'] * 8 / 1e6:6.2f} Mbps  shaped {stats['frames_dropped']}"
+                  + (f"  filters {filters}" if filters else ""), flush=True)
+    finally:
+        print("Shutting down...")
+        if recorder:
+            camera.remove_listener(recorder.write)
+            recorder.stop()
+        server.stop()
+        if camera:
+            camera.stop()
+        if pipeline:
+            pipeline.close()
+    # 子プロセスが落ちて復旧できずに止まった場合は失敗
+    return 1 if getattr(server, "error", None) else 0
+
+
+def _mbps(value):
+    return value * 1e6 if value else None
+
+
+def _filter_pipeline(args):
+    if not args.filter:
+        return None
+    from utils.filters import DEFAULT_BUDGET_MS, FilterPipeline, parse_filters
+    return FilterPipeline(parse_filters(args.filter), args.filter_budget or DEFAULT_BUDGET_MS)
+
+
+def _resolve_stream_url(args):
+    """接続先URLと、検出した場合はその送信元の情報を返す（未指定ならLANを検出して最適な送信元を選ぶ）"""
+    if args.target and args.target.startswith(("http://", "https://")):
+        return args.target, None
+
+    if args.target:
+        path = "/stream.mjpg" if args.rendition == "main" else f"/stream.mjpg?rendition={args.rendition}"
+        return _with_crop(f"http://{args.target}:{args.port}{path}", args.crop), None
+
+    from utils.network import ServerDiscovery, rank_servers
+    from utils.sender_cache import SenderCache
+    print("Discovering senders...")
+    servers = rank_servers(ServerDiscovery(timeout=args.discover_timeout, cache=SenderCache()).discover())
+    if args.crop:
+        # リレーは生フレームを持たず切り出しできない
+        servers = [s for s in servers if s.get("raw_frames", True)]
+    if args.tiles:
+        servers = [s for s in servers if "tiles" in s.get("formats", ())]
+    if not servers:
+        raise ConnectionError("No senders found")
+    best = servers[0]
+    print(f"Selected {best['name']} ({best['rendition']['name']}, {best.get('rtt_ms', 0):.1f} ms)")
+    return _with_crop(f"http://{best['ip']}:{best['port']}{best['rendition']['path']}", args.crop), best
+
+
+def _open_client(args, url, server, relay):
+    """同じホストの送信元なら共有メモリ（main 以外のレンディション、切り出し指定時と --no-shm を除く）、
+    それ以外はHTTPで接続する"""
+    from receiver.client import StreamClient
+    from receiver.shm_client import ShmClient, shm_target
+
+    if args.tiles:
+        from receiver.tiles import TileClient, tiles_url
+        client = TileClient(tiles_url(url), via=[relay.relay_id] if relay else None)
+        client.start()
+        return client
+    shm = shm_target(server) if server and args.rendition == "main" and not args.crop and not args.no_shm else None
+    if shm:
+        client = ShmClient(shm["name"], path=server.get("path"))
+        try:
+            client.start()
+            return client
+        except ConnectionError as e:
+            print(f"Shared memory unavailable, using HTTP: {e}")
+    client = StreamClient(url, via=[relay.relay_id] if relay else None)
+    client.start()
+    return client
+
+
+def _with_crop(url, crop):
+    if not crop:
+        return url
+    return url + ("&" if "?" in url else "?") + f"crop={crop}"
+
+
+def run_receive(args):
+    from utils import thread_roles
+    from utils.stats import RateMeter
+
+    sinks = set(args.sink or ["vcam"])
+    pipeline = _filter_pipeline(args)
+    if args.tiles and (args.relay_port or "record" in sinks):
+        # 差分はJPEGとして取り出せないため、リレー・録画にはキーフレームしか渡せない
+        print("--tiles cannot be combined with --relay-port or the record sink", file=sys.stderr)
+        return 2
+    stop_event = threading.Event()
+    _install_signal_handlers(stop_event)
+
+    relay = None
+    if args.relay_port:
+        from receiver.relay import StreamRelay
+        relay = StreamRelay(port=args.relay_port)
+
+    from receiver.reconnect import ReconnectingClient, SenderTarget
+    from utils.sender_cache import SenderCache
+
+    url, server = _resolve_stream_url(args)
+    # 切断・停止したら再検出したアドレスも含めて張り直す（その間も仮想カメラは出力を続ける）
+    target = SenderTarget(url, server, cache=SenderCache())
+    client = ReconnectingClient(lambda attempt: _open_client(args, *target.next(attempt), relay))
+    client.start()
+    print(f"Connected to {client.url}" + (f" (via {client.hops} relay hops)" if client.hops else ""))
+
+    vcam = None
+    recorder = None
+    bus = None
+    counters = {"frames": 0, "bytes": 0, "output": 0}
+    try:
+        if "vcam" in sinks:
+            from receiver.virtual_cam import VirtualCamera
+            vcam = VirtualCamera(width=args.width, height=args.height)
+            vcam.start()
+        if "record" in sinks:
+            from utils.recorder import StreamRecorder
+            recorder = StreamRecorder(args.record_dir, prefix="receiver")
+            recorder.start()
+        if relay:
+            relay.start(client.path)
+
+        # 出力先はそれぞれ購読スレッドで動かし、遅い出力が受信や他の出力を待たせないようにする
+        from receiver.frame_bus import FrameBus
+        bus = FrameBus()
+        if vcam:
+            def output(item):
+                # フィルターは出力スレッドで（受信や他の出力を待たせない）
+                frame = pipeline.process(item.frame, item.seq) if pipeline else item.frame
+                vcam.send_frame(frame, item.seq, pace=False)
+                counters["output"] += 1
+            bus.subscribe("vcam", output)
+        if relay:
+            bus.subscribe("relay", lambda item: relay.publish(item.jpeg, client.relay_delay_ms), needs_frame=False,
+                          role="network")
+        if recorder:
+            bus.subscribe("record", lambda item: recorder.write(item.jpeg), needs_frame=False)
+
+        def pump():
+            thread_roles.assign("network", "receive")
+            try:
+                # デコードは仮想カメラ出力がある場合のみ、バスで1回だけ（共有メモリは常に生フレーム）
+                for jpg, frame in client.read_frames(decode=False):
+                    if stop_event.is_set():
+                        break
+                    counters["frames"] += 1
+                    counters["bytes"] = client.bytes_received
+                    bus.publish(jpg, frame, client.frames_received, shared=client.reuses_buffers)
+            except Exception as e:
+                if not stop_event.is_set():
+                    print(f"Stream error: {e}")
+            finally:
+                stop_event.set()
+
+        worker = threading.Thread(target=pump, daemon=True)
+        worker.start()
+
+        meter = RateMeter()
+        while not stop_event.wait(args.stats_interval if args.stats_interval > 0 else 1.0):
+            if args.stats_interval <= 0:
+                continue
+            rates = meter.rates(**counters)
+            recovery = f" (last {client.recovery_s:.1f} s)" if client.recovery_s is not None else ""
+            print(f"[receive] in {rates['frames']:6.1f} fps  {rates['bytes'] * 8 / 1e6:6.2f} Mbps  "
+                  f"out {rates['output']:6.1f} fps  held {vcam.frames_held if vcam else 0}  "
+                  f"reconnects {client.reconnects}{recovery}"
+                  + (f"  filters {pipeline.describe()}" if pipeline else ""), flush=True)
+    finally:
+        print("Shutting down...")
+        stop_event.set()
+        client.stop()
+        if bus:
+            bus.stop()
+        if relay:
+            relay.stop()
+        if recorder:
+            recorder.stop()
+        if vcam:
+            vcam.stop()
+        if pipeline:
+            pipeline.close()
+    return 0
+
+
+def build_parser():
+    from utils.network import STREAM_PORT
+
+    parser = argparse.ArgumentParser(prog="webcamshare", description="WebCam Share headless mode")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    send = subparsers.add_parser("send", help="capture a camera and serve it as MJPEG")
+    send.add_argument("--camera", type=int, default=0, help="camera index")
+    send.add_argument("--port", type=int, default=STREAM_PORT)
+    send.add_argument("--quality", type=int, default=85, help="JPEG quality of the main rendition")
+    send.add_argument("--encoder", choices=["auto", "cv2", "pillow", "turbojpeg"], default="auto",
+                      help="JPEG encoder backend (auto: fastest on this machine)")
+    send.add_argument("--subsampling", choices=["444", "422", "420"], default="420")
+    send.add_argument("--progressive", action="store_true")
+    send.add_argument("--optimize", action="store_true", help="optimize Huffman tables")
+    send.add_argument("--restart-interval", type=int, default=0, help="restart marker interval in MCUs")
+    send.add_argument("--renditions", default="main,360p",
+                      help="comma separated renditions, e.g. main,360p,540p@80")
+    send.add_argument("--max-mbps", type=float, help="uplink cap for all clients together (frames over it are dropped)")
+    send.add_argument("--client-mbps", type=float, help="uplink cap per client")
+    send.add_argument("--crop-preset", action="append", metavar="NAME=X,Y,W,H[@HEIGHT]",
+                      help="advertise a region-of-interest rendition, repeatable")
+    send.add_argument("--no-shm", action="store_true",
+                      help="do not offer the shared-memory transport to receivers on this host")
+    send.add_argument("--workers", action="store_true",
+                      help="run capture/encode and serving in separate processes")
+    send.add_argument("--filter", metavar="NAMES",
+                      help="image filters before encoding, e.g. denoise,blur,brightness")
+    send.add_argument("--filter-budget", type=float,
+                      help="per-frame filter time budget in ms (default 12; cheaper variants are used above it)")
+    send.add_argument("--record", metavar="DIR", help="also record the stream into DIR")
+    send.add_argument("--stats-interval", type=float, default=5.0, help="seconds between stats lines (0: off)")
+    send.add_argument("--thread-roles", metavar="SPEC",
+                      help="pin threads per role and set their niceness on Linux, "
+                           "e.g. auto or capture=1,encode=2-3@-5,network=1,ui=0")
+    send.add_argument("--trace", metavar="FILE", help="record per-stage spans and write Chrome trace JSON on exit")
+    send.set_defaults(func=run_send)
+
+    receive = subparsers.add_parser("receive", help="receive a stream and output it to sinks")
+    receive.add_argument("target", nargs="?", help="sender IP/host or stream URL (default: discover)")
+    receive.add_argument("--port", type=int, default=STREAM_PORT)
+    receive.add_argument("--rendition", default="main")
+    receive.add_argument("--crop", metavar="X,Y,W,H", help="request only this region, cropped by the sender")
+    receive.add_argument("--sink", action="append", choices=["vcam", "record", "null"],
+                         help="output sink, repeatable (default: vcam)")
+    receive.add_argument("--record-dir", metavar="DIR", help="directory for the record sink")
+    receive.add_argument("--no-shm", action="store_true",
+                         help="always use HTTP, even for a sender on this host")
+    receive.add_argument("--tiles", action="store_true",
+                         help="receive only changed tiles (for mostly static scenes)")
+    receive.add_argument("--filter", metavar="NAMES",
+                         help="image filters before the virtual camera, e.g. denoise,brightness")
+    receive.add_argument("--filter-budget", type=float, help="per-frame filter time budget in ms (default 12)")
+    receive.add_argument("--relay-port", type=int, help="re-serve the stream on this port")
+    receive.add_argument("--width", type=int, default=1280, help="virtual camera width")
+    receive.add_argument("--height", type=int, default=720, help="virtual camera height")
+    receive.add_argument("--discover-timeout", type=float, default=3.0)
+    receive.add_argument("--stats-interval", type=float, default=5.0, help="seconds between stats lines (0: off)")
+    receive.add_argument("--thread-roles", metavar="SPEC",
+                         help="pin threads per role and set their niceness on Linux, "
+                              "e.g. auto or capture=1,encode=2-3@-5,network=1,ui=0")
+    receive.add_argument("--trace", metavar="FILE", help="record per-stage spans and write Chrome trace JSON on exit")
+    receive.set_defaults(func=run_receive)
+
+    # 引数は sender.replay 側で解析する（main() で振り分け）
+    subparsers.add_parser("replay", help="serve recorded sessions (python main.py replay --help)")
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] == "replay":
+        from sender.replay import main as replay_main
+        return replay_main(argv[1:]) or 0
+
+    args = build_parser().parse_args(argv)
+    if getattr(args, "trace", None):
+        from utils import tracing
+        tracing.enable(args.trace)
+    try:
+        if getattr(args, "thread_roles", None):
+            from utils import thread_roles
+            thread_roles.configure(args.thread_roles)
+            print(f"Thread roles: {thread_roles.describe() or 'none'}")
+        return args.func(args) or 0
+    except (RuntimeError, ConnectionError, ValueError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
@@ -1,24 +1,52 @@
+import time
 import cv2
 import numpy as np
 import requests
+from utils import tracing
+from utils.network import VIA_HEADER, PATH_HEADER, HOPS_HEADER, RELAY_DELAY_HEADER
 
 class StreamClient:
     MAX_BUFFER_SIZE = 1024 * 1024  # 1MB制限
+    # これだけの間フレームが届かなければ送信元が止まった・切れたとみなす（s）
+    FRAME_TIMEOUT = 3.0
+    # read_frames が返すバッファを次のフレームで上書きするか（保持するならコピーが必要）
+    reuses_buffers = False
 
-    def __init__(self, url):
+    def __init__(self, url, via=None, frame_timeout=FRAME_TIMEOUT):
         self.url = url
+        self.frame_timeout = frame_timeout
         self.stream = None
         self._buffer = bytearray()  # bytearrayに変更（効率的な追加・削除）
         self.running = False
+        # リレー情報: 自分のリレーID（ループ検出用）と上流の経路・段数・累積遅延
+        self.via = list(via or [])
+        self.path = []
+        self.hops = 0
+        self.relay_delay_ms = 0.0
+        # 受信統計（累積）
+        self.frames_received = 0
+        self.bytes_received = 0
+        # デコード時間（ms、移動平均）
+        self.decode_ms = 0.0
 
     def start(self):
         self.running = True
         try:
-            self.stream = requests.get(self.url, stream=True, timeout=5)
+            headers = {VIA_HEADER: ','.join(self.via)} if self.via else None
+            # 読み込みのタイムアウトがフレームの締め切りを兼ねる（データが途絶えたら例外）
+            self.stream = requests.get(self.url, stream=True, timeout=(5, self.frame_timeout), headers=headers)
+            if self.stream.status_code == 508:
+                raise ConnectionError(f"Relay loop detected at {self.url}")
             if self.stream.status_code != 200:
                 raise ConnectionError(f"Could not connect to {self.url}")
+            self.path = [p for p in self.stream.headers.get(PATH_HEADER, '').split(',') if p]
+            self.hops = int(self.stream.headers.get(HOPS_HEADER, 0))
+            if any(v in self.path for v in self.via):
+                raise ConnectionError(f"Relay loop detected at {self.url}")
         except Exception as e:
             self.running = False
+            if self.stream:
+                self.stream.close()
             raise e
 
     def stop(self):
@@ -26,14 +54,31 @@ class StreamClient:
         if self.stream:
             self.stream.close()
 
-    def get_frames(self):
-        """Generator that yields frames from the stream."""
+    def _iter_chunks(self):
+        """受信データを届いた分だけ返す
+
+        iter_content(65536) は64KBが溜まるまで戻らず、小さいフレームが数枚ずつまとめて届く。
+        urllib3 の read1 があればそれを使う。
+        """
+        read1 = getattr(getattr(self.stream, 'raw', None), 'read1', None)
+        if read1:
+            return iter(lambda: read1(65536), b'')
+        return self.stream.iter_content(chunk_size=65536)  # 64KB（100回→数回のイテレーション）
+
+    def get_jpeg_frames(self):
+        """Generator that yields raw JPEG bytes from the stream (no decode)."""
         if not self.stream:
             return
 
-        for chunk in self.stream.iter_content(chunk_size=65536):  # 64KB（100回→数回のイテレーション）
-            if not self.running:
+        delay_key = RELAY_DELAY_HEADER.encode() + b':'
+        chunks = self._iter_chunks()
+        deadline = time.monotonic() + self.frame_timeout
+        while True:
+            span = tracing.begin()
+            chunk = next(chunks, None)
+            if chunk is None or not self.running:
                 break
+            tracing.end("receive", span, cat="net")
 
             self._buffer.extend(chunk)
 
@@ -45,18 +90,62 @@ class StreamClient:
 
             # フレーム抽出ループ（複数フレームが蓄積している場合に対応）
             while True:
+                span = tracing.begin()
                 a = self._buffer.find(b'\xff\xd8')  # JPEG start
                 b = self._buffer.find(b'\xff\xd9', a if a != -1 else 0)  # JPEG end
 
                 if a == -1 or b == -1:
+                    # データは届いているのにフレームにならない
+                    if time.monotonic() > deadline:
+                        raise ConnectionError(f"No frames from {self.url} for {self.frame_timeout:.0f} s")
                     break
 
+                # リレー経由の場合のみパートヘッダー（SOIより前）から累積遅延を読む
+                if self.hops:
+                    i = self._buffer.find(delay_key, 0, a)
+                    if i != -1:
+                        end = self._buffer.find(b'\r\n', i, a)
+                        try:
+                            self.relay_delay_ms = float(self._buffer[i + len(delay_key):end])
+                        except ValueError:
+                            pass
+
                 jpg = bytes(self._buffer[a:b+2])
                 del self._buffer[:b+2]
+                deadline = time.monotonic() + self.frame_timeout
+                self.frames_received += 1
+                self.bytes_received += len(jpg)
+                tracing.end("parse", span, self.frames_received)
+                yield jpg
 
-                try:
-                    frame = cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
-                    if frame is not None:
-                        yield frame
-                except Exception:
-                    continue
+    @staticmethod
+    def decode(jpg, seq=None):
+        """JPEGバイト列をBGRフレームにデコード（失敗時はNone）"""
+        span = tracing.begin()
+        try:
+            return cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), cv2.IMREAD_COLOR)
+        except Exception:
+            return None
+        finally:
+            tracing.end("decode", span, seq)
+
+    def read_frames(self, decode=True):
+        """(jpeg, frame) を順に返す（decode=False または失敗時の frame はNone）
+
+        ShmClient と同じ形で受信ループを書けるようにする。
+        """
+        for jpg in self.get_jpeg_frames():
+            frame = None
+            if decode:
+                start = time.perf_counter()
+                frame = self.decode(jpg, self.frames_received)
+                if frame is not None:
+                    self.decode_ms += ((time.perf_counter() - start) * 1000 - self.decode_ms) * 0.1
+            yield jpg, frame
+
+    def get_frames(self):
+        """Generator that yields frames from the stream."""
+        for jpg in self.get_jpeg_frames():
+            frame = self.decode(jpg)
+            if frame is not None:
+                yield frame
@@ -0,0 +1,171 @@
+import threading
+import time
+from utils import tracing, thread_roles
+from .client import StreamClient
+
+
+class BusFrame:
+    """購読者に配る1フレーム（全購読者で同じオブジェクトを共有する）
+
+    frame は読み取り専用のビュー。加工する購読者は自分でコピーする。
+    """
+
+    __slots__ = ("jpeg", "frame", "seq", "timestamp")
+
+    def __init__(self, jpeg, frame, seq, timestamp):
+        self.jpeg = jpeg
+        self.frame = frame
+        self.seq = seq
+        self.timestamp = timestamp
+
+
+class Subscriber:
+    """1つの出力先（仮想カメラ・プレビュー・録画・リレーなど）
+
+    専用スレッドで callback(BusFrame) を呼ぶ。処理中に届いたフレームは最新の1枚だけを残し
+    （latest-wins）、max_fps を超える分は次の配信時刻まで待って最新のものを渡す。
+    遅い購読者は自分の分を取りこぼすだけで、受信や他の購読者を待たせない。
+    role はスレッドの役割（utils.thread_roles。CPU と優先度の割り当て）。
+    """
+
+    def __init__(self, name, callback, needs_frame=True, max_fps=None, role="output"):
+        self.name = name
+        self.callback = callback
+        self.role = role
+        # False ならJPEGだけを使う（デコード不要）
+        self.needs_frame = needs_frame
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        # 統計: 渡したフレーム数、渡す前に新しいフレームで置き換えられた数、callbackの時間（ms、移動平均）
+        self.delivered = 0
+        self.skipped = 0
+        self.busy_ms = 0.0
+        self._latest = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name=f"bus-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self, wait=True):
+        """停止する（wait=False なら処理中の callback の終了を待たない）"""
+        self.running = False
+        self._ready.set()
+        if wait and self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def offer(self, item):
+        with self._lock:
+            if self._latest is not None:
+                self.skipped += 1
+            self._latest = item
+        self._ready.set()
+
+    def _run(self):
+        thread_roles.assign(self.role, f"bus-{self.name}")
+        next_due = 0.0
+        while self.running:
+            self._ready.wait()
+            self._ready.clear()
+            if not self.running:
+                break
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                # 上限FPSの間隔まで待ち、その間に届いたものも含めて最新を渡す
+                time.sleep(delay)
+            with self._lock:
+                item, self._latest = self._latest, None
+            if item is None:
+                continue
+            if self.interval:
+                next_due = max(next_due + self.interval, time.monotonic())
+            start = time.perf_counter()
+            span = tracing.begin()
+            try:
+                self.callback(item)
+            except Exception as e:
+                print(f"{self.name} error: {e}")
+            tracing.end(self.name, span, item.seq)
+            self.delivered += 1
+            self.busy_ms += ((time.perf_counter() - start) * 1000 - self.busy_ms) * 0.1
+
+
+class FrameBus:
+    """受信したフレームを1回だけデコードし、複数の購読者へ同じバッファを配る
+
+    publish() は受信スレッドから呼ぶ。JPEGしか受け取っていなければ、フレームを使う購読者が
+    いるときだけここでデコードする。shared=True（共有メモリのビューやタイルの出力バッファなど、
+    次のフレームで上書きされるもの）は購読者へ渡す前に1回だけコピーする。
+    """
+
+    def __init__(self):
+        self._subscribers = ()
+        self._lock = threading.Lock()
+        # デコード時間（ms、移動平均）とデコードに失敗したフレーム数
+        self.decode_ms = 0.0
+        self.decode_failures = 0
+
+    def subscribe(self, name, callback, needs_frame=True, max_fps=None, role="output"):
+        subscriber = Subscriber(name, callback, needs_frame, max_fps, role)
+        subscriber.start()
+        with self._lock:
+            self._subscribers = self._subscribers + (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscriber)
+        subscriber.stop()
+
+    def stop(self, wait=True):
+        """全購読者を止める（UIスレッドからは wait=False: プレビューが after() で待っている場合がある）"""
+        with self._lock:
+            subscribers, self._subscribers = self._subscribers, ()
+        for subscriber in subscribers:
+            subscriber.stop(wait)
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    @property
+    def needs_frame(self):
+        return any(s.needs_frame for s in self._subscribers)
+
+    def publish(self, jpeg, frame=None, seq=None, shared=False):
+        """1フレームを全購読者へ渡す（各購読者は受け取れる形がなければ飛ばされる）"""
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        wants_frame = any(s.needs_frame for s in subscribers)
+        wants_jpeg = not all(s.needs_frame for s in subscribers)
+
+        if not wants_frame:
+            frame = None
+        elif frame is None and jpeg is not None:
+            start = time.perf_counter()
+            frame = StreamClient.decode(jpeg, seq)
+            if frame is None:
+                self.decode_failures += 1
+            else:
+                self.decode_ms += ((time.perf_counter() - start) * 1000 - self.decode_ms) * 0.1
+        elif frame is not None and shared:
+            frame = frame.copy()
+        if frame is not None:
+            frame = frame.view()
+            frame.flags.writeable = False
+
+        if not wants_jpeg or jpeg is None:
+            jpeg = None
+        elif shared or not isinstance(jpeg, bytes):
+            # bytes(bytes) はコピーしないので、共有メモリ上のビューなどだけがコピーされる
+            jpeg = bytes(jpeg)
+
+        item = BusFrame(jpeg, frame, seq, time.time())
+        for subscriber in subscribers:
+            if (frame if subscriber.needs_frame else jpeg) is not None:
+                subscriber.offer(item)
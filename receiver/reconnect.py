@@ -0,0 +1,208 @@
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+# 再接続の待ち時間（s）: 失敗ごとに倍にし、上限で頭打ち
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+# この回数の失敗ごとに1回、送信元を再検出する（再起動やIP変更に追従）
+REDISCOVER_EVERY = 2
+REDISCOVER_TIMEOUT = 1.5
+
+
+class Backoff:
+    """ジッター付き指数バックオフ（同時に切れた受信側の再接続が揃わないようにする）
+
+    最初の1回は待たない。reset() するまで待ち時間は倍になっていく。
+    """
+
+    def __init__(self, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+        self.base = base
+        self.maximum = maximum
+        self.failures = 0
+
+    def next(self):
+        self.failures += 1
+        if self.failures == 1:
+            return 0.0
+        delay = min(self.maximum, self.base * (2 ** (self.failures - 2)))
+        return random.uniform(delay / 2, delay)
+
+    def reset(self):
+        self.failures = 0
+
+
+def _base_name(server):
+    # ディスカバリー応答の名前は "名前 (IP)" の形
+    return server.get("name", "").rsplit(" (", 1)[0]
+
+
+class SenderTarget:
+    """再接続先: 直前の接続先と、再検出で見つけた同じ送信元のアドレス
+
+    URLのパスとクエリ（レンディション・切り出し・?fps=）は再検出後も引き継ぐ。
+    """
+
+    def __init__(self, url, server=None, cache=None, rediscover=True):
+        self.url = url
+        self.server = server
+        self.cache = cache
+        self.rediscover = rediscover
+        parts = urlsplit(url)
+        self._path = parts.path + (f"?{parts.query}" if parts.query else "")
+        self._address = (parts.hostname, parts.port or 80)
+
+    def next(self, attempt):
+        """attempt 回目の接続先 (url, server)"""
+        if self.rediscover and attempt and attempt % REDISCOVER_EVERY == 0:
+            server = self._find()
+            if server is not None:
+                self.server = server
+                self.url = f"http://{server['ip']}:{server['port']}{self._path}"
+                self._address = (server['ip'], server['port'])
+        return self.url, self.server
+
+    def _find(self):
+        from utils.network import ServerDiscovery, rank_servers
+
+        servers = rank_servers(ServerDiscovery(timeout=REDISCOVER_TIMEOUT, cache=self.cache).discover())
+        for server in servers:
+            if (server['ip'], server['port']) == self._address:
+                return server
+        name = _base_name(self.server) if self.server else None
+        for server in servers:
+            if name and _base_name(server) == name:
+                print(f"Sender {name} found at {server['ip']}:{server['port']}")
+                return server
+        return None
+
+
+class ReconnectingClient:
+    """切断・停止を検知したらバックオフしながら張り直すクライアント（StreamClient互換）
+
+    connect(attempt) は接続済みのクライアント（StreamClient / ShmClient）を返す。
+    read_frames() は stop() まで終わらず、再接続の間はフレームが来ないだけになる。
+    """
+
+    def __init__(self, connect, client=None, on_state=None):
+        self.connect = connect
+        self.client = client
+        self.on_state = on_state
+        self.running = False
+        self.state = "disconnected"
+        self.backoff = Backoff()
+        self._stopped = threading.Event()
+        # 統計: 再接続回数と、直近の途切れ（最後のフレームから復帰後の最初のフレームまで、s）
+        self.reconnects = 0
+        self.recovery_s = None
+        self._frames_base = 0
+        self._bytes_base = 0
+
+    # StreamClient と同じ属性は現在の接続のものを返す（受信数は再接続をまたいで累積）
+    @property
+    def url(self):
+        return self.client.url if self.client else None
+
+    @property
+    def via(self):
+        return self.client.via if self.client else []
+
+    @property
+    def path(self):
+        return self.client.path if self.client else []
+
+    @property
+    def hops(self):
+        return self.client.hops if self.client else 0
+
+    @property
+    def relay_delay_ms(self):
+        return self.client.relay_delay_ms if self.client else 0.0
+
+    @property
+    def decode_ms(self):
+        return self.client.decode_ms if self.client else 0.0
+
+    @property
+    def reuses_buffers(self):
+        return self.client.reuses_buffers if self.client else False
+
+    @property
+    def frames_received(self):
+        client = self.client
+        return self._frames_base + (client.frames_received if client else 0)
+
+    @property
+    def bytes_received(self):
+        client = self.client
+        return self._bytes_base + (client.bytes_received if client else 0)
+
+    def start(self):
+        self._stopped.clear()
+        if self.client is None:
+            self.client = self.connect(0)
+        self.running = True
+        self._set_state("connected")
+
+    def stop(self):
+        self.running = False
+        self._stopped.set()
+        if self.client:
+            self.client.stop()
+
+    def _set_state(self, state):
+        self.state = state
+        if self.on_state:
+            self.on_state(state)
+
+    def read_frames(self, decode=True):
+        last_frame = None
+        while self.running:
+            client = self.client
+            try:
+                for item in client.read_frames(decode):
+                    if last_frame is not None and self.state == "reconnecting":
+                        self.recovery_s = time.monotonic() - last_frame
+                        print(f"Stream recovered after {self.recovery_s:.1f} s")
+                        # フレームが届くまでは接続できても失敗扱い（すぐ切れる接続で再接続を繰り返さない）
+                        self.backoff.reset()
+                        self._set_state("connected")
+                    last_frame = time.monotonic()
+                    yield item
+            except Exception as e:
+                if self.running:
+                    print(f"Stream error: {e}")
+            if not self.running:
+                break
+            print(f"Stream from {client.url} lost, reconnecting...")
+            self._set_state("reconnecting")
+            if last_frame is None:
+                last_frame = time.monotonic()
+            if not self._reconnect(client):
+                break
+
+    def _reconnect(self, old):
+        """新しい接続ができるまで待って差し替える（stop() されたらFalse）"""
+        old.stop()
+        attempt = 0
+        while self.running:
+            delay = self.backoff.next()
+            if delay and self._stopped.wait(delay):
+                return False
+            attempt += 1
+            try:
+                client = self.connect(attempt)
+            except Exception as e:
+                print(f"Reconnect attempt {attempt} failed: {e}")
+                continue
+            if not self.running:
+                client.stop()
+                return False
+            self._frames_base += old.frames_received
+            self._bytes_base += old.bytes_received
+            self.client = client
+            self.reconnects += 1
+            print(f"Reconnected to {client.url}")
+            return True
+        return False
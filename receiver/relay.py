@@ -0,0 +1,115 @@
+import threading
+import time
+import uuid
+from sender.server import StreamServer
+from sender.renditions import Rendition
+from utils.network import STREAM_PORT, MAX_RELAY_HOPS
+from utils.jpeg import jpeg_dimensions
+
+
+class RelaySource:
+    """受信したJPEGをそのまま再配信するフレームソース（StreamServerのcamera互換）"""
+
+    # デコードしないため生フレームを持たない（切り出し・縮小・タイル差分は配信できない）
+    raw_frames = False
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.fps = 0.0
+        self.frame_seq = 0
+        self._jpeg = None
+        self._lock = threading.Lock()
+        self._received_at = 0.0
+        self._upstream_delay_ms = 0.0
+        self._last_publish = None
+        self._listeners = ()
+
+    def publish(self, jpeg, upstream_delay_ms=0.0):
+        now = time.monotonic()
+        if self._last_publish is not None and now > self._last_publish:
+            rate = 1.0 / (now - self._last_publish)
+            self.fps = self.fps * 0.9 + rate * 0.1 if self.fps else rate
+        self._last_publish = now
+
+        # 解像度はヘッダーから時々確認するだけ（デコード不要）
+        if self.frame_seq % 30 == 0:
+            size = jpeg_dimensions(jpeg)
+            if size:
+                self.width, self.height = size
+
+        with self._lock:
+            self._jpeg = jpeg
+            self._received_at = now
+            self._upstream_delay_ms = upstream_delay_ms
+            self.frame_seq += 1
+        if self._listeners:
+            timestamp = time.time()
+            for listener in self._listeners:
+                listener(jpeg, timestamp)
+
+    def get_listeners(self):
+        return self._listeners
+
+    def add_listener(self, callback):
+        """受信したJPEGごとに callback(jpeg, timestamp) を呼ぶ"""
+        self._listeners = self._listeners + (callback,)
+
+    def remove_listener(self, callback):
+        self._listeners = tuple(l for l in self._listeners if l != callback)
+
+    def get_jpeg_frame_direct(self):
+        with self._lock:
+            return self._jpeg
+
+    def get_frame_view(self):
+        # デコードしないため生フレームは持たない
+        return None
+
+    def get_load(self):
+        return 0.0
+
+    def get_relay_delay_ms(self):
+        """上流の累積遅延 + このリレーでの滞留時間"""
+        with self._lock:
+            residence = (time.monotonic() - self._received_at) * 1000 if self._received_at else 0.0
+            return self._upstream_delay_ms + residence
+
+
+class StreamRelay:
+    """Receiver側: 受信中のストリームを再エンコードせずに再配信する"""
+
+    def __init__(self, port=STREAM_PORT, relay_id=None):
+        self.port = port
+        self.relay_id = relay_id or uuid.uuid4().hex[:12]
+        self.source = RelaySource()
+        self.server = None
+
+    def start(self, upstream_path):
+        if self.server:
+            return
+        if len(upstream_path) > MAX_RELAY_HOPS:
+            raise RuntimeError(f"Relay chain too long ({len(upstream_path) - 1} hops)")
+        if self.relay_id in upstream_path:
+            raise RuntimeError("Relay loop detected")
+        server = StreamServer(
+            self.source,
+            port=self.port,
+            # 生フレームがないため縮小レンディションは提供しない
+            renditions=[Rendition("main")],
+            name="WebCamShare Relay",
+            server_id=self.relay_id,
+            upstream_path=upstream_path,
+        )
+        server.start()
+        self.server = server
+        print(f"Relay started on port {self.port} ({len(server.path) - 1} hops from origin)")
+
+    def publish(self, jpeg, upstream_delay_ms=0.0):
+        self.source.publish(jpeg, upstream_delay_ms)
+
+    def stop(self):
+        if self.server:
+            self.server.stop()
+            self.server = None
+            print("Relay stopped")
@@ -0,0 +1,96 @@
+import time
+from sender.shm import host_id
+from utils.shm_ring import ShmRingReader
+from .client import StreamClient
+
+
+def shm_target(server):
+    """ディスカバリー応答の送信元が同じホストで共有メモリを公開していれば、その情報を返す
+
+    共有メモリはカメラ解像度の生フレームなので、main 以外のレンディションを選んでいれば使わない。
+    """
+    if (server.get("rendition") or {}).get("name", "main") != "main":
+        return None
+    shm = server.get("shm")
+    if shm and shm.get("host") == host_id():
+        return shm
+    return None
+
+
+class ShmClient:
+    """同じホストの送信元から共有メモリ経由でフレームを受け取る（StreamClient互換）
+
+    デコードは行わず、共有メモリから1回だけコピーして渡す。コピーの後で上書きされていないかを確かめ、
+    上書きされていれば（受信側の処理が追いついていない）そのフレームは渡さずに破棄する。
+    """
+
+    POLL_INTERVAL = 0.002
+    # 毎回新しいバッファにコピーして渡す（受け取った側でのコピーは不要）
+    reuses_buffers = False
+
+    def __init__(self, name, path=None, frame_timeout=StreamClient.FRAME_TIMEOUT):
+        self.name = name
+        self.frame_timeout = frame_timeout
+        self.url = f"shm://{name}"
+        self.reader = None
+        self.running = False
+        # StreamClient と同じ属性（共有メモリは直結なのでリレー段数0）
+        self.via = []
+        self.path = list(path or [])
+        self.hops = 0
+        self.relay_delay_ms = 0.0
+        self.frames_received = 0
+        self.bytes_received = 0
+        self.decode_ms = 0.0
+        # コピー中に上書きされて破棄したフレーム数（受信側の処理が追いついていない）
+        self.frames_torn = 0
+
+    def start(self):
+        try:
+            self.reader = ShmRingReader(self.name)
+        except (OSError, ValueError) as e:
+            raise ConnectionError(f"Could not attach {self.url}: {e}")
+        if self.reader.closed:
+            self.reader.close()
+            self.reader = None
+            raise ConnectionError(f"{self.url} is closed")
+        self.reader.touch()
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def read_frames(self, decode=True):
+        """(jpeg, frame) を順に返す（jpeg は送信側が書かなければNone）"""
+        reader = self.reader
+        if reader is None:
+            return
+        last = 0
+        deadline = time.monotonic() + self.frame_timeout
+        try:
+            while self.running:
+                reader.touch()
+                item = reader.read(last)
+                if item is None:
+                    if reader.closed:
+                        break
+                    if time.monotonic() > deadline:
+                        raise ConnectionError(f"No frames from {self.url} for {self.frame_timeout:.0f} s")
+                    time.sleep(self.POLL_INTERVAL)
+                    continue
+                deadline = time.monotonic() + self.frame_timeout
+                seq, timestamp, view, jpeg_view = item
+                last = seq
+                del item
+                frame = view.copy()
+                jpeg = bytes(jpeg_view) if jpeg_view is not None else None
+                del view, jpeg_view
+                if not reader.valid(seq):
+                    self.frames_torn += 1
+                    continue
+                self.frames_received += 1
+                self.bytes_received += frame.nbytes
+                yield jpeg, frame
+        finally:
+            self.reader = None
+            reader.close()
@@ -0,0 +1,148 @@
+import time
+from urllib.parse import urlsplit
+import requests
+from utils import tracing
+from utils.network import TILES_HEADER, SESSION_HEADER, RELAY_DELAY_HEADER
+from .client import StreamClient
+
+
+def tiles_url(url):
+    """ストリームURLをタイル差分（?mode=tiles）の要求にする"""
+    return url + ("&" if "?" in url else "?") + "mode=tiles"
+
+
+class TileClient(StreamClient):
+    """タイル差分ストリーム（?mode=tiles）を受信し、出力バッファへタイルを貼り込む（StreamClient互換）
+
+    キーフレームで出力バッファを置き換え、差分のモザイクから変化したタイルだけを上書きする。
+    read_frames は常に出力バッファ全体を返す（jpeg はキーフレームのときだけ、差分ではNone）。
+    """
+
+    reuses_buffers = True
+
+    def __init__(self, url, via=None, frame_timeout=StreamClient.FRAME_TIMEOUT):
+        super().__init__(url, via=via, frame_timeout=frame_timeout)
+        self.session = None
+        self.canvas = None
+        # 統計: 受け取ったキーフレーム数・差分数・貼り込んだタイル数
+        self.keyframes = 0
+        self.deltas = 0
+        self.tiles_patched = 0
+        self._keyframe_requested = False
+
+    def start(self):
+        super().start()
+        self.session = self.stream.headers.get(SESSION_HEADER)
+
+    def get_parts(self):
+        """(パートヘッダー, 本文) を順に返す（Content-Length で区切る）"""
+        if not self.stream:
+            return
+
+        chunks = self._iter_chunks()
+        deadline = time.monotonic() + self.frame_timeout
+        while True:
+            span = tracing.begin()
+            chunk = next(chunks, None)
+            if chunk is None or not self.running:
+                break
+            tracing.end("receive", span, cat="net")
+            self._buffer.extend(chunk)
+
+            while True:
+                start = self._buffer.find(b'--frame\r\n')
+                end = self._buffer.find(b'\r\n\r\n', start) if start != -1 else -1
+                if end == -1:
+                    break
+                headers = {}
+                for line in bytes(self._buffer[start + 9:end]).decode('latin-1').split('\r\n'):
+                    key, _, value = line.partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get('content-length', ''))
+                except ValueError:
+                    raise ConnectionError(f"Missing Content-Length from {self.url}")
+                body_start = end + 4
+                if len(self._buffer) < body_start + length:
+                    break
+                body = bytes(self._buffer[body_start:body_start + length])
+                del self._buffer[:body_start + length]
+                deadline = time.monotonic() + self.frame_timeout
+                if self.hops and RELAY_DELAY_HEADER.lower() in headers:
+                    try:
+                        self.relay_delay_ms = float(headers[RELAY_DELAY_HEADER.lower()])
+                    except ValueError:
+                        pass
+                self.frames_received += 1
+                self.bytes_received += length
+                yield headers, body
+
+            # データは届いているのにパートにならない
+            if time.monotonic() > deadline:
+                raise ConnectionError(f"No frames from {self.url} for {self.frame_timeout:.0f} s")
+
+    def read_frames(self, decode=True):
+        """(jpeg, frame) を順に返す（差分は貼り込みにデコードが要るため decode に関係なく常にデコード）"""
+        for headers, body in self.get_parts():
+            start = time.perf_counter()
+            if headers.get('content-type') == 'image/jpeg':
+                frame = self.decode(body, self.frames_received)
+                if frame is None:
+                    self._request_keyframe()
+                    continue
+                self.canvas = frame
+                self._keyframe_requested = False
+                self.keyframes += 1
+                jpg = body
+            else:
+                if not self._patch(headers.get(TILES_HEADER.lower(), ''), body):
+                    self._request_keyframe()
+                    continue
+                self.deltas += 1
+                jpg = None
+            self.decode_ms += ((time.perf_counter() - start) * 1000 - self.decode_ms) * 0.1
+            yield jpg, self.canvas
+
+    def _patch(self, header, body):
+        """差分のモザイクから出力バッファへタイルを貼り込む（キーフレームがまだ、または壊れていればFalse）"""
+        try:
+            size, tile, mosaic_cols, *tiles = header.split()
+            width, height = (int(v) for v in size.split('x'))
+            tile, mosaic_cols = int(tile), int(mosaic_cols)
+            positions = [tuple(int(v) for v in pos.split(',')) for pos in tiles]
+            # 変化がなければモザイクの列数は0
+            if tile <= 0 or (positions and mosaic_cols <= 0) or any(
+                    len(pos) != 2 or not (0 <= pos[0] * tile < width and 0 <= pos[1] * tile < height)
+                    for pos in positions):
+                raise ValueError(header)
+        except ValueError:
+            return False
+        if self.canvas is None or self.canvas.shape[:2] != (height, width):
+            return False
+        if not positions:
+            return True
+        mosaic = self.decode(body, self.frames_received)
+        rows = -(-len(positions) // mosaic_cols)
+        if mosaic is None or mosaic.shape[0] < rows * tile or mosaic.shape[1] < mosaic_cols * tile:
+            return False
+        span = tracing.begin()
+        for i, (col, row) in enumerate(positions):
+            x, y = col * tile, row * tile
+            mx, my = (i % mosaic_cols) * tile, (i // mosaic_cols) * tile
+            # 端のタイルは出力バッファに収まる分だけ
+            w, h = min(tile, width - x), min(tile, height - y)
+            self.canvas[y:y + h, x:x + w] = mosaic[my:my + h, mx:mx + w]
+        tracing.end("tile patch", span, self.frames_received)
+        self.tiles_patched += len(positions)
+        return True
+
+    def _request_keyframe(self):
+        """送信元へキーフレームを要求する（届くまでは1回だけ）"""
+        if self._keyframe_requested or not self.session:
+            return
+        self._keyframe_requested = True
+        url = urlsplit(self.url)
+        try:
+            requests.get(f"{url.scheme}://{url.netloc}/keyframe?session={self.session}", timeout=1.0)
+        except requests.RequestException as e:
+            print(f"Keyframe request failed: {e}")
@@ -1,14 +1,28 @@
 import customtkinter as ctk
 import cv2
 import threading
+import time
+import uuid
 from PIL import Image, ImageTk
 from .client import StreamClient
+from .frame_bus import FrameBus
+from .reconnect import ReconnectingClient, SenderTarget
+from .shm_client import ShmClient, shm_target
 from .virtual_cam import VirtualCamera
-from utils.network import ServerDiscovery
+from .relay import StreamRelay
+from utils.network import ServerDiscovery, rank_servers
+from utils.sender_cache import SenderCache
+from utils.recorder import StreamRecorder
+from utils import tracing, thread_roles
+from utils.stats import StageTimes
+from utils.stats_panel import StatsPanel
 from utils.theme import Theme
 import tkinter as tk
 
 class ReceiverApp(ctk.CTkFrame):
+    # プレビューの描画はUIスレッドを使うため、仮想カメラより低いレートに抑える
+    PREVIEW_FPS = 15
+
     def __init__(self, master, on_back=None):
         super().__init__(master, fg_color=Theme.BG_DARK)
         self.master = master
@@ -17,18 +31,36 @@ class ReceiverApp(ctk.CTkFrame):
 
         self.client = None
         self.virtual_cam = None
+        # 受信スレッドは受け取ったフレームを流すだけで、出力先はそれぞれの購読スレッドで動く
+        self.bus = None
+        self.relay_subscriber = None
+        self.recorder_subscriber = None
         self.is_running = False
         self.thread = None
         self.photo_image = None
         self.discovered_servers = []
+        self.selected_server = None
+        self.discovery = None
+        self.sender_cache = SenderCache()
+        self.relay = None
+        self.recorder = None
+        self.relay_id = uuid.uuid4().hex[:12]
         self._pending_frame = False
         self._canvas_size = (640, 360)
         self._connecting = False
         self._cancel_connect = False
         self.preview_enabled = True
+        self.stage_times = StageTimes()
 
         self.setup_ui()
 
+        # 既知の送信元があれば入力欄に反映し、起動直後に問い合わせる
+        known = self.sender_cache.entries()
+        if known:
+            self.entry_ip.delete(0, "end")
+            self.entry_ip.insert(0, known[0]['ip'])
+            self.after(100, self.discover_servers)
+
     def setup_ui(self):
         # Header section
         self.frame_header = ctk.CTkFrame(self, fg_color="transparent")
@@ -141,6 +173,35 @@ class ReceiverApp(ctk.CTkFrame):
         )
         self.btn_connect.pack(side="right", padx=Theme.PAD_XS)
 
+        # 受信ストリームを再エンコードなしで再配信（ツリー状の配信）
+        self.relay_var = ctk.BooleanVar(value=False)
+        self.check_relay = ctk.CTkCheckBox(
+            self.frame_controls_inner,
+            text="Relay",
+            variable=self.relay_var,
+            font=Theme.FONT_SMALL,
+            text_color=Theme.TEXT_SECONDARY,
+            fg_color=Theme.ACCENT,
+            hover_color=Theme.ACCENT_HOVER,
+            corner_radius=Theme.RADIUS_SM,
+            command=self._on_relay_toggled
+        )
+        self.check_relay.pack(side="right", padx=Theme.PAD_SM)
+
+        self.record_var = ctk.BooleanVar(value=False)
+        self.check_record = ctk.CTkCheckBox(
+            self.frame_controls_inner,
+            text="Record",
+            variable=self.record_var,
+            font=Theme.FONT_SMALL,
+            text_color=Theme.TEXT_SECONDARY,
+            fg_color=Theme.ACCENT,
+            hover_color=Theme.ACCENT_HOVER,
+            corner_radius=Theme.RADIUS_SM,
+            command=self._on_record_toggled
+        )
+        self.check_record.pack(side="right", padx=Theme.PAD_SM)
+
         # Status indicator
         self.frame_status = ctk.CTkFrame(self, fg_color="transparent")
         self.frame_status.pack(fill="x", padx=Theme.PAD_LG, pady=Theme.PAD_XS)
@@ -153,6 +214,10 @@ class ReceiverApp(ctk.CTkFrame):
         )
         self.label_status.pack(side="left")
 
+        # 性能パネル（展開中のみ1秒ごとに更新）
+        self.stats_panel = StatsPanel(self, self._get_stats_rows, counters=self._get_stats_counters)
+        self.stats_panel.pack(fill="x", padx=Theme.PAD_LG, pady=Theme.PAD_XS)
+
         # Preview area
         self.frame_preview = ctk.CTkFrame(
             self, 
@@ -211,6 +276,40 @@ class ReceiverApp(ctk.CTkFrame):
         self.preview_canvas.coords(self.preview_text, event.width // 2, event.height // 2)
         self._canvas_size = (event.width, event.height)
 
+    def _get_stats_counters(self):
+        client, vcam = self.client, self.virtual_cam
+        return {
+            "frames": client.frames_received if client else 0,
+            "bytes": client.bytes_received if client else 0,
+            "output": vcam.frames_sent if vcam else 0,
+        }
+
+    def _get_stats_rows(self, rates):
+        client, vcam = self.client, self.virtual_cam
+        if not client or not self.is_running:
+            return [("status", "not connected")]
+        frame_kb = rates["bytes"] / rates["frames"] / 1024 if rates["frames"] else 0.0
+        bus = self.bus
+        drops = (bus.decode_failures if bus else 0) + (self.recorder.frames_dropped if self.recorder else 0)
+        # HTTPはバスで、タイル差分はクライアントでデコードする（どちらか一方だけが0以外）
+        decode_ms = client.decode_ms + (bus.decode_ms if bus else 0.0)
+        skipped = " ".join(f"{s.name} {s.skipped}" for s in bus.subscribers) if bus else ""
+        return [
+            ("input", f"{rates['frames']:.1f} fps"),
+            ("output", f"{rates['output']:.1f} fps"),
+            ("decode", f"{decode_ms:.1f} ms" if isinstance(client.client, StreamClient) else "shared memory"),
+            ("vcam", f"{vcam.send_ms:.1f} ms" if vcam else "-"),
+            ("preview", f"{self.stage_times.get('preview'):.1f} ms"),
+            ("relay", f"{client.relay_delay_ms:.0f} ms / {client.hops} hops"),
+            ("bitrate", f"{rates['bytes'] * 8 / 1e6:.2f} Mbps"),
+            ("frame", f"{frame_kb:.0f} KB"),
+            ("drops", str(drops)),
+            ("skipped", skipped or "-"),
+            ("reconnects", str(client.reconnects) + (f" (last {client.recovery_s:.1f} s)"
+                                                      if client.recovery_s is not None else "")),
+            ("held", str(vcam.frames_held) if vcam else "-"),
+        ]
+
     def toggle_connection(self):
         if not self.is_running and not self._connecting:
             self.start_receiving()
@@ -219,46 +318,81 @@ class ReceiverApp(ctk.CTkFrame):
 
     def discover_servers(self):
         """LANでサーバーを自動検出"""
+        if self.discovery:
+            return
         self.btn_discover.configure(state="disabled", text="🔍  Searching...")
         self.label_status.configure(text="● Searching for servers...", text_color=Theme.STATUS_WARNING)
+        self.discovered_servers = []
+        self.discovery = ServerDiscovery(timeout=3.0, cache=self.sender_cache)
+        discovery = self.discovery
         
+        def on_found(server):
+            self.master.after(0, lambda: self._on_server_found(server))
+
         def search():
-            discovery = ServerDiscovery(timeout=3.0)
-            servers = discovery.discover()
+            servers = discovery.discover(on_found=on_found)
             self.master.after(0, lambda: self.update_server_list(servers))
         
         threading.Thread(target=search, daemon=True).start()
+
+    def _format_server(self, server):
+        text = f"{server['name']} - {server['ip']}:{server['port']}"
+        rendition = server.get('rendition')
+        if rendition:
+            text += f" [{rendition['name']}, {server.get('rtt_ms', 0):.0f} ms]"
+        return text
+
+    def _on_server_found(self, server):
+        """検出のたびにドロップダウンへ逐次追加"""
+        if self.discovery is None or server in self.discovered_servers:
+            return
+        self.discovered_servers.append(server)
+        server_names = [self._format_server(s) for s in self.discovered_servers]
+        self.server_dropdown.configure(values=server_names)
+        if len(server_names) == 1:
+            self.server_dropdown.set(server_names[0])
+        self.label_status.configure(
+            text=f"● Searching... {len(server_names)} found",
+            text_color=Theme.STATUS_WARNING
+        )
     
     def update_server_list(self, servers):
-        """検出結果をUIに反映"""
+        """検出結果をUIに反映（RTT・負荷・能力でランク付けし、最適な送信元に自動接続）"""
+        self.discovery = None
         self.btn_discover.configure(state="normal", text="🔍  Auto Discover")
-        self.discovered_servers = servers
+        # 自分のリレーとその下流は候補から除外（ループ防止）
+        self.discovered_servers = rank_servers(servers, exclude_id=self.relay_id)
+        servers = self.discovered_servers
         
         if servers:
-            server_names = [f"{s['name']} - {s['ip']}:{s['port']}" for s in servers]
+            server_names = [self._format_server(s) for s in self.discovered_servers]
             self.server_dropdown.configure(values=server_names)
+            if self.is_running or self._connecting:
+                return
             self.server_dropdown.set(server_names[0])
-            
+
+            best = self.discovered_servers[0]
+            self._select_server(best)
             if len(servers) == 1:
-                self.entry_ip.delete(0, "end")
-                self.entry_ip.insert(0, servers[0]['ip'])
-                self.label_status.configure(
-                    text=f"● Found: {servers[0]['name']} — Connecting...", 
-                    text_color=Theme.STATUS_SUCCESS
-                )
-                self.master.after(100, self.start_receiving)
+                text = f"● Found: {best['name']} — Connecting..."
             else:
-                self.label_status.configure(
-                    text=f"● {len(servers)} servers found — Select from dropdown", 
-                    text_color=Theme.STATUS_SUCCESS
-                )
+                text = f"● {len(servers)} servers found — Connecting to best: {best['name']}"
+            self.label_status.configure(text=text, text_color=Theme.STATUS_SUCCESS)
+            self.master.after(100, self.start_receiving)
         else:
+            if self.is_running or self._connecting:
+                return
             self.server_dropdown.configure(values=["No servers found"])
             self.server_dropdown.set("No servers found")
             self.label_status.configure(
                 text="● No servers found — Enter IP manually", 
                 text_color=Theme.STATUS_WARNING
             )
+
+    def _select_server(self, server):
+        self.selected_server = server
+        self.entry_ip.delete(0, "end")
+        self.entry_ip.insert(0, server['ip'])
     
     def on_server_selected(self, choice):
         """ドロップダウンでサーバー選択時にIPを入力欄に反映して接続"""
@@ -267,10 +401,8 @@ class ReceiverApp(ctk.CTkFrame):
         
         # 選択されたサーバーを検索
         for server in self.discovered_servers:
-            display_name = f"{server['name']} - {server['ip']}:{server['port']}"
-            if display_name == choice:
-                self.entry_ip.delete(0, "end")
-                self.entry_ip.insert(0, server['ip'])
+            if self._format_server(server) == choice:
+                self._select_server(server)
                 self.label_status.configure(
                     text=f"● Selected: {server['name']} — Connecting...", 
                     text_color=Theme.STATUS_SUCCESS
@@ -282,6 +414,28 @@ class ReceiverApp(ctk.CTkFrame):
                     self.master.after(100, self.start_receiving)
                 break
 
+    def _stream_url(self, ip):
+        """入力IPが検出済みサーバーならそのポートと選択レンディションのURLを使う"""
+        server = self.selected_server
+        if server and server['ip'] == ip:
+            path = server.get('rendition', {}).get('path', '/stream.mjpg')
+            return f"http://{ip}:{server['port']}{path}"
+        return f"http://{ip}:8000/stream.mjpg"
+
+    def _open_client(self, url, server):
+        """同じホストの送信元なら共有メモリ、使えなければHTTPで接続したクライアントを返す"""
+        shm = shm_target(server) if server else None
+        if shm:
+            client = ShmClient(shm['name'], path=server.get('path'))
+            try:
+                client.start()
+                return client
+            except ConnectionError as e:
+                print(f"Shared memory unavailable, using HTTP: {e}")
+        client = StreamClient(url, via=[self.relay_id] if self.relay_var.get() else None)
+        client.start()
+        return client
+
     def start_receiving(self):
         if self._connecting or self.is_running:
             return
@@ -289,7 +443,13 @@ class ReceiverApp(ctk.CTkFrame):
         self._cancel_connect = False
 
         ip = self.entry_ip.get()
-        url = f"http://{ip}:8000/stream.mjpg"
+        url = self._stream_url(ip)
+        server = self.selected_server if self.selected_server and self.selected_server['ip'] == ip else None
+        # 切断・停止したら再検出したアドレスも含めて張り直す
+        target = SenderTarget(url, server, cache=self.sender_cache)
+
+        def connect(attempt):
+            return self._open_client(*target.next(attempt))
 
         self.btn_connect.configure(text="⏳  Connecting...", state="disabled")
         self.label_status.configure(text="● Connecting...", text_color=Theme.STATUS_WARNING)
@@ -298,7 +458,7 @@ class ReceiverApp(ctk.CTkFrame):
             client = None
             vcam = None
             try:
-                client = StreamClient(url)
+                client = ReconnectingClient(connect, on_state=self._on_stream_state)
                 client.start()
                 
                 # Initialize Virtual Camera (Standard HD resolution)
@@ -333,6 +493,10 @@ class ReceiverApp(ctk.CTkFrame):
 
         self.client = client
         self.virtual_cam = vcam
+        self.bus = FrameBus()
+        # 仮想カメラは送信元のフレーム間隔どおりに出す（待機すると次のフレームを取りこぼす）
+        self.bus.subscribe("vcam", lambda item: vcam.send_frame(item.frame, item.seq, pace=False))
+        self.bus.subscribe("preview", self._prepare_preview, max_fps=self.PREVIEW_FPS, role="ui")
         self.is_running = True
         self._connecting = False
         self.btn_connect.configure(
@@ -341,11 +505,35 @@ class ReceiverApp(ctk.CTkFrame):
             hover_color=Theme.ACCENT_DANGER_HOVER,
             state="normal"
         )
-        self.label_status.configure(text="● Connected — Streaming", text_color=Theme.STATUS_SUCCESS)
+        self._show_connected_status()
+        if self.relay_var.get():
+            self._start_relay()
+        if self.record_var.get():
+            self._start_recording()
         
         self.thread = threading.Thread(target=self.process_stream, daemon=True)
         self.thread.start()
 
+    def _show_connected_status(self):
+        client = self.client
+        status = "● Connected — Streaming"
+        if isinstance(client.client, ShmClient):
+            status += " (shared memory)"
+        if client.hops:
+            status += f" (via {client.hops} relay{'s' if client.hops > 1 else ''})"
+        self.label_status.configure(text=status, text_color=Theme.STATUS_SUCCESS)
+
+    def _on_stream_state(self, state):
+        """再接続の開始・復帰（受信スレッドから呼ばれる）"""
+        def update():
+            if not self.is_running or not self.client:
+                return
+            if state == "reconnecting":
+                self.label_status.configure(text="● Reconnecting...", text_color=Theme.STATUS_WARNING)
+            else:
+                self._show_connected_status()
+        self.master.after(0, update)
+
     def _on_connect_failed(self, error):
         self._connecting = False
         self._cancel_connect = False
@@ -357,13 +545,86 @@ class ReceiverApp(ctk.CTkFrame):
             state="normal"
         )
 
+    def _start_relay(self):
+        if self.relay or not self.client or not self.bus:
+            return
+        relay = StreamRelay(relay_id=self.relay_id)
+        try:
+            relay.start(self.client.path)
+        except Exception as e:
+            print(f"Relay start failed: {e}")
+            self.relay_var.set(False)
+            self.label_status.configure(text=f"● Relay error: {e}", text_color=Theme.STATUS_ERROR)
+            return
+        self.relay = relay
+        # リレーにはデコード前のJPEGをそのまま渡す
+        client = self.client
+        self.relay_subscriber = self.bus.subscribe(
+            "relay", lambda item: relay.publish(item.jpeg, client.relay_delay_ms), needs_frame=False,
+            role="network")
+
+    def _stop_relay(self):
+        if self.relay_subscriber:
+            self.bus.unsubscribe(self.relay_subscriber)
+            self.relay_subscriber = None
+        if self.relay:
+            self.relay.stop()
+            self.relay = None
+
+    def _on_relay_toggled(self):
+        """接続中でもリレーの開始・停止を切り替え可能"""
+        if not self.is_running:
+            return
+        if self.relay_var.get():
+            self._start_relay()
+        else:
+            self._stop_relay()
+
+    def _start_recording(self):
+        if self.recorder or not self.bus:
+            return
+        recorder = StreamRecorder(prefix="receiver")
+        try:
+            recorder.start()
+        except OSError as e:
+            print(f"Recording failed: {e}")
+            self.record_var.set(False)
+            return
+        self.recorder = recorder
+        self.recorder_subscriber = self.bus.subscribe(
+            "record", lambda item: recorder.write(item.jpeg), needs_frame=False)
+
+    def _stop_recording(self):
+        recorder = self.recorder
+        if not recorder:
+            return
+        if self.recorder_subscriber:
+            self.bus.unsubscribe(self.recorder_subscriber)
+            self.recorder_subscriber = None
+        self.recorder = None
+        # 残りの書き出しを待つためUIスレッド外で停止
+        threading.Thread(target=recorder.stop, daemon=True).start()
+
+    def _on_record_toggled(self):
+        if not self.is_running:
+            return
+        if self.record_var.get():
+            self._start_recording()
+        else:
+            self._stop_recording()
+
     def stop_receiving(self):
         if self._connecting:
             self._cancel_connect = True
         self.is_running = False
+        self._stop_relay()
+        self._stop_recording()
         if self.client:
             self.client.stop()
             self.client = None
+        if self.bus:
+            self.bus.stop(wait=False)
+            self.bus = None
         if self.virtual_cam:
             self.virtual_cam.stop()
             self.virtual_cam = None
@@ -384,58 +645,67 @@ class ReceiverApp(ctk.CTkFrame):
         if not self.client:
             return
 
-        for frame in self.client.get_frames():
+        thread_roles.assign("network", "receive")
+        client, bus = self.client, self.bus
+        # デコードは購読者がいればバスで1回だけ（共有メモリ・タイル差分はクライアントが生フレームを返す）
+        for jpg, frame in client.read_frames(decode=False):
             if not self.is_running:
                 break
-            
-            # Send to Virtual Camera
-            if self.virtual_cam:
-                self.virtual_cam.send_frame(frame)
-
-            # Skip frame if previous frame is still being processed
-            if self._pending_frame:
-                continue
-
-            # プレビュー無効時または最小化時はプレビュー処理をスキップ
-            if not self.preview_enabled or self._is_minimized():
-                if not self.preview_enabled:
-                    self.master.after(0, lambda: self._show_preview_message("Preview Disabled"))
-                else:
-                    self.master.after(0, lambda: self._show_preview_message("Minimized (Preview Paused)"))
-                import time
-                time.sleep(0.1)
-                continue
-            
-            # Process image in background thread for performance
-            try:
-                canvas_width, canvas_height = self._canvas_size
-                if canvas_width < 10:
-                    canvas_width = 640
-                if canvas_height < 10:
-                    canvas_height = 360
-                
-                h, w = frame.shape[:2]
-                ratio = min(canvas_width / w, canvas_height / h)
-                preview_width = int(w * ratio)
-                preview_height = int(h * ratio)
-                frame_resized = cv2.resize(frame, (preview_width, preview_height))
-                
-                # Convert to RGB
-                frame_rgb = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
-                
-                self._pending_frame = True
-                # Update Preview (run on main thread) - only PIL conversion and drawing
-                self.master.after(0, self._draw_preview, frame_rgb, canvas_width, canvas_height)
-            except Exception as e:
-                print(f"Preview processing error: {e}")
+            bus.publish(jpg, frame, client.frames_received, shared=client.reuses_buffers)
+
+    def _prepare_preview(self, item):
+        """プレビュー用に縮小・色変換して描画をUIスレッドへ渡す（プレビューの購読スレッド）"""
+        # Skip frame if previous frame is still being processed
+        if self._pending_frame or not self.is_running:
+            return
+
+        # プレビュー無効時または最小化時はプレビュー処理をスキップ
+        if not self.preview_enabled or self._is_minimized():
+            if not self.preview_enabled:
+                self.master.after(0, lambda: self._show_preview_message("Preview Disabled"))
+            else:
+                self.master.after(0, lambda: self._show_preview_message("Minimized (Preview Paused)"))
+            time.sleep(0.1)
+            return
+
+        frame, seq = item.frame, item.seq
+        try:
+            preview_start = time.perf_counter()
+            canvas_width, canvas_height = self._canvas_size
+            if canvas_width < 10:
+                canvas_width = 640
+            if canvas_height < 10:
+                canvas_height = 360
+
+            h, w = frame.shape[:2]
+            ratio = min(canvas_width / w, canvas_height / h)
+            preview_width = int(w * ratio)
+            preview_height = int(h * ratio)
+            span = tracing.begin()
+            frame_resized = cv2.resize(frame, (preview_width, preview_height))
+            tracing.end("preview resize", span, seq)
+
+            # Convert to RGB
+            span = tracing.begin()
+            frame_rgb = cv2.cvtColor(frame_resized, cv2.COLOR_BGR2RGB)
+            tracing.end("preview color convert", span, seq)
+
+            self.stage_times.since('preview_prepare', preview_start)
+            self._pending_frame = True
+            # Update Preview (run on main thread) - only PIL conversion and drawing
+            self.master.after(0, self._draw_preview, frame_rgb, canvas_width, canvas_height, seq)
+        except Exception as e:
+            print(f"Preview processing error: {e}")
 
-    def _draw_preview(self, frame_rgb, canvas_width, canvas_height):
+    def _draw_preview(self, frame_rgb, canvas_width, canvas_height, seq=None):
         """Draw pre-processed frame on canvas (runs on main thread)"""
         if not self.is_running:
             self._pending_frame = False
             return
         
         try:
+            draw_start = time.perf_counter()
+            span = tracing.begin()
             # Convert to PIL Image and PhotoImage (lightweight operations)
             image = Image.fromarray(frame_rgb)
             self.photo_image = ImageTk.PhotoImage(image)
@@ -446,6 +716,10 @@ class ReceiverApp(ctk.CTkFrame):
             x = canvas_width // 2
             y = canvas_height // 2
             self.preview_canvas.create_image(x, y, image=self.photo_image, tag="preview")
+            tracing.end("preview draw", span, seq)
+            # 準備（ワーカー）と描画（UIスレッド）の合計
+            self.stage_times.record('preview', self.stage_times.get('preview_prepare')
+                                    + (time.perf_counter() - draw_start) * 1000)
         except Exception as e:
             print(f"Preview error: {e}")
         finally:
@@ -479,4 +753,6 @@ class ReceiverApp(ctk.CTkFrame):
 
     def cleanup(self):
         """Clean up resources before destroying"""
+        if self.discovery:
+            self.discovery.stop()
         self.stop_receiving()
@@ -1,13 +1,31 @@
+import threading
+import time
 import pyvirtualcam
 import cv2
 import numpy as np
+from utils import tracing, thread_roles
 
 class VirtualCamera:
+    # 入力が途切れたら（再接続中など）この間は最後のフレームを出し続け、以降は代わりの画像を出す（s）
+    HOLD_LAST = 5.0
+
     def __init__(self, width=1280, height=720, fps=30):
         self.width = width
         self.height = height
         self.fps = fps
         self.cam = None
+        # 出力統計: 送出フレーム数と、送出処理（待機を除く）の時間（ms、移動平均）
+        self.frames_sent = 0
+        self.send_ms = 0.0
+        # 入力が途切れている間に代わりに出したフレーム数
+        self.frames_held = 0
+        self._lock = threading.Lock()
+        self._last_rgb = None
+        self._last_input = 0.0
+        self._last_send = 0.0
+        self._placeholder = None
+        self.running = False
+        self.thread = None
 
     def start(self):
         try:
@@ -16,19 +34,76 @@ class VirtualCamera:
             print(f'Virtual camera started: {self.cam.device}')
         except Exception as e:
             raise RuntimeError(f"Could not start virtual camera. Make sure OBS Virtual Camera is installed. Error: {e}")
+        # 入力が途切れても出力を止めない（止まるとビデオ会議アプリ側で黒画面・フリーズになる）
+        self.running = True
+        self.thread = threading.Thread(target=self._keepalive, daemon=True)
+        self.thread.start()
 
-    def send_frame(self, frame):
+    def send_frame(self, frame, seq=None, pace=True):
+        """1フレームを出力する（pace=False なら出力FPSに合わせた待機をしない。入力側で間隔が決まる場合用）"""
         if self.cam:
+            start = time.perf_counter()
             # pyvirtualcam expects RGB, OpenCV gives BGR
             # Also need to resize if frame size doesn't match
             if frame.shape[1] != self.width or frame.shape[0] != self.height:
+                span = tracing.begin()
                 frame = cv2.resize(frame, (self.width, self.height))
+                tracing.end("resize", span, seq)
             
+            span = tracing.begin()
             frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            self.cam.send(frame_rgb)
-            self.cam.sleep_until_next_frame()
+            tracing.end("color convert", span, seq)
+            span = tracing.begin()
+            with self._lock:
+                cam = self.cam
+                if cam is None:
+                    return
+                cam.send(frame_rgb)
+                self._last_rgb = frame_rgb
+                self._last_input = self._last_send = time.monotonic()
+            tracing.end("vcam send", span, seq)
+            self.frames_sent += 1
+            self.send_ms += ((time.perf_counter() - start) * 1000 - self.send_ms) * 0.1
+            if pace:
+                cam.sleep_until_next_frame()
+
+    def _keepalive(self):
+        """入力が2フレーム以上途切れたら、最後のフレーム（古すぎれば代わりの画像）をFPSどおりに出す"""
+        thread_roles.assign("output", "vcam-keepalive")
+        interval = 1.0 / self.fps
+        while self.running:
+            time.sleep(interval)
+            now = time.monotonic()
+            if now - self._last_send < interval * 2:
+                continue
+            with self._lock:
+                cam = self.cam
+                if cam is None:
+                    break
+                frame = self._last_rgb
+                if frame is None or now - self._last_input > self.HOLD_LAST:
+                    frame = self._get_placeholder()
+                cam.send(frame)
+                self._last_send = now
+            self.frames_held += 1
+
+    def _get_placeholder(self):
+        if self._placeholder is None:
+            frame = np.full((self.height, self.width, 3), 32, dtype=np.uint8)
+            text = "Reconnecting..."
+            scale = self.height / 480
+            (w, h), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, scale, 2)
+            cv2.putText(frame, text, ((self.width - w) // 2, (self.height + h) // 2),
+                        cv2.FONT_HERSHEY_SIMPLEX, scale, (200, 200, 200), 2, cv2.LINE_AA)
+            self._placeholder = frame
+        return self._placeholder
 
     def stop(self):
-        if self.cam:
-            self.cam.close()
-            self.cam = None
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        with self._lock:
+            cam, self.cam = self.cam, None
+        if cam:
+            cam.close()
@@ -0,0 +1,119 @@
+import collections
+import threading
+import numpy as np
+
+
+class BufferSlot:
+    """プール内の1バッファ（参照カウント付き）
+
+    acquire() した側が1つ参照を持ち、共有する相手ごとに retain()、
+    使い終わったら release() する。最後の release() でプールへ戻る。
+    """
+
+    __slots__ = ("pool", "array", "size", "refs", "generation")
+
+    def __init__(self, pool, array):
+        self.pool = pool
+        self.array = array
+        self.size = 0
+        self.refs = 0
+        self.generation = pool.generation
+
+    def retain(self):
+        with self.pool._lock:
+            self.refs += 1
+        return self
+
+    def release(self):
+        self.pool._release(self)
+
+    def view(self):
+        """有効な範囲の読み取り専用memoryview（コピーなし）"""
+        return memoryview(self.array)[:self.size].toreadonly()
+
+
+class BufferPool:
+    """使い回すバッファのプール
+
+    解放されたバッファは古い順（FIFO）に再利用するため、参照を持たずに
+    読んでいる相手にも数フレーム分の猶予がある。空きがなければ新しく確保し、
+    空きが max_free を超えた分は破棄してメモリ使用量を一定に保つ。
+    """
+
+    def __init__(self, factory, max_free=4):
+        self.factory = factory
+        self.max_free = max_free
+        self._free = collections.deque()
+        self._lock = threading.Lock()
+        # reset() ごとに増やし、古い形のバッファはプールへ戻さない
+        self.generation = 0
+        # 統計: 新規確保したバッファ数（定常状態では増えない）
+        self.allocations = 0
+
+    def acquire(self):
+        with self._lock:
+            slot = self._free.popleft() if self._free else None
+        if slot is None:
+            slot = BufferSlot(self, self.factory())
+            self.allocations += 1
+        slot.refs = 1
+        slot.size = 0
+        return slot
+
+    def _release(self, slot):
+        with self._lock:
+            slot.refs -= 1
+            if slot.refs == 0 and slot.generation == self.generation and len(self._free) < self.max_free:
+                self._free.append(slot)
+
+    def reset(self, factory):
+        """バッファの形が変わった（解像度変更など）。空きを捨てて作り直す"""
+        with self._lock:
+            self.factory = factory
+            self.generation += 1
+            self._free.clear()
+
+
+def frame_factory(width, height):
+    return lambda: np.empty((height, width, 3), dtype=np.uint8)
+
+
+class JpegPool(BufferPool):
+    """エンコード済みJPEGを格納するバイト列のプール
+
+    put() でエンコーダーの出力をプールのバッファへコピーする。
+    バッファは必要に応じて拡張し、以後はそのサイズのまま使い回す。
+    """
+
+    def __init__(self, initial_capacity=256 * 1024, max_free=8):
+        super().__init__(lambda: np.empty(initial_capacity, dtype=np.uint8), max_free)
+
+    def put(self, data):
+        slot = self.acquire()
+        src = np.frombuffer(data, dtype=np.uint8) if not isinstance(data, np.ndarray) else data.reshape(-1)
+        size = src.size
+        if size > slot.array.size:
+            # 余裕を持って拡張（参照が残る古い配列はGCに任せる）
+            slot.array = np.empty(int(size * 1.25), dtype=np.uint8)
+            self.allocations += 1
+        slot.array[:size] = src
+        slot.size = size
+        return slot
+
+
+class StaticBuffer:
+    """プール外のバイト列をBufferSlotと同じ使い方で扱う（release不要なデータ用）"""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def retain(self):
+        return self
+
+    def release(self):
+        pass
+
+    def view(self):
+        return self.data
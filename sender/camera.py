@@ -3,16 +3,45 @@ import sys
 
 # OpenCVの不要なログを抑制 (cv2をインポートする前に設定する必要がある)
 os.environ["OPENCV_LOG_LEVEL"] = "SILENT"
-os.environ["OPENCV_VIDEOIO_PRIORITY_LIST"] = "DSHOW,MSMF"
+if sys.platform == "win32":
+    os.environ["OPENCV_VIDEOIO_PRIORITY_LIST"] = "DSHOW,MSMF"
 os.environ["OPENCV_VIDEOIO_OBSENSOR_BACKEND_PRIORITY"] = "0"
 
 import cv2
+import numpy as np
 import threading
 import time
-import pythoncom
+from .buffers import BufferPool, JpegPool, frame_factory
+from .encoders import JpegOptions, get_encoder, select_encoder
+from utils import tracing, thread_roles
+
+if sys.platform == "win32":
+    import pythoncom
+
+# Linux: sysfs列挙結果のキャッシュ（/dev のホットプラグで無効化）
+_v4l2_cache = None
+
+def _get_v4l2_cameras():
+    global _v4l2_cache
+    if _v4l2_cache is None:
+        from .v4l2 import V4L2CameraCache
+        _v4l2_cache = V4L2CameraCache()
+    return _v4l2_cache.get_devices()
+
+def get_capture_backend():
+    """OS別のOpenCVキャプチャバックエンド"""
+    if sys.platform == "win32":
+        # DirectShowを使用（名前のインデックスと一致させるため）
+        return cv2.CAP_DSHOW
+    if sys.platform.startswith("linux"):
+        return cv2.CAP_V4L2
+    return cv2.CAP_ANY
 
 def get_camera_names():
     """DirectShowのインデックス順にカメラ名を取得する"""
+    if sys.platform.startswith("linux"):
+        return [device['name'] for device in _get_v4l2_cameras()]
+
     devices = []
     
     # 1. pygrabber (DirectShow Graph) を使用
@@ -50,6 +79,10 @@ def get_available_cameras():
     # DirectShowバックエンドでのデバイス名リストを取得
     # 一台ずつVideoCaptureを開くと非常に遅く、LEDが点滅するため、
     # システムのデバイス一覧をそのまま信頼する。
+    if sys.platform.startswith("linux"):
+        # Linuxのカメラ番号は /dev/videoN の N（メタデータ用ノードを除くため連番にならない）
+        return [{'id': d['id'], 'name': d['name']} for d in _get_v4l2_cameras()]
+
     device_names = get_camera_names()
 
     cameras = []
@@ -62,7 +95,8 @@ def get_available_cameras():
     return cameras
 
 class Camera:
-    def __init__(self, camera_id=0, width=1280, height=720):
+    def __init__(self, camera_id=0, width=1280, height=720, quality=85, encoder="auto", jpeg_options=None,
+                 filters=None):
         self.camera_id = camera_id
         self.width = width
         self.height = height
@@ -70,19 +104,37 @@ class Camera:
         self.running = False
         self.thread = None
         self.current_frame = None
+        # フレームとJPEGは参照カウント付きのプールバッファ（毎フレームの確保を避ける）
+        self._frame_pool = BufferPool(frame_factory(width, height))
+        self._frame_slot = None
+        self._jpeg_pool = JpegPool()
+        self._jpeg_slot = None
+        self.frame_seq = 0
         self.lock = threading.Lock()
+        self._first_frame = threading.Event()
+
+        # 実測値（ディスカバリー応答の負荷情報に使用）
+        self.fps = 0.0
+        self.encode_ms = 0.0
+        self._last_capture_time = None
 
-        # Zero-Copy設計: JPEG圧縮済みバッファ
-        self._jpeg_buffer = None
         self._jpeg_lock = threading.Lock()
-        self._encode_params = [cv2.IMWRITE_JPEG_QUALITY, 85]
+        self.jpeg_options = jpeg_options or JpegOptions(quality=quality)
+        # "auto" は最初のフレームでベンチマークして選ぶ
+        self.jpeg_encoder = None if encoder == "auto" else get_encoder(encoder)
+        if encoder != "auto" and self.jpeg_encoder is None:
+            raise RuntimeError(f"JPEG encoder '{encoder}' is not available")
+
+        # エンコード済みJPEGの購読者（録画など）。キャプチャスレッドから呼ばれるため軽量であること
+        self._listeners = ()
+        # エンコード前に通す画像処理（utils.filters.FilterPipeline、Noneなら何もしない）
+        self.filters = filters
 
     def start(self):
         if self.running:
             return
 
-        # DirectShowを使用（名前のインデックスと一致させるため）
-        self.cap = cv2.VideoCapture(self.camera_id, cv2.CAP_DSHOW)
+        self.cap = cv2.VideoCapture(self.camera_id, get_capture_backend())
         
         if self.cap.isOpened():
             # バッファサイズを最小にして遅延を抑制
@@ -92,6 +144,7 @@ class Camera:
             self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
             self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
             print(f"Camera opened at: {self.width}x{self.height}")
+            self._frame_pool.reset(frame_factory(self.width, self.height))
 
         if not self.cap.isOpened():
             raise RuntimeError(f"Could not open camera {self.camera_id}")
@@ -106,21 +159,110 @@ class Camera:
             self.thread.join()
         if self.cap:
             self.cap.release()
+        with self.lock:
+            frame_slot, self._frame_slot = self._frame_slot, None
+            self.current_frame = None
+        with self._jpeg_lock:
+            jpeg_slot, self._jpeg_slot = self._jpeg_slot, None
+        for slot in (frame_slot, jpeg_slot):
+            if slot:
+                slot.release()
 
     def _update(self):
+        thread_roles.assign("capture", f"capture-{self.camera_id}")
+        slot = None
         while self.running:
-            ret, frame = self.cap.read()
+            span = tracing.begin()
+            if slot is None:
+                slot = self._frame_pool.acquire()
+            # プールのバッファへ直接読み込む（サイズが合わなければOpenCVが新しく確保する）
+            ret, frame = self.cap.read(image=slot.array)
             if ret:
+                if frame is not slot.array:
+                    # 解像度が変わった: 以後はこのサイズで確保する
+                    h, w = frame.shape[:2]
+                    self._frame_pool.reset(frame_factory(w, h))
+                    slot.array = frame
+                seq = self.frame_seq + 1
+                timestamp = time.time()
+                tracing.end("capture", span, seq)
+                self._update_fps()
+                if self.filters:
+                    # 処理結果はキャプチャしたプールのバッファへ戻す（公開・共有の流れは変えない）
+                    filtered = self.filters.process(frame, seq)
+                    if filtered is not frame:
+                        np.copyto(frame, filtered)
+                if self.jpeg_encoder is None:
+                    try:
+                        self.jpeg_encoder = select_encoder(frame, self.jpeg_options)
+                    except Exception as e:
+                        # 選択に失敗してもキャプチャは止めない
+                        print(f"JPEG encoder selection failed, using cv2: {e}")
+                        self.jpeg_encoder = get_encoder("cv2")
                 # JPEG圧縮をカメラスレッドで事前実行（メインスレッドの負荷軽減）
-                ret_enc, jpeg = cv2.imencode('.jpg', frame, self._encode_params)
-                if ret_enc:
+                span = tracing.begin()
+                encode_start = time.perf_counter()
+                encoded = self.jpeg_encoder.encode_buffer(frame, self.jpeg_options)
+                jpeg_slot = self._jpeg_pool.put(encoded) if encoded is not None and len(encoded) else None
+                encode_ms = (time.perf_counter() - encode_start) * 1000
+                self.encode_ms = self.encode_ms * 0.9 + encode_ms * 0.1
+                tracing.end("encode", span, seq)
+                span = tracing.begin()
+                if jpeg_slot:
                     with self._jpeg_lock:
-                        self._jpeg_buffer = jpeg.tobytes()
+                        old_jpeg, self._jpeg_slot = self._jpeg_slot, jpeg_slot
+                    if old_jpeg:
+                        old_jpeg.release()
                 with self.lock:
+                    old_frame, self._frame_slot = self._frame_slot, slot
                     self.current_frame = frame
+                    self.frame_seq = seq
+                if old_frame:
+                    old_frame.release()
+                slot = None
+                # 公開後に通知する（購読側が frame_seq・最新フレームを参照できるように）
+                if jpeg_slot and self._listeners:
+                    view = jpeg_slot.view()
+                    for listener in self._listeners:
+                        listener(view, timestamp)
+                tracing.end("publish", span, seq)
+                self._first_frame.set()
             else:
                 time.sleep(0.1)
 
+    def _update_fps(self):
+        """キャプチャ間隔から実効FPSを指数移動平均で更新"""
+        now = time.monotonic()
+        if self._last_capture_time is not None:
+            interval = now - self._last_capture_time
+            if interval > 0:
+                self.fps = self.fps * 0.9 + (1.0 / interval) * 0.1 if self.fps else 1.0 / interval
+        self._last_capture_time = now
+
+    def wait_first_frame(self, timeout=5.0):
+        """最初のフレームがエンコードされるまで待つ（切り替え前の準備完了確認）"""
+        return self._first_frame.wait(timeout)
+
+    def get_listeners(self):
+        return self._listeners
+
+    def add_listener(self, callback):
+        """エンコード済みJPEGごとに callback(jpeg, timestamp) を呼ぶ
+
+        jpeg は読み取り専用memoryviewで、呼び出し中のみ有効（保持する場合はコピーする）。
+        timestamp はキャプチャ時刻（UNIX秒）。
+        """
+        self._listeners = self._listeners + (callback,)
+
+    def remove_listener(self, callback):
+        self._listeners = tuple(l for l in self._listeners if l != callback)
+
+    def get_load(self):
+        """エンコードがフレーム間隔に占める割合（0.0〜1.0）"""
+        if not self.fps:
+            return 0.0
+        return min(1.0, self.encode_ms * self.fps / 1000.0)
+
     def get_frame(self):
         """フレームのコピーを返す（外部で変更する場合用）"""
         with self.lock:
@@ -129,15 +271,28 @@ class Camera:
             return None
 
     def get_frame_view(self):
-        """プレビュー用（コピーなし参照、読み取り専用）"""
+        """プレビュー用（コピーなし参照、読み取り専用）
+
+        バッファは数フレーム後に再利用されるため、時間のかかる処理には acquire_frame() を使う。
+        """
         with self.lock:
             return self.current_frame
 
+    def acquire_frame(self):
+        """最新フレームのバッファを参照付きで返す（使用後に release()、なければNone）"""
+        with self.lock:
+            return self._frame_slot.retain() if self._frame_slot else None
+
+    def acquire_jpeg(self):
+        """最新JPEGのバッファを参照付きで返す（view() で読み取り専用memoryview、使用後に release()）"""
+        with self._jpeg_lock:
+            return self._jpeg_slot.retain() if self._jpeg_slot else None
+
     def get_jpeg_frame(self):
         """互換性維持用（非推奨）"""
         return self.get_jpeg_frame_direct()
 
     def get_jpeg_frame_direct(self):
-        """圧縮済みJPEGバッファを直接返す（Zero-Copy）"""
+        """圧縮済みJPEGのコピー（bytes）。配信には参照付きの acquire_jpeg() を使う"""
         with self._jpeg_lock:
-            return self._jpeg_buffer
+            return self._jpeg_slot.view().tobytes() if self._jpeg_slot else None
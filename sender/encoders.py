@@ -0,0 +1,276 @@
+import threading
+import time
+import cv2
+import numpy as np
+
+# クロマサブサンプリング名（"4:2:0" 形式も受け付ける）
+SUBSAMPLINGS = ("444", "422", "420")
+
+
+class JpegOptions:
+    """JPEGエンコード設定（バックエンド共通）"""
+
+    def __init__(self, quality=85, subsampling="420", progressive=False, optimize=False,
+                 restart_interval=0):
+        self.quality = quality
+        self.subsampling = subsampling.replace(":", "")
+        if self.subsampling not in SUBSAMPLINGS:
+            raise ValueError(f"Invalid subsampling: {subsampling}")
+        self.progressive = progressive
+        # ハフマンテーブル最適化（サイズ数%減、エンコードは遅くなる）
+        self.optimize = optimize
+        # リスタートマーカー間隔（MCU数、0で無効）。欠損時の破損範囲を限定する
+        self.restart_interval = restart_interval
+
+    def with_quality(self, quality):
+        return JpegOptions(quality, self.subsampling, self.progressive, self.optimize,
+                           self.restart_interval)
+
+    def key(self):
+        return (self.quality, self.subsampling, self.progressive, self.optimize, self.restart_interval)
+
+
+class JpegEncoder:
+    """エンコーダーバックエンドの基底クラス
+
+    encode() はBGR画像、encode_yuv() はI420（高さ×1.5行の平面形式、JPEGと同じ
+    フルレンジBT.601）を受け取り、JPEGのbytesを返す（失敗時はNone）。
+    """
+
+    name = None
+
+    @classmethod
+    def load(cls):
+        """バックエンドを初期化して返す（ライブラリがなければNone）"""
+        return cls()
+
+    def supports(self, options):
+        return True
+
+    def encode(self, frame, options):
+        raise NotImplementedError
+
+    def encode_buffer(self, frame, options):
+        """encode() と同じだが、bytesへのコピーを省いたバッファ（buffer protocol対応）を返す"""
+        return self.encode(frame, options)
+
+    def encode_yuv(self, yuv, width, height, options):
+        # 既定: BGRへ変換してからエンコード
+        y, u, v = _upsample_i420(yuv, width, height)
+        return self.encode(cv2.cvtColor(cv2.merge((y, v, u)), cv2.COLOR_YCrCb2BGR), options)
+
+
+def _upsample_i420(yuv, width, height):
+    """I420の各平面を取り出し、クロマをフル解像度へ（最近傍で）拡大する"""
+    y = yuv[:height]
+    u = yuv[height:height + height // 4].reshape(height // 2, width // 2)
+    v = yuv[height + height // 4:].reshape(height // 2, width // 2)
+    size = (width, height)
+    return (y,
+            cv2.resize(u, size, interpolation=cv2.INTER_NEAREST),
+            cv2.resize(v, size, interpolation=cv2.INTER_NEAREST))
+
+
+class Cv2Encoder(JpegEncoder):
+    name = "cv2"
+
+    _SAMPLING = {
+        "444": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_444", None),
+        "422": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_422", None),
+        "420": getattr(cv2, "IMWRITE_JPEG_SAMPLING_FACTOR_420", None),
+    }
+
+    def __init__(self):
+        self._params = {}
+
+    def supports(self, options):
+        # サンプリング指定は OpenCV 4.5.5 以降（既定の4:2:0なら指定不要）
+        return options.subsampling == "420" or self._SAMPLING[options.subsampling] is not None
+
+    def _get_params(self, options):
+        key = options.key()
+        params = self._params.get(key)
+        if params is None:
+            params = [cv2.IMWRITE_JPEG_QUALITY, options.quality]
+            if options.subsampling != "420":
+                params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, self._SAMPLING[options.subsampling]]
+            if options.progressive:
+                params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+            if options.optimize:
+                params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+            if options.restart_interval:
+                params += [cv2.IMWRITE_JPEG_RST_INTERVAL, options.restart_interval]
+            self._params[key] = params
+        return params
+
+    def encode(self, frame, options):
+        ret, jpeg = cv2.imencode('.jpg', frame, self._get_params(options))
+        return jpeg.tobytes() if ret else None
+
+    def encode_buffer(self, frame, options):
+        ret, jpeg = cv2.imencode('.jpg', frame, self._get_params(options))
+        return jpeg.reshape(-1) if ret else None
+
+
+class PillowEncoder(JpegEncoder):
+    name = "pillow"
+
+    _SAMPLING = {"444": 0, "422": 1, "420": 2}
+
+    def __init__(self):
+        from PIL import Image
+        self._image = Image
+
+    @classmethod
+    def load(cls):
+        try:
+            return cls()
+        except ImportError:
+            return None
+
+    def _save(self, image, options):
+        import io
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=options.quality,
+                   subsampling=self._SAMPLING[options.subsampling],
+                   progressive=options.progressive, optimize=options.optimize,
+                   restart_marker_blocks=options.restart_interval)
+        return out.getvalue()
+
+    def encode(self, frame, options):
+        return self._save(self._image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)), options)
+
+    def encode_yuv(self, yuv, width, height, options):
+        # YCbCrのまま渡し、RGBへの往復変換を省く
+        ycbcr = cv2.merge(_upsample_i420(yuv, width, height))
+        return self._save(self._image.frombytes("YCbCr", (width, height), ycbcr.tobytes()), options)
+
+
+class TurboJpegEncoder(JpegEncoder):
+    """libjpeg-turbo の直接呼び出し（PyTurboJPEG がインストールされている場合）"""
+
+    name = "turbojpeg"
+
+    def __init__(self):
+        import turbojpeg
+        self._module = turbojpeg
+        self._tj = turbojpeg.TurboJPEG()
+        self._sampling = {"444": turbojpeg.TJSAMP_444, "422": turbojpeg.TJSAMP_422,
+                          "420": turbojpeg.TJSAMP_420}
+
+    @classmethod
+    def load(cls):
+        try:
+            return cls()
+        except (ImportError, OSError, RuntimeError, AttributeError):
+            # モジュールはあっても libturbojpeg が見つからない場合や、
+            # 同名の別パッケージ（TurboJPEG クラスを持たない turbojpeg）の場合がある
+            return None
+
+    def supports(self, options):
+        # TurboJPEG API 2 はリスタート間隔を指定できず、ハフマン最適化はプログレッシブ時のみ
+        return not options.restart_interval and (options.progressive or not options.optimize)
+
+    def _flags(self, options):
+        return self._module.TJFLAG_PROGRESSIVE if options.progressive else 0
+
+    def encode(self, frame, options):
+        return self._tj.encode(frame, quality=options.quality,
+                               jpeg_subsample=self._sampling[options.subsampling],
+                               flags=self._flags(options))
+
+    def encode_yuv(self, yuv, width, height, options):
+        if not hasattr(self._tj, "encode_from_yuv"):
+            return super().encode_yuv(yuv, width, height, options)
+        jpeg = self._tj.encode_from_yuv(yuv, height, width, quality=options.quality,
+                                        jpeg_subsample=self._sampling[options.subsampling],
+                                        flags=self._flags(options))
+        return jpeg if isinstance(jpeg, bytes) else bytes(jpeg)
+
+
+BACKENDS = (TurboJpegEncoder, Cv2Encoder, PillowEncoder)
+
+_loaded = {}
+_selection_cache = {}
+_lock = threading.Lock()
+
+
+def get_encoder(name):
+    """名前でバックエンドを取得（利用できなければNone）"""
+    with _lock:
+        if name not in _loaded:
+            backend = next((b for b in BACKENDS if b.name == name), None)
+            if backend is None:
+                raise ValueError(f"Unknown JPEG encoder: {name}")
+            try:
+                _loaded[name] = backend.load()
+            except Exception as e:
+                # 読み込みに失敗したバックエンドは使えないものとして扱う（選択・ベンチマークから外れる）
+                print(f"JPEG encoder {name} unavailable: {e}")
+                _loaded[name] = None
+        return _loaded[name]
+
+
+def available_encoders():
+    return [e for e in (get_encoder(b.name) for b in BACKENDS) if e is not None]
+
+
+def _psnr(original, jpeg):
+    decoded = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+    if decoded is None or decoded.shape != original.shape:
+        return 0.0
+    return cv2.PSNR(original, decoded)
+
+
+def benchmark_encoders(frame, options, iterations=5):
+    """各バックエンドでframeをエンコードし、{name, ms, bytes, psnr} のリストを返す"""
+    results = []
+    for encoder in available_encoders():
+        if not encoder.supports(options):
+            continue
+        try:
+            jpeg = encoder.encode(frame, options)  # ウォームアップ（初回のテーブル生成等を除外）
+            if not jpeg:
+                continue
+            times = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                encoder.encode(frame, options)
+                times.append((time.perf_counter() - start) * 1000)
+        except Exception as e:
+            print(f"JPEG encoder {encoder.name} failed: {e}")
+            continue
+        times.sort()
+        results.append({
+            "name": encoder.name,
+            "ms": times[len(times) // 2],
+            "bytes": len(jpeg),
+            "psnr": _psnr(frame, jpeg),
+        })
+    return results
+
+
+def select_encoder(frame, options, max_bytes=None, min_psnr=None, iterations=5):
+    """このマシンで最速、かつサイズ・画質の目標を満たすバックエンドを選ぶ
+
+    目標を指定しなければcv2の結果を基準にする（サイズ+10%以内、PSNR-0.5dB以内）。
+    目標を満たすものがなければcv2を使う。結果は解像度と設定ごとにキャッシュする。
+    """
+    h, w = frame.shape[:2]
+    key = (w, h, options.key(), max_bytes, min_psnr)
+    if key in _selection_cache:
+        return get_encoder(_selection_cache[key])
+
+    results = benchmark_encoders(frame, options, iterations)
+    reference = next((r for r in results if r["name"] == Cv2Encoder.name), None)
+    if reference and max_bytes is None and min_psnr is None:
+        max_bytes = reference["bytes"] * 1.1
+        min_psnr = reference["psnr"] - 0.5
+    eligible = [r for r in results
+                if (max_bytes is None or r["bytes"] <= max_bytes)
+                and (min_psnr is None or r["psnr"] >= min_psnr)]
+    name = min(eligible, key=lambda r: r["ms"])["name"] if eligible else Cv2Encoder.name
+    summary = ", ".join(f"{r['name']} {r['ms']:.1f}ms/{r['bytes'] // 1024}KB" for r in results)
+    print(f"JPEG encoder: {name} ({summary})")
+    _selection_cache[key] = name
+    return get_encoder(name)
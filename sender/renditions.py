@@ -0,0 +1,181 @@
+import threading
+import cv2
+from .buffers import StaticBuffer
+from .encoders import JpegOptions, get_encoder
+from .tiles import TileEncoder
+from utils import tracing
+
+
+class Rendition:
+    """配信するストリームのバリエーション（解像度・画質・切り出し範囲）"""
+
+    def __init__(self, name, height=None, quality=None, crop=None):
+        self.name = name
+        # height=None はカメラのネイティブ解像度（再エンコードなし）
+        self.height = height
+        self.quality = quality
+        # (x, y, w, h): エンコード前に切り出す領域（カメラ解像度の画素単位）
+        self.crop = crop
+
+    @property
+    def passthrough(self):
+        """カメラのエンコード結果をそのまま配信できるか"""
+        return self.height is None and self.crop is None
+
+    @property
+    def path(self):
+        if self.name == "main":
+            return "/stream.mjpg"
+        return f"/stream.mjpg?rendition={self.name}"
+
+    def crop_rect(self, width, height):
+        """切り出し範囲をフレーム内に収めた (x, y, w, h)"""
+        if self.crop is None or not width or not height:
+            return 0, 0, width, height
+        x, y, w, h = self.crop
+        x = min(max(0, x), width - 1)
+        y = min(max(0, y), height - 1)
+        return x, y, max(1, min(w, width - x)), max(1, min(h, height - y))
+
+    def output_size(self, width, height):
+        """カメラ解像度からこのレンディションの出力サイズを求める"""
+        _, _, width, height = self.crop_rect(width, height)
+        if self.height is None or not height or self.height >= height:
+            return width, height
+        return max(2, int(round(width * self.height / height / 2)) * 2), self.height
+
+    def with_crop(self, crop):
+        """このレンディションの解像度・画質で crop を切り出す派生レンディション"""
+        return Rendition(self.name, self.height, self.quality, crop)
+
+
+DEFAULT_RENDITIONS = [
+    Rendition("main"),
+    Rendition("360p", height=360, quality=70),
+]
+
+
+class RenditionEncoder:
+    """同じフレームをレンディションごとに一度だけエンコードし、全クライアントで共有"""
+
+    def __init__(self, rendition):
+        self.rendition = rendition
+        # 同じ切り出し範囲を要求している接続数（動的ROIの破棄判定に使用）
+        self.users = 0
+        self._lock = threading.Lock()
+        self._source = None
+        self._seq = -1
+        self._jpeg = None
+        self._tiles = None
+
+    def tiles(self):
+        """このレンディションのタイル差分（?mode=tiles の接続で共有、最初の接続で作る）"""
+        with self._lock:
+            if self._tiles is None:
+                self._tiles = TileEncoder(self)
+            return self._tiles
+
+    def acquire(self, camera):
+        """このレンディションの最新JPEGを参照付きで返す（view() で読み、使用後に release()）"""
+        if self.rendition.passthrough:
+            acquire_jpeg = getattr(camera, 'acquire_jpeg', None)
+            if acquire_jpeg:
+                return acquire_jpeg()
+            jpeg = camera.get_jpeg_frame_direct()
+            return StaticBuffer(jpeg) if jpeg is not None else None
+
+        seq = camera.frame_seq
+        with self._lock:
+            # カメラ切り替え後は連番が振り直されるためソースも比較する
+            if seq != self._seq or camera is not self._source:
+                self._encode(camera, seq)
+            return self._jpeg
+
+    def _encode(self, camera, seq):
+        # 処理中にキャプチャ側でバッファが再利用されないよう参照を持つ
+        acquire_frame = getattr(camera, 'acquire_frame', None)
+        slot = acquire_frame() if acquire_frame else None
+        frame = slot.array if slot else camera.get_frame_view()
+        if frame is None:
+            return
+        try:
+            jpeg = self.encode(camera, self.render(frame, seq), seq)
+        finally:
+            if slot:
+                slot.release()
+        if jpeg:
+            self._jpeg = StaticBuffer(jpeg)
+            self._seq = seq
+            self._source = camera
+
+    def render(self, frame, seq=None):
+        """カメラのフレームをこのレンディションの範囲・サイズにする（そのままならビューを返す）"""
+        h, w = frame.shape[:2]
+        size = self.rendition.output_size(w, h)
+        if self.rendition.crop is not None:
+            # 縮小・エンコード前に切り出す（スライスなのでコピーなし）
+            x, y, cw, ch = self.rendition.crop_rect(w, h)
+            frame = frame[y:y + ch, x:x + cw]
+            w, h = cw, ch
+        if size != (w, h):
+            span = tracing.begin()
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            tracing.end("resize", span, seq)
+        return frame
+
+    def encode(self, camera, frame, seq=None):
+        """カメラと同じバックエンド・設定で、品質だけレンディションに合わせてエンコードする"""
+        encoder = getattr(camera, 'jpeg_encoder', None) or get_encoder('cv2')
+        options = getattr(camera, 'jpeg_options', None) or JpegOptions()
+        span = tracing.begin()
+        jpeg = encoder.encode(frame, options.with_quality(self.rendition.quality or options.quality))
+        tracing.end(f"encode {self.rendition.name}", span, seq)
+        return jpeg
+
+
+def parse_crop(value):
+    """"x,y,w,h" 形式の切り出し範囲を解析する"""
+    try:
+        x, y, w, h = (int(v) for v in value.split(','))
+    except ValueError:
+        raise ValueError(f"Invalid crop: {value} (expected x,y,w,h)")
+    if x < 0 or y < 0 or w <= 0 or h <= 0:
+        raise ValueError(f"Invalid crop: {value}")
+    return x, y, w, h
+
+
+def parse_crop_preset(spec):
+    """"name=x,y,w,h" または "name=x,y,w,h@高さ" 形式の切り出しプリセットを作る"""
+    name, sep, rest = spec.partition('=')
+    name = name.strip()
+    if not sep or not name or name == 'main':
+        raise ValueError(f"Invalid crop preset: {spec} (expected name=x,y,w,h)")
+    crop, _, height = rest.partition('@')
+    return Rendition(name, height=int(height) if height else None, quality=85, crop=parse_crop(crop))
+
+
+def parse_renditions(spec):
+    """"main,360p,540p@80" 形式の指定からレンディション一覧を作る
+
+    既定の名前（main, 360p）はそのまま使い、それ以外の "<高さ>p" は
+    その高さへ縮小する。縮小レンディションは "@<品質>" でJPEG品質を指定できる。
+    """
+    defaults = {r.name: r for r in DEFAULT_RENDITIONS}
+    renditions = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, quality = item.partition('@')
+        if name in defaults and not quality:
+            renditions.append(defaults[name])
+            continue
+        if name == 'main':
+            # mainはカメラのエンコード結果をそのまま配信するため品質は指定できない
+            raise ValueError("The main rendition uses the camera's encode quality")
+        if not name.endswith('p') or not name[:-1].isdigit():
+            raise ValueError(f"Invalid rendition: {item}")
+        renditions.append(Rendition(name, height=int(name[:-1]), quality=int(quality) if quality else 75))
+    if not any(r.passthrough for r in renditions):
+        raise ValueError("Renditions must include 'main'")
+    return renditions
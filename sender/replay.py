@@ -0,0 +1,215 @@
+import argparse
+import bisect
+import mmap
+import os
+import time
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from .server import MJPEGHandler, StreamServer
+from .renditions import Rendition
+from utils.jpeg import jpeg_dimensions
+from utils.network import STREAM_PORT
+from utils.recorder import read_index
+
+
+class _ReplaySegment:
+    """録画セグメントをメモリマップし、インデックスと共に保持"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.records = read_index(self.path.with_suffix('.idx'))
+        self.file = open(self.path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+
+    def close(self):
+        try:
+            self.view.release()
+            self.mm.close()
+        except BufferError:
+            # 送信中のスライスが残っている場合はGCに任せる
+            pass
+        self.file.close()
+
+
+class ReplaySource:
+    """録画（StreamRecorderのセグメント群）をStreamServerのフレームソースとして提供
+
+    フレームはmmap上のスライス、または os.sendfile でソケットへ直接送り、
+    Pythonのbytesへの読み込みを行わない。
+    """
+
+    def __init__(self, paths, loop=True):
+        self.loop = loop
+        self.segments = [_ReplaySegment(p) for p in sorted(Path(p) for p in paths)]
+        # (segment, part_offset, part_length, header_length) と先頭からの相対時刻
+        self.frames = []
+        self.times = []
+        for segment in self.segments:
+            for timestamp, offset, length, header_length in segment.records:
+                self.frames.append((segment, offset, length, header_length))
+                self.times.append(timestamp)
+        if not self.frames:
+            raise ValueError("Recording contains no frames")
+
+        t0 = self.times[0]
+        self.times = [t - t0 for t in self.times]
+        span = self.times[-1]
+        self.fps = (len(self.frames) - 1) / span if span > 0 else 30.0
+        # 最終フレームの表示時間を含めた全長
+        self.duration = span + 1.0 / self.fps
+
+        segment, offset, length, header_length = self.frames[0]
+        size = jpeg_dimensions(segment.view[offset + header_length:offset + length - 2])
+        self.width, self.height = size if size else (0, 0)
+        self.frame_seq = 0
+        self.started = time.monotonic()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame_at(self, elapsed):
+        """再生開始からの経過時間に対応するフレーム番号（ループなしで終端を過ぎたらNone）"""
+        if elapsed >= self.duration:
+            if not self.loop:
+                return None
+            elapsed %= self.duration
+        return max(0, bisect.bisect_right(self.times, elapsed) - 1)
+
+    def time_until_next(self, elapsed):
+        """次のフレームの表示時刻までの秒数"""
+        position = elapsed % self.duration if self.loop else elapsed
+        i = bisect.bisect_right(self.times, position)
+        next_time = self.times[i] if i < len(self.times) else self.duration
+        return max(0.0, next_time - position)
+
+    def send_part(self, sock, index):
+        """録画済みのmultipartパート（ヘッダー+JPEG）をそのままソケットへ送る"""
+        segment, offset, length, _ = self.frames[index]
+        if hasattr(os, 'sendfile'):
+            out_fd = sock.fileno()
+            in_fd = segment.file.fileno()
+            while length > 0:
+                sent = os.sendfile(out_fd, in_fd, offset, length)
+                if sent == 0:
+                    raise ConnectionError("Socket closed")
+                offset += sent
+                length -= sent
+        else:
+            # sendfileがない環境（Windows）: mmapのスライスをコピーせずに送信
+            sock.sendall(segment.view[offset:offset + length])
+
+    def get_jpeg_frame_direct(self):
+        """現在の再生位置のJPEG（mmap上のmemoryview、コピーなし）"""
+        index = self.frame_at(time.monotonic() - self.started)
+        if index is None:
+            return None
+        segment, offset, length, header_length = self.frames[index]
+        return segment.view[offset + header_length:offset + length - 2]
+
+    def get_frame_view(self):
+        return None
+
+    def get_load(self):
+        return 0.0
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+class ReplayHandler(MJPEGHandler):
+    """録画を /stream.mjpg プロトコルで配信（?speed=max で待ち時間なし）"""
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != '/stream.mjpg' and url.path != '/':
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        query = parse_qs(url.query)
+        speed = query.get('speed', [self.server.replay_speed])[0]
+        source = self.server.camera
+
+        if not self.begin_stream():
+            return
+
+        self.server.client_connected()
+        try:
+            if speed == 'max':
+                self._stream_max(source)
+            else:
+                self._stream_realtime(source)
+        except Exception:
+            pass  # Client disconnected
+        finally:
+            self.server.client_disconnected()
+
+    def _stream_realtime(self, source):
+        """元のタイミングで再生（全クライアントで再生位置を共有）"""
+        last = None
+        while True:
+            elapsed = time.monotonic() - source.started
+            index = source.frame_at(elapsed)
+            if index is None:
+                return
+            if index == last:
+                time.sleep(source.time_until_next(elapsed))
+                continue
+            source.send_part(self.connection, index)
+            last = index
+
+    def _stream_max(self, source):
+        """送信できる最大速度で再生（クライアントごとに独立した再生位置）"""
+        while True:
+            for index in range(len(source)):
+                source.send_part(self.connection, index)
+            if not source.loop:
+                return
+
+
+class ReplayServer(StreamServer):
+    """録画済みセッションを再配信するサーバー（負荷試験・デモ用）"""
+
+    handler_class = ReplayHandler
+
+    def __init__(self, paths, host='0.0.0.0', port=STREAM_PORT, speed='realtime', loop=True):
+        super().__init__(ReplaySource(paths, loop=loop), host=host, port=port,
+                         renditions=[Rendition("main")], name="WebCamShare Replay")
+        self.speed = speed
+
+    def start(self):
+        super().start()
+        self.server.replay_speed = self.speed
+
+    def stop(self):
+        super().stop()
+        self.camera.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay recorded WebCamShare sessions over /stream.mjpg")
+    parser.add_argument("paths", nargs="+", help="recorded .mjpg segments (with .idx sidecars)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=STREAM_PORT)
+    parser.add_argument("--speed", choices=["realtime", "max"], default="realtime")
+    parser.add_argument("--no-loop", action="store_true")
+    args = parser.parse_args(argv)
+
+    server = ReplayServer(args.paths, host=args.host, port=args.port, speed=args.speed, loop=not args.no_loop)
+    source = server.camera
+    print(f"Replaying {len(source)} frames ({source.width}x{source.height}, {source.fps:.1f} fps, "
+          f"{source.duration:.1f} s)")
+    server.start()
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import threading
+import time
+from utils import thread_roles
+
+# ?fps= を指定しない接続の配信レート（従来の30fps目標と同じ）
+DEFAULT_CLIENT_FPS = 30.0
+
+
+class Subscription:
+    """1接続ぶんの配信予定（要求FPSに合わせて、配るフレームをキャプチャ時刻で選ぶ）"""
+
+    def __init__(self, fps):
+        self.fps = fps
+        self.interval = 1.0 / fps if fps else 0.0
+        self.next_due = None
+        self.seq = 0
+        self._ready = threading.Event()
+
+    def offer(self, seq, timestamp, tolerance):
+        """公開されたフレームを配るかどうか決める（配るなら待機中の接続を起こす）"""
+        if self.interval and self.next_due is not None and timestamp < self.next_due - tolerance:
+            return False
+        if self.interval:
+            # 予定時刻を基準に進めて等間隔を保つ（1間隔以上遅れたら今から取り直す）
+            late = self.next_due is None or timestamp - self.next_due >= self.interval
+            self.next_due = (timestamp if late else self.next_due) + self.interval
+        self.seq = seq
+        self._ready.set()
+        return True
+
+    def wait(self, timeout=1.0):
+        """配るフレームが決まるまで待つ（タイムアウトならFalse）"""
+        if not self._ready.wait(timeout):
+            return False
+        self._ready.clear()
+        return True
+
+
+class FrameScheduler:
+    """全クライアントで共有する配信スケジューラー
+
+    ソースの公開通知（add_listener）を1つだけ購読し、接続ごとの要求FPSに応じて
+    どのフレームを配るかを決める。接続側はフレームが割り当てられるまで待つだけで、
+    個別にスリープで時間を計らない。通知のないソースは1本のスレッドで frame_seq を監視する
+    （接続がある間だけ。独自の配信ループを持つリプレイサーバーなどでは起動しない）。
+    """
+
+    POLL_INTERVAL = 0.005
+
+    def __init__(self):
+        self.source = None
+        self._subscriptions = ()
+        self._lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self, source):
+        self.running = True
+        self.attach(source)
+
+    def stop(self):
+        self.running = False
+        self.attach(None)
+        with self._lock:
+            thread, self.thread = self.thread, None
+        if thread:
+            thread.join()
+
+    def attach(self, source):
+        """購読するソースを切り替える"""
+        old, self.source = self.source, source
+        if old is not None and hasattr(old, 'remove_listener'):
+            old.remove_listener(self._on_publish)
+        if source is None:
+            return
+        if hasattr(source, 'add_listener'):
+            source.add_listener(self._on_publish)
+        else:
+            with self._lock:
+                self._start_polling()
+
+    def _start_polling(self):
+        """通知のないソースで接続があれば監視スレッドを起動する（_lock を持って呼ぶ）"""
+        source = self.source
+        if (self.thread is None and self.running and self._subscriptions
+                and source is not None and not hasattr(source, 'add_listener')):
+            self.thread = threading.Thread(target=self._poll, daemon=True)
+            self.thread.start()
+
+    def subscribe(self, fps=DEFAULT_CLIENT_FPS):
+        subscription = Subscription(fps)
+        with self._lock:
+            self._subscriptions = self._subscriptions + (subscription,)
+            self._start_polling()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = tuple(s for s in self._subscriptions if s is not subscription)
+
+    def _on_publish(self, jpeg, timestamp):
+        self._dispatch(timestamp)
+
+    def _dispatch(self, timestamp):
+        source = self.source
+        if source is None:
+            return
+        seq = source.frame_seq
+        # ソースのフレーム間隔の半分までは早めに配る（キャプチャ間隔の揺らぎを吸収）
+        tolerance = 0.5 / source.fps if source.fps else 0.0
+        for subscription in self._subscriptions:
+            subscription.offer(seq, timestamp, tolerance)
+
+    def _poll(self):
+        thread_roles.assign("network", "scheduler")
+        last_seq = None
+        while self.running:
+            with self._lock:
+                if not self._subscriptions or hasattr(self.source, 'add_listener'):
+                    # 接続がなくなった（次の subscribe() で起動し直す）か、通知のあるソースへ切り替わった
+                    if self.thread is threading.current_thread():
+                        self.thread = None
+                    return
+            source = self.source
+            if source is not None and not hasattr(source, 'add_listener') and source.frame_seq != last_seq:
+                last_seq = source.frame_seq
+                self._dispatch(time.time())
+            time.sleep(self.POLL_INTERVAL)
@@ -1,87 +1,383 @@
 from http.server import BaseHTTPRequestHandler, HTTPServer
 from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit, parse_qs
 import threading
 import time
-from utils.network import ServerAnnouncer
+import uuid
+from utils.network import (
+    ServerAnnouncer, STREAM_PORT, VIA_HEADER, PATH_HEADER, HOPS_HEADER, RELAY_DELAY_HEADER,
+    TILES_HEADER, SESSION_HEADER,
+)
+from .renditions import DEFAULT_RENDITIONS, RenditionEncoder, parse_crop
+from .scheduler import DEFAULT_CLIENT_FPS, FrameScheduler
+from .shaping import RateShaper
+from .shm import ShmPublisher
+from .tiles import TileSession
+from utils import tracing, thread_roles
+
+# 同時に保持する任意ROI（?crop=）のエンコーダー数の上限（ROIごとにエンコード負荷がかかる）
+MAX_CROP_ENCODERS = 8
 
 class MJPEGHandler(BaseHTTPRequestHandler):
     def log_message(self, format, *args):
         """HTTPサーバーのログを抑制（Nuitkaビルドでstdout問題を回避）"""
         pass
 
-    def do_GET(self):
-        if self.path == '/stream.mjpg' or self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
-            self.send_header('Cache-Control', 'no-cache')
-            self.send_header('Connection', 'keep-alive')
+    def begin_stream(self, session=None):
+        """multipartレスポンスのヘッダーを送る（リレーのループ検出時は508を返してFalse）"""
+        # 要求元リレーが自分の上流経路に含まれていれば拒否
+        via = [v for v in self.headers.get(VIA_HEADER, '').split(',') if v]
+        if any(v in self.server.path for v in via):
+            self.send_response(508, 'Loop Detected')
             self.end_headers()
+            return False
 
-            target_interval = 1.0 / 30  # 30fps目標
-            last_frame_time = 0
+        self.send_response(200)
+        self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'keep-alive')
+        self.send_header(PATH_HEADER, ','.join(self.server.path))
+        self.send_header(HOPS_HEADER, str(self.server.relay_hops))
+        if session is not None:
+            self.send_header(SESSION_HEADER, session.id)
+        self.end_headers()
+        return True
 
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/stream.mjpg' or url.path == '/':
+            query = parse_qs(url.query)
+            rendition_name = query.get('rendition', ['main'])[0]
             try:
-                while True:
-                    current_time = time.monotonic()
-                    elapsed = current_time - last_frame_time
-
-                    # 適応的FPS制御：目標間隔に満たない場合のみスリープ
-                    if elapsed < target_interval:
-                        time.sleep(target_interval - elapsed)
-
-                    frame = self.server.camera.get_jpeg_frame_direct()
-                    if frame:
-                        last_frame_time = time.monotonic()
-                        # MJPEGフォーマットで直接書き込み（send_headerは使わない）
-                        self.wfile.write(b'--frame\r\n')
-                        self.wfile.write(b'Content-Type: image/jpeg\r\n')
-                        self.wfile.write(f'Content-Length: {len(frame)}\r\n'.encode())
-                        self.wfile.write(b'\r\n')
-                        self.wfile.write(frame)
-                        self.wfile.write(b'\r\n')
-                        self.wfile.flush()
-            except Exception as e:
-                pass  # Client disconnected
+                crop = parse_crop(query['crop'][0]) if 'crop' in query else None
+                fps = float(query['fps'][0]) if 'fps' in query else DEFAULT_CLIENT_FPS
+                if not fps > 0:
+                    raise ValueError(fps)
+                mode = query.get('mode', ['mjpeg'])[0]
+                if mode not in ('mjpeg', 'tiles'):
+                    raise ValueError(mode)
+            except ValueError:
+                self.send_response(400)
+                self.end_headers()
+                return
+            preset = self.server.encoders.get(rendition_name)
+            if not self.server.has_raw_frames() and (mode == 'tiles' or crop is not None or (
+                    preset is not None and not preset.rendition.passthrough)):
+                # 生フレームを持たないソース（リレー）では切り出し・縮小・タイル差分を作れない（接続だけ受けて何も送れない）
+                self.send_response(501)
+                self.end_headers()
+                return
+            encoder = self.server.acquire_encoder(rendition_name, crop)
+            if encoder is None:
+                self.send_response(404 if rendition_name not in self.server.encoders else 503)
+                self.end_headers()
+                return
+
+            session = self.server.open_tile_session(encoder) if mode == 'tiles' else None
+            try:
+                self._stream(encoder, fps, session)
+            finally:
+                if session is not None:
+                    self.server.close_tile_session(session)
+                self.server.release_encoder(encoder)
+        elif url.path == '/keyframe':
+            # タイル差分の受信側が全体の再送を要求する（デコード失敗など）
+            session = self.server.tile_sessions.get(parse_qs(url.query).get('session', [''])[0])
+            if session is not None:
+                session.request_keyframe()
+            self.send_response(204 if session is not None else 404)
+            self.end_headers()
         else:
             self.send_response(404)
             self.end_headers()
 
+    def _stream(self, encoder, fps=DEFAULT_CLIENT_FPS, session=None):
+        """multipartでフレームを送り続ける（切断まで戻らない）
+
+        どのフレームを送るかは共有スケジューラーが要求FPSに合わせて決める。
+        session があればタイル差分（キーフレームと変化したタイルのモザイク）を送る。
+        """
+        if not self.begin_stream(session):
+            return
+        thread_roles.assign("network", f"stream-{self.client_address[0]}")
+        is_relay = self.server.relay_hops > 0
+
+        shaper = self.server.shaper
+        bucket = shaper.client_bucket()
+        subscription = self.server.scheduler.subscribe(fps)
+
+        self.server.client_connected()
+        try:
+            while True:
+                if not subscription.wait():
+                    # ソースが止まったままサーバーが停止された
+                    if not self.server.scheduler.running:
+                        break
+                    continue
+
+                source = self.server.camera
+                part = None
+                if session is None:
+                    buffer = encoder.acquire(source)
+                else:
+                    part = session.next_part(source)
+                    buffer = part.buffer.retain() if part else None
+                if buffer is None:
+                    continue
+                # 送信が終わるまでバッファを保持（キャプチャ側で再利用されない）
+                try:
+                    frame = buffer.view()
+                    # 帯域超過ならフレームごと送らない（書き込み中に待たない）
+                    if not shaper.allow(bucket, len(frame)):
+                        continue
+                    send_start = time.perf_counter()
+                    span = tracing.begin()
+                    # MJPEGフォーマットで直接書き込み（send_headerは使わない）
+                    self.wfile.write(b'--frame\r\n')
+                    if part is None:
+                        self.wfile.write(b'Content-Type: image/jpeg\r\n')
+                    else:
+                        self.wfile.write(f'Content-Type: {part.content_type}\r\n'.encode())
+                        self.wfile.write(f'{TILES_HEADER}: {part.header}\r\n'.encode())
+                    self.wfile.write(f'Content-Length: {len(frame)}\r\n'.encode())
+                    if is_relay:
+                        delay_ms = source.get_relay_delay_ms()
+                        self.wfile.write(f'{RELAY_DELAY_HEADER}: {delay_ms:.1f}\r\n'.encode())
+                    self.wfile.write(b'\r\n')
+                    self.wfile.write(frame)
+                    self.wfile.write(b'\r\n')
+                    self.wfile.flush()
+                    self.server.record_sent(len(frame), (time.perf_counter() - send_start) * 1000)
+                    if part is not None:
+                        session.sent(part)
+                    tracing.end("send", span, subscription.seq)
+                finally:
+                    buffer.release()
+        except Exception as e:
+            pass  # Client disconnected
+        finally:
+            self.server.scheduler.unsubscribe(subscription)
+            self.server.client_disconnected()
+
 class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
     """Handle requests in a separate thread."""
-    pass
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client_count = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        # 1フレームの書き込みにかかった時間（ms、移動平均）。送信側の詰まりの目安
+        self.send_ms = 0.0
+        self.encoders = {}
+        # (レンディション名, crop) -> 任意ROI用エンコーダー（同じROIの接続で共有）
+        self.crop_encoders = {}
+        # 接続ID -> タイル差分の接続（/keyframe での再送要求に使う）
+        self.tile_sessions = {}
+        self._client_lock = threading.Lock()
+
+    def has_raw_frames(self):
+        """ソースがデコード済みのフレームを持つか（受信したJPEGだけを持つリレーはFalse）"""
+        return getattr(self.camera, 'raw_frames', True)
+
+    def acquire_encoder(self, rendition_name, crop=None):
+        """接続用のエンコーダーを取得（未知のレンディション、ROI数の上限超過ならNone）"""
+        encoder = self.encoders.get(rendition_name)
+        if encoder is None:
+            return None
+        if crop is not None:
+            key = (rendition_name, crop)
+            with self._client_lock:
+                encoder = self.crop_encoders.get(key)
+                if encoder is None:
+                    if len(self.crop_encoders) >= MAX_CROP_ENCODERS:
+                        return None
+                    rendition = self.encoders[rendition_name].rendition.with_crop(crop)
+                    encoder = self.crop_encoders[key] = RenditionEncoder(rendition)
+        with self._client_lock:
+            encoder.users += 1
+        return encoder
+
+    def release_encoder(self, encoder):
+        with self._client_lock:
+            encoder.users -= 1
+            rendition = encoder.rendition
+            key = (rendition.name, rendition.crop)
+            # 誰も見ていない任意ROIは破棄（プリセットは残す）
+            if encoder.users == 0 and self.crop_encoders.get(key) is encoder:
+                del self.crop_encoders[key]
+
+    def open_tile_session(self, encoder):
+        session = TileSession(encoder.tiles())
+        with self._client_lock:
+            self.tile_sessions[session.id] = session
+        return session
+
+    def close_tile_session(self, session):
+        with self._client_lock:
+            self.tile_sessions.pop(session.id, None)
+
+    def client_connected(self):
+        with self._client_lock:
+            self.client_count += 1
+
+    def client_disconnected(self):
+        with self._client_lock:
+            self.client_count -= 1
+
+    def record_sent(self, nbytes, send_ms=0.0):
+        with self._client_lock:
+            self.frames_sent += 1
+            self.bytes_sent += nbytes
+            self.send_ms += (send_ms - self.send_ms) * 0.1
 
 class StreamServer:
-    def __init__(self, camera, host='0.0.0.0', port=8000):
+    handler_class = MJPEGHandler
+
+    def __init__(self, camera, host='0.0.0.0', port=STREAM_PORT, renditions=None, max_clients=16,
+                 name="WebCamShare", server_id=None, upstream_path=None, max_bitrate=None,
+                 client_bitrate=None, announce=True, shared_memory=False):
         self.camera = camera
         self.host = host
         self.port = port
+        self.renditions = renditions if renditions is not None else DEFAULT_RENDITIONS
+        # 負荷計算の目安となる同時接続数（接続数の上限として強制はしない）
+        self.max_clients = max_clients
+        # リレー経路: 配信元からこのサーバーまでのID列（配信元なら自分のIDのみ）
+        self.server_id = server_id or uuid.uuid4().hex[:12]
+        self.path = list(upstream_path or []) + [self.server_id]
+        # 送信帯域の上限（bps、Noneで無制限）。全体とクライアントごと
+        self.shaper = RateShaper(max_bitrate, client_bitrate)
+        # 全クライアント共通の配信スケジューラー（?fps= による間引き）
+        self.scheduler = FrameScheduler()
+        # shared_memory=True: 同じホストの受信側へ共有メモリで生フレームも配る
+        self.shm = ShmPublisher(f"wcs-{self.server_id}") if shared_memory else None
         self.server = None
         self.thread = None
         self.running = False
-        self.announcer = ServerAnnouncer(server_port=port)
+        # announce=False: ディスカバリーに応答しない（負荷試験・内部用サーバー）
+        self.announcer = ServerAnnouncer(server_port=port, status_provider=self.get_status,
+                                         name=name) if announce else None
 
     def start(self):
         if self.running:
             return
 
-        self.server = ThreadedHTTPServer((self.host, self.port), MJPEGHandler)
+        self.server = ThreadedHTTPServer((self.host, self.port), self.handler_class)
         self.server.camera = self.camera
+        self.server.shaper = self.shaper
+        self.server.scheduler = self.scheduler
+        self.scheduler.start(self.camera)
+        if self.shm:
+            self.shm.attach(self.camera)
+        self.server.encoders = {r.name: RenditionEncoder(r) for r in self.renditions}
+        self.server.path = self.path
+        self.server.relay_hops = len(self.path) - 1
         self.running = True
         self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
         self.thread.start()
 
         # Start server announcer for auto-discovery
-        self.announcer.start()
+        if self.announcer:
+            self.announcer.start()
 
         print(f"Server started at http://{self.host}:{self.port}/stream.mjpg")
 
+    def set_source(self, camera):
+        """配信中のフレームソースを差し替え、古いソースを返す
+
+        接続中のクライアントは切断されず、次のフレームから新しいソースになる。
+        エンコード済みJPEGの購読者（録画など）も新しいソースへ引き継ぐ。
+        """
+        old = self.camera
+        if self.running:
+            self.scheduler.attach(camera)
+            if self.shm:
+                self.shm.attach(camera)
+        for listener in getattr(old, 'get_listeners', tuple)():
+            camera.add_listener(listener)
+            old.remove_listener(listener)
+        self.camera = camera
+        if self.server:
+            self.server.camera = camera
+        return old
+
+    def set_rate_limits(self, max_bitrate=None, client_bitrate=None):
+        """送信帯域の上限を変更する（bps、Noneで無制限）。接続中のクライアントにも即時反映"""
+        self.shaper.set_limits(max_bitrate, client_bitrate)
+
+    def get_client_count(self):
+        return self.server.client_count if self.server else 0
+
+    def get_stats(self):
+        """送信統計（累積、未開始ならNone）"""
+        httpd = self.server
+        if not httpd:
+            return None
+        return {
+            "clients": httpd.client_count,
+            "frames_sent": httpd.frames_sent,
+            "bytes_sent": httpd.bytes_sent,
+            "send_ms": httpd.send_ms,
+            "frames_dropped": self.shaper.frames_dropped,
+        }
+
+    def get_status(self):
+        """ディスカバリー応答に含める能力・負荷情報"""
+        width, height = self.camera.width, self.camera.height
+        fps = round(self.camera.fps, 1)
+        renditions = []
+        for rendition in self.renditions:
+            w, h = rendition.output_size(width, height)
+            entry = {
+                "name": rendition.name,
+                "path": rendition.path,
+                "width": w,
+                "height": h,
+                "fps": fps,
+                # ネイティブ解像度に対する画素数比（帯域・エンコード負荷の目安）
+                "cost": round((w * h) / (width * height), 3) if width and height else 1.0,
+            }
+            if rendition.crop is not None:
+                entry["crop"] = list(rendition.crop_rect(width, height))
+            renditions.append(entry)
+        clients = self.get_client_count()
+        load = max(clients / self.max_clients if self.max_clients else 0.0, self.camera.get_load())
+        status = {
+            "width": width,
+            "height": height,
+            "fps": fps,
+            "formats": ["mjpeg", "tiles"] if getattr(self.camera, 'raw_frames', True) else ["mjpeg"],
+            "renditions": renditions,
+            "clients": clients,
+            "load": round(min(1.0, load), 3),
+            "server_id": self.server_id,
+            "path": self.path,
+            "relay_hops": len(self.path) - 1,
+            # False なら ?crop= や縮小レンディション、?mode=tiles は配信できない
+            "raw_frames": getattr(self.camera, 'raw_frames', True),
+        }
+        if self.shm:
+            shm = self.shm.status()
+        else:
+            # ソース自体が共有メモリのリング（マルチプロセス構成）ならそれを案内する
+            shm_status = getattr(self.camera, 'shm_status', None)
+            shm = shm_status() if shm_status else None
+        if shm:
+            status["shm"] = shm
+        return status
+
     def stop(self):
         if self.server and self.running:
             self.running = False
 
             # Stop server announcer
-            self.announcer.stop()
+            if self.announcer:
+                self.announcer.stop()
 
+            self.scheduler.stop()
+            if self.shm:
+                self.shm.close()
             self.server.shutdown()
             self.server.server_close()
             self.server = None
@@ -0,0 +1,88 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """バイト単位のトークンバケット（帯域制限）
+
+    送信の可否をフレーム単位で判定し、待たずに可否だけを返す。
+    フレームがバケット容量より大きくても、満杯なら送信を許可して
+    残高をマイナスにする（平均レートは守りつつ大きなフレームで詰まらない）。
+    rate_bps が None/0 のときは無制限。
+    """
+
+    def __init__(self, rate_bps=None, burst_seconds=0.25):
+        self._lock = threading.Lock()
+        self.burst_seconds = burst_seconds
+        self.rate_bps = None
+        self.set_rate(rate_bps)
+
+    def set_rate(self, rate_bps):
+        """レートを変更する（配信中に呼んでよい）"""
+        with self._lock:
+            self.rate_bps = rate_bps or None
+            # 容量は burst_seconds 分のバイト数。変更時は満杯から始める
+            self.capacity = self.rate_bps / 8 * self.burst_seconds if self.rate_bps else 0.0
+            self.tokens = self.capacity
+            self._last = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate_bps / 8)
+        self._last = now
+
+    def can_send(self, nbytes):
+        if not self.rate_bps:
+            return True
+        with self._lock:
+            self._refill()
+            return self.tokens >= nbytes or self.tokens >= self.capacity
+
+    def consume(self, nbytes):
+        if not self.rate_bps:
+            return
+        with self._lock:
+            self.tokens -= nbytes
+
+    def try_consume(self, nbytes):
+        """送信できれば残高から差し引いてTrue、できなければFalse（ブロックしない）"""
+        if not self.rate_bps:
+            return True
+        with self._lock:
+            self._refill()
+            if self.tokens >= nbytes or self.tokens >= self.capacity:
+                self.tokens -= nbytes
+                return True
+            return False
+
+
+class RateShaper:
+    """サーバー全体とクライアントごとの帯域制限
+
+    フレームを送る前に allow() で判定し、超過分はフレームごと破棄する。
+    書き込み中にスリープしないため、制限下でもFPSが下がるだけで遅延は増えない。
+    """
+
+    def __init__(self, total_bps=None, per_client_bps=None):
+        self.total = TokenBucket(total_bps)
+        self.per_client_bps = per_client_bps or None
+        self.frames_dropped = 0
+
+    def set_limits(self, total_bps=None, per_client_bps=None):
+        self.total.set_rate(total_bps)
+        self.per_client_bps = per_client_bps or None
+
+    def client_bucket(self):
+        return TokenBucket(self.per_client_bps)
+
+    def allow(self, client_bucket, nbytes):
+        """このクライアントにnbytesのフレームを送ってよいか（送るなら両方のバケットから差し引く）"""
+        if client_bucket.rate_bps != self.per_client_bps:
+            # 実行中に制限値が変わった
+            client_bucket.set_rate(self.per_client_bps)
+        # クライアント側を先に確認し、全体の枠を無駄に消費しない
+        if client_bucket.can_send(nbytes) and self.total.try_consume(nbytes):
+            client_bucket.consume(nbytes)
+            return True
+        self.frames_dropped += 1
+        return False
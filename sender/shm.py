@@ -0,0 +1,93 @@
+import socket
+import threading
+from utils.shm_ring import ShmRingWriter
+
+
+def host_id():
+    """同一ホスト判定に使う識別子（ディスカバリー応答に含める）"""
+    return socket.gethostname()
+
+
+class ShmPublisher:
+    """同じホストの受信側向けに、公開された生フレームを共有メモリのリングへ書き込む
+
+    ソースの公開通知（add_listener）で最新フレームとJPEGを書き込む。
+    読み手がいない間は書き込みを省き、解像度がリングに収まらなくなったら作り直す
+    （セグメント名が変わるため、読み手は終了を検知して再接続する）。
+    """
+
+    def __init__(self, name):
+        self.base_name = name
+        self.source = None
+        self.writer = None
+        self._generation = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+        # 統計: 共有メモリへ書き込んだフレーム数
+        self.frames_written = 0
+
+    @property
+    def name(self):
+        writer = self.writer
+        return writer.name if writer else None
+
+    def attach(self, source):
+        """購読するソースを切り替える（Noneで停止）"""
+        old, self.source = self.source, source
+        if old is not None:
+            old.remove_listener(self._on_publish)
+        if source is not None:
+            if not hasattr(source, 'add_listener'):
+                print("Shared memory transport: source has no publish notifications, disabled")
+                self.source = None
+                return
+            source.add_listener(self._on_publish)
+
+    def close(self):
+        self.attach(None)
+        with self._lock:
+            writer, self.writer = self.writer, None
+        if writer:
+            writer.close()
+
+    def status(self):
+        """ディスカバリー応答用の情報（リング未作成ならNone）"""
+        writer = self.writer
+        if writer is None:
+            return None
+        return {"name": writer.name, "host": host_id()}
+
+    def _on_publish(self, jpeg, timestamp):
+        source = self.source
+        acquire_frame = getattr(source, 'acquire_frame', None)
+        slot = acquire_frame() if acquire_frame else None
+        frame = slot.array if slot else source.get_frame_view()
+        try:
+            if frame is None:
+                return
+            with self._lock:
+                writer = self._ensure_writer(frame)
+                if not writer.has_readers():
+                    return
+                # ソース切り替えで frame_seq が振り直されても単調増加させる
+                self._seq += 1
+                writer.write(self._seq, timestamp, frame, jpeg)
+                self.frames_written += 1
+        except OSError as e:
+            print(f"Shared memory transport error: {e}")
+        finally:
+            if slot:
+                slot.release()
+
+    def _ensure_writer(self, frame):
+        writer = self.writer
+        if writer is not None and writer.fits(frame):
+            return writer
+        h, w = frame.shape[:2]
+        self._generation += 1
+        new = ShmRingWriter(f"{self.base_name}-{self._generation}", w, h)
+        self.writer = new
+        if writer is not None:
+            writer.close()
+        print(f"Shared memory transport: {new.name} ({w}x{h})")
+        return new
@@ -0,0 +1,118 @@
+import threading
+from .camera import Camera
+
+
+class WarmCameraPool:
+    """切り替え候補のカメラを開いたまま保持する（即時切り替え用、任意）"""
+
+    def __init__(self, camera_factory=None):
+        self.camera_factory = camera_factory or (lambda camera_id: Camera(camera_id=camera_id))
+        self._cameras = {}
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def warm(self, camera_ids):
+        """指定カメラを事前に開く（ブロッキング。バックグラウンドスレッドから呼ぶ）"""
+        for camera_id in camera_ids:
+            with self._lock:
+                if self.closed or camera_id in self._cameras:
+                    continue
+            camera = self.camera_factory(camera_id)
+            try:
+                camera.start()
+            except Exception as e:
+                print(f"Warm pool: could not open camera {camera_id}: {e}")
+                continue
+            self.release(camera)
+
+    def take(self, camera_id):
+        """開いているカメラを取り出す（なければNone）"""
+        with self._lock:
+            return self._cameras.pop(camera_id, None)
+
+    def release(self, camera):
+        """使い終わったカメラをプールに戻す（閉じられていれば停止）"""
+        with self._lock:
+            if not self.closed and camera.camera_id not in self._cameras:
+                self._cameras[camera.camera_id] = camera
+                return
+        camera.stop()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            cameras = list(self._cameras.values())
+            self._cameras.clear()
+        for camera in cameras:
+            camera.stop()
+
+
+class CameraSwitcher:
+    """配信を止めずにカメラを切り替える
+
+    新しいカメラをバックグラウンドで開いて最初のフレームを待ち、
+    その後で StreamServer のソースを差し替える。それまでは古いカメラが
+    配信を続けるため、受信側に見えるのは最大1回の映像の切れ目だけ。
+    """
+
+    def __init__(self, server, pool=None, camera_factory=None):
+        self.server = server
+        self.pool = pool
+        self.camera_factory = camera_factory or (lambda camera_id: Camera(camera_id=camera_id))
+        self._lock = threading.Lock()
+        self._switching = False
+        self.closed = False
+
+    @property
+    def switching(self):
+        return self._switching
+
+    def switch(self, camera_id, on_done=None):
+        """camera_id へ切り替える。完了時に on_done(camera, error) をワーカースレッドから呼ぶ"""
+        with self._lock:
+            if self._switching or self.closed:
+                return False
+            self._switching = True
+        threading.Thread(target=self._switch_worker, args=(camera_id, on_done), daemon=True).start()
+        return True
+
+    def _switch_worker(self, camera_id, on_done):
+        camera = None
+        error = None
+        try:
+            camera = self.pool.take(camera_id) if self.pool else None
+            if camera is None:
+                camera = self.camera_factory(camera_id)
+                camera.start()
+            if not camera.wait_first_frame():
+                raise RuntimeError(f"Camera {camera_id} produced no frames")
+
+            with self._lock:
+                if self.closed:
+                    # 切り替え中に配信が停止された
+                    camera.stop()
+                    camera = None
+                    return
+                old = self.server.set_source(camera)
+            self._retire(old)
+        except Exception as e:
+            error = e
+            if camera:
+                camera.stop()
+                camera = None
+        finally:
+            self._switching = False
+            if on_done:
+                on_done(camera, error)
+
+    def _retire(self, camera):
+        if self.pool:
+            self.pool.release(camera)
+        else:
+            camera.stop()
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+        if self.pool:
+            self.pool.close()
@@ -0,0 +1,214 @@
+"""タイル差分ストリーム（?mode=tiles）
+
+フレームをタイルに分け、受信側が持っている内容から変わったタイルだけを1枚のモザイクJPEGに
+まとめて送る。話者だけが動くカメラやホワイトボードのように大部分が静止している映像向け。
+
+    キーフレーム: Content-Type: image/jpeg            （全体のJPEG、受信側は出力バッファを置き換える）
+    差分:         Content-Type: application/x-webcamshare-tiles
+                  X-WebCamShare-Tiles: <幅>x<高さ> <タイル> <モザイク列数> <列>,<行> ...
+                  本文はタイルを左上から並べたモザイクのJPEG（変化がなければ空）
+"""
+import math
+import threading
+import time
+import uuid
+import cv2
+import numpy as np
+from .buffers import StaticBuffer
+from utils import tracing
+
+# 4:2:0 のMCU（16px）の倍数にして、モザイク内で隣のタイルとブロックを共有しないようにする
+TILE_SIZE = 64
+# 画素の差（輝度）がこれを超えたら変化とみなす（カメラのノイズは通常これ以下）
+PIXEL_THRESHOLD = 24
+# タイル内の差の平均がこれを超えても変化とみなす（照明の変化などゆっくり全体が変わる場合）
+MEAN_THRESHOLD = 4
+# 送るタイルがこの割合を超えたら全体のJPEGを送る（タイルごとの処理より小さく速い）
+KEYFRAME_FRACTION = 0.5
+# 取りこぼしや画質劣化が残らないよう、定期的にキーフレームを送る（s）
+KEYFRAME_INTERVAL = 5.0
+CONTENT_TYPE = "application/x-webcamshare-tiles"
+
+
+class TilePart:
+    """1回分の送信内容"""
+
+    __slots__ = ("buffer", "header", "version", "keyframe")
+
+    def __init__(self, buffer, header, version, keyframe):
+        self.buffer = buffer
+        self.header = header
+        self.version = version
+        self.keyframe = keyframe
+
+    @property
+    def content_type(self):
+        return "image/jpeg" if self.keyframe else CONTENT_TYPE
+
+
+class TileEncoder:
+    """レンディションのフレームをタイル単位で追跡し、差分を全接続で共有してエンコードする
+
+    ref は受信側が持っているはずの内容（変化したタイルだけ更新）、versions はタイルごとに
+    最後に変化した版。接続は受け取った版を覚えておき、それより新しいタイルだけを受け取る。
+    同じ版から追いつく接続（同じFPSの接続）は同じモザイクを共有する。
+    """
+
+    def __init__(self, rendition_encoder, tile_size=TILE_SIZE):
+        self.rendition_encoder = rendition_encoder
+        self.tile_size = tile_size
+        self.version = 0
+        # これより古い版しか持たない接続は全体を受け取り直す（解像度・ソースの変更）
+        self.reset_version = 0
+        self.ref = None
+        self.versions = None
+        # 統計: 変化を検出したタイル数（累積）と、検出にかかった時間（ms、移動平均）
+        self.tiles_changed = 0
+        self.detect_ms = 0.0
+        self._source = None
+        self._seq = -1
+        self._deltas = {}
+        self._keyframe = None
+        self._lock = threading.Lock()
+
+    def _update(self, camera):
+        seq = camera.frame_seq
+        if seq == self._seq and camera is self._source:
+            return
+        acquire_frame = getattr(camera, 'acquire_frame', None)
+        slot = acquire_frame() if acquire_frame else None
+        frame = slot.array if slot else camera.get_frame_view()
+        if frame is None:
+            return
+        try:
+            self._apply(self.rendition_encoder.render(frame, seq), camera is not self._source)
+        finally:
+            if slot:
+                slot.release()
+        self._seq = seq
+        self._source = camera
+
+    def _apply(self, frame, reset=False):
+        """frame と ref の差を検出し、変化したタイルを ref へ取り込む"""
+        h, w = frame.shape[:2]
+        size = self.tile_size
+        rows, cols = math.ceil(h / size), math.ceil(w / size)
+        if reset or self.ref is None or self.ref.shape != frame.shape:
+            self.ref = np.array(frame)
+            self.version += 1
+            self.versions = np.full((rows, cols), self.version, dtype=np.int64)
+            self.reset_version = self.version
+            self._deltas.clear()
+            return
+
+        start = time.perf_counter()
+        span = tracing.begin()
+        # 画素ごとの変化を2値化し、タイルごとの平均（=変化した画素の割合）を縮小で求める
+        diff = cv2.cvtColor(cv2.absdiff(frame, self.ref), cv2.COLOR_BGR2GRAY)
+        diff = cv2.copyMakeBorder(diff, 0, rows * size - h, 0, cols * size - w, cv2.BORDER_CONSTANT, value=0)
+        _, mask = cv2.threshold(diff, PIXEL_THRESHOLD, 255, cv2.THRESH_BINARY)
+        # uint8の平均なので、タイルの約0.2%（64x64で8画素）以上が変化していれば非ゼロ
+        changed = cv2.resize(mask, (cols, rows), interpolation=cv2.INTER_AREA) > 0
+        changed |= cv2.resize(diff, (cols, rows), interpolation=cv2.INTER_AREA) > MEAN_THRESHOLD
+        tracing.end("tile detect", span, self._seq)
+        self.detect_ms += ((time.perf_counter() - start) * 1000 - self.detect_ms) * 0.1
+        if not changed.any():
+            return
+        if changed.sum() > KEYFRAME_FRACTION * changed.size:
+            # どの接続にもキーフレームを送ることになるので、閾値未満の変化も含めて全体を取り込む
+            changed[:] = True
+
+        self.version += 1
+        self.versions[changed] = self.version
+        self.tiles_changed += int(changed.sum())
+        self._deltas.clear()
+        if changed.all():
+            np.copyto(self.ref, frame)
+            return
+        for row, col in np.argwhere(changed):
+            y, x = row * size, col * size
+            self.ref[y:y + size, x:x + size] = frame[y:y + size, x:x + size]
+
+    def keyframe(self, camera):
+        """現在の ref 全体のJPEG（版ごとに1回だけエンコード）"""
+        with self._lock:
+            self._update(camera)
+            return self._keyframe_part(camera)
+
+    def _keyframe_part(self, camera):
+        if self.ref is None:
+            return None
+        if self._keyframe is None or self._keyframe.version != self.version:
+            jpeg = self.rendition_encoder.encode(camera, self.ref, self._seq)
+            if not jpeg:
+                return None
+            h, w = self.ref.shape[:2]
+            self._keyframe = TilePart(StaticBuffer(jpeg), f"{w}x{h} {self.tile_size}", self.version, True)
+        return self._keyframe
+
+    def delta(self, camera, base):
+        """版 base から現在までに変化したタイルのモザイク（多すぎれば、または base が古ければキーフレーム）"""
+        with self._lock:
+            self._update(camera)
+            if self.ref is None:
+                return None
+            if base < self.reset_version:
+                return self._keyframe_part(camera)
+            part = self._deltas.get(base)
+            if part is None:
+                changed = np.argwhere(self.versions > base)
+                if len(changed) > KEYFRAME_FRACTION * self.versions.size:
+                    return self._keyframe_part(camera)
+                part = self._mosaic(camera, changed)
+                if part is None:
+                    return None
+                self._deltas[base] = part
+            return part
+
+    def _mosaic(self, camera, changed):
+        h, w = self.ref.shape[:2]
+        size = self.tile_size
+        if not len(changed):
+            return TilePart(StaticBuffer(b""), f"{w}x{h} {size} 0", self.version, False)
+        mosaic_cols = math.ceil(math.sqrt(len(changed)))
+        mosaic_rows = math.ceil(len(changed) / mosaic_cols)
+        mosaic = np.zeros((mosaic_rows * size, mosaic_cols * size, 3), dtype=np.uint8)
+        for i, (row, col) in enumerate(changed):
+            tile = self.ref[row * size:(row + 1) * size, col * size:(col + 1) * size]
+            th, tw = tile.shape[:2]
+            if (th, tw) != (size, size):
+                # 端のタイルは端の画素で埋める（黒との境界でブロックノイズが出ないように）
+                tile = cv2.copyMakeBorder(tile, 0, size - th, 0, size - tw, cv2.BORDER_REPLICATE)
+            y, x = (i // mosaic_cols) * size, (i % mosaic_cols) * size
+            mosaic[y:y + size, x:x + size] = tile
+        jpeg = self.rendition_encoder.encode(camera, mosaic, self._seq)
+        if not jpeg:
+            return None
+        tiles = " ".join(f"{col},{row}" for row, col in changed)
+        return TilePart(StaticBuffer(jpeg), f"{w}x{h} {size} {mosaic_cols} {tiles}", self.version, False)
+
+
+class TileSession:
+    """1接続ぶんのタイル差分の状態（受け取った版とキーフレームの予定）"""
+
+    def __init__(self, tiles):
+        self.tiles = tiles
+        self.id = uuid.uuid4().hex[:12]
+        self.base = -1
+        self.next_keyframe = 0.0
+        self.keyframe_requested = False
+
+    def request_keyframe(self):
+        """受信側の要求（デコード失敗など）で、次に全体を送る"""
+        self.keyframe_requested = True
+
+    def next_part(self, camera):
+        if self.keyframe_requested or time.monotonic() >= self.next_keyframe:
+            return self.tiles.keyframe(camera)
+        return self.tiles.delta(camera, self.base)
+
+    def sent(self, part):
+        self.base = part.version
+        if part.keyframe:
+            self.keyframe_requested = False
+            self.next_keyframe = time.monotonic() + KEYFRAME_INTERVAL
@@ -1,13 +1,22 @@
 import customtkinter as ctk
 import cv2
 import threading
+import time
 from PIL import Image, ImageTk
 from .camera import Camera, get_available_cameras
 from .server import StreamServer
+from .switcher import CameraSwitcher, WarmCameraPool
+from .workers import WorkerSender
 from utils.network import get_local_ip
+from utils.recorder import StreamRecorder
+from utils import tracing
+from utils.stats import StageTimes
+from utils.stats_panel import StatsPanel
 from utils.theme import Theme
 import tkinter as tk
 
+UPLINK_LIMITS = ["No limit", "5 Mbps", "10 Mbps", "20 Mbps", "50 Mbps"]
+
 class SenderApp(ctk.CTkFrame):
     def __init__(self, master, on_back=None):
         super().__init__(master, fg_color=Theme.BG_DARK)
@@ -17,6 +26,9 @@ class SenderApp(ctk.CTkFrame):
 
         self.camera = None
         self.server = None
+        self.switcher = None
+        self.recorder = None
+        self.stage_times = StageTimes()
         self.is_running = False
         self.camera_list = []
         self.photo_image = None
@@ -81,6 +93,23 @@ class SenderApp(ctk.CTkFrame):
         )
         self.label_ip.pack(anchor="w", padx=Theme.PAD_MD, pady=(0, Theme.PAD_SM))
 
+        # 送信帯域の上限（全体）。超過分はフレーム単位で間引く
+        self.limit_var = ctk.StringVar(value=UPLINK_LIMITS[0])
+        self.option_limit = ctk.CTkOptionMenu(
+            self.frame_url,
+            values=UPLINK_LIMITS,
+            variable=self.limit_var,
+            width=120,
+            height=28,
+            font=Theme.FONT_SMALL,
+            fg_color=Theme.BG_INPUT,
+            button_color=Theme.ACCENT,
+            button_hover_color=Theme.ACCENT_HOVER,
+            corner_radius=Theme.RADIUS_SM,
+            command=self._on_limit_changed
+        )
+        self.option_limit.place(relx=1.0, rely=0.5, x=-Theme.PAD_MD, anchor="e")
+
         # Controls card
         self.frame_controls = ctk.CTkFrame(
             self, 
@@ -114,7 +143,8 @@ class SenderApp(ctk.CTkFrame):
             button_color=Theme.ACCENT,
             button_hover_color=Theme.ACCENT_HOVER,
             dropdown_fg_color=Theme.BG_CARD,
-            corner_radius=Theme.RADIUS_SM
+            corner_radius=Theme.RADIUS_SM,
+            command=self._on_camera_selected
         )
         self.combo_camera.pack(side="left", padx=Theme.PAD_XS)
 
@@ -144,6 +174,54 @@ class SenderApp(ctk.CTkFrame):
         )
         self.btn_toggle.pack(side="right", padx=Theme.PAD_XS)
 
+        # 配信中のJPEGをそのまま録画（エンコード済みデータを非同期に書き出す）
+        self.record_var = ctk.BooleanVar(value=False)
+        self.check_record = ctk.CTkCheckBox(
+            self.frame_controls_inner,
+            text="Record",
+            variable=self.record_var,
+            font=Theme.FONT_SMALL,
+            text_color=Theme.TEXT_SECONDARY,
+            fg_color=Theme.ACCENT,
+            hover_color=Theme.ACCENT_HOVER,
+            corner_radius=Theme.RADIUS_SM,
+            command=self._on_record_toggled
+        )
+        self.check_record.pack(side="right", padx=Theme.PAD_SM)
+
+        # 他のカメラを開いたままにして配信中の切り替えを即時にする（CPU・電力を消費）
+        self.warm_var = ctk.BooleanVar(value=False)
+        self.check_warm = ctk.CTkCheckBox(
+            self.frame_controls_inner,
+            text="Keep warm",
+            variable=self.warm_var,
+            font=Theme.FONT_SMALL,
+            text_color=Theme.TEXT_SECONDARY,
+            fg_color=Theme.ACCENT,
+            hover_color=Theme.ACCENT_HOVER,
+            corner_radius=Theme.RADIUS_SM,
+            command=self._on_warm_toggled
+        )
+        self.check_warm.pack(side="right", padx=Theme.PAD_SM)
+
+        # キャプチャ・エンコードと配信を別プロセスで動かす（UIが固まっても配信は続く）
+        self.process_var = ctk.BooleanVar(value=False)
+        self.check_process = ctk.CTkCheckBox(
+            self.frame_controls_inner,
+            text="Separate process",
+            variable=self.process_var,
+            font=Theme.FONT_SMALL,
+            text_color=Theme.TEXT_SECONDARY,
+            fg_color=Theme.ACCENT,
+            hover_color=Theme.ACCENT_HOVER,
+            corner_radius=Theme.RADIUS_SM
+        )
+        self.check_process.pack(side="right", padx=Theme.PAD_SM)
+
+        # 性能パネル（展開中のみ1秒ごとに更新）
+        self.stats_panel = StatsPanel(self, self._get_stats_rows, counters=self._get_stats_counters)
+        self.stats_panel.pack(fill="x", padx=Theme.PAD_LG, pady=Theme.PAD_XS)
+
         # Preview area
         self.frame_preview = ctk.CTkFrame(
             self, 
@@ -252,14 +330,24 @@ class SenderApp(ctk.CTkFrame):
         self.btn_refresh.configure(state="disabled")
 
         cam_id = self.get_selected_camera_id()
+        separate = self.process_var.get()
+        self.check_process.configure(state="disabled")
 
         def worker():
             try:
-                camera = Camera(camera_id=cam_id)
-                camera.start()
-
-                server = StreamServer(camera)
-                server.start()
+                if separate:
+                    # GUIプロセスはプレビュー用にリングを読むだけ
+                    server = WorkerSender(cam_id, max_bitrate=self._get_uplink_limit(),
+                                          on_failure=lambda message: self.master.after(
+                                              0, lambda: self._on_worker_failed(server, message)))
+                    server.start()
+                    camera = server.camera
+                else:
+                    camera = Camera(camera_id=cam_id)
+                    camera.start()
+
+                    server = StreamServer(camera, max_bitrate=self._get_uplink_limit(), shared_memory=True)
+                    server.start()
             except Exception as e:
                 self.master.after(0, lambda: self._on_start_failed(e))
                 return
@@ -279,8 +367,14 @@ class SenderApp(ctk.CTkFrame):
             hover_color=Theme.ACCENT_DANGER_HOVER,
             state="normal"
         )
-        self.combo_camera.configure(state="disabled")
+        # 配信中もカメラ選択で切り替え可能
+        self.combo_camera.configure(state="readonly")
         self.btn_refresh.configure(state="disabled")
+        self.switcher = server if isinstance(server, WorkerSender) else CameraSwitcher(server)
+        if self.warm_var.get():
+            self._start_warm_pool()
+        if self.record_var.get():
+            self._start_recording()
         self.update_preview()
 
     def _on_start_failed(self, error):
@@ -294,13 +388,144 @@ class SenderApp(ctk.CTkFrame):
         )
         self.combo_camera.configure(state="readonly")
         self.btn_refresh.configure(state="normal")
+        self.check_process.configure(state="normal")
         print(f"Error starting stream: {error}")
 
+    def _on_worker_failed(self, server, message):
+        """別プロセス構成の子プロセスが落ちて復旧できなかった（配信を止める）"""
+        if self.server is not server or not self.is_running:
+            return
+        print(f"Streaming stopped: {message}")
+        self.stop_streaming()
+
+    def _start_recording(self):
+        if self.recorder or not self.camera:
+            return
+        recorder = StreamRecorder(prefix="sender")
+        try:
+            recorder.start()
+        except OSError as e:
+            print(f"Recording failed: {e}")
+            self.record_var.set(False)
+            return
+        self.recorder = recorder
+        self.camera.add_listener(recorder.write)
+
+    def _stop_recording(self):
+        recorder = self.recorder
+        if not recorder:
+            return
+        self.recorder = None
+        if self.camera:
+            self.camera.remove_listener(recorder.write)
+        # 残りの書き出しを待つためUIスレッド外で停止
+        threading.Thread(target=recorder.stop, daemon=True).start()
+
+    def _on_record_toggled(self):
+        if not self.is_running:
+            return
+        if self.record_var.get():
+            self._start_recording()
+        else:
+            self._stop_recording()
+
+    def _get_stats_counters(self):
+        stats = self.server.get_stats() if self.server else None
+        if not stats:
+            return {"frames": 0, "bytes": 0}
+        return {"frames": stats["frames_sent"], "bytes": stats["bytes_sent"]}
+
+    def _get_stats_rows(self, rates):
+        camera = self.server.camera if self.server else self.camera
+        stats = self.server.get_stats() if self.server else None
+        if not camera or not stats:
+            return [("status", "not streaming")]
+        frame_kb = rates["bytes"] / rates["frames"] / 1024 if rates["frames"] else 0.0
+        drops = stats["frames_dropped"] + (self.recorder.frames_dropped if self.recorder else 0)
+        encoder = getattr(camera, 'jpeg_encoder', None)
+        encoder_name = encoder.name if encoder else getattr(camera, 'encoder_name', None)
+        return [
+            ("capture", f"{camera.fps:.1f} fps"),
+            ("output", f"{rates['frames']:.1f} fps"),
+            ("encode", f"{camera.encode_ms:.1f} ms"),
+            ("send", f"{stats['send_ms']:.1f} ms"),
+            ("preview", f"{self.stage_times.get('preview'):.1f} ms"),
+            ("bitrate", f"{rates['bytes'] * 8 / 1e6:.2f} Mbps"),
+            ("frame", f"{frame_kb:.0f} KB"),
+            ("clients", str(stats["clients"])),
+            ("drops", str(drops)),
+            ("encoder", encoder_name or "-"),
+        ]
+
+    def _get_uplink_limit(self):
+        value = self.limit_var.get()
+        return float(value.split()[0]) * 1e6 if value != UPLINK_LIMITS[0] else None
+
+    def _on_limit_changed(self, choice):
+        if self.server:
+            self.server.set_rate_limits(max_bitrate=self._get_uplink_limit())
+
+    def _on_camera_selected(self, choice):
+        """配信中にカメラが選ばれたら、受信側を切断せずに切り替える"""
+        if not self.is_running or not self.switcher or not self.camera:
+            return
+        cam_id = self.get_selected_camera_id()
+        if cam_id == self.camera.camera_id:
+            return
+
+        def on_done(camera, error):
+            self.master.after(0, lambda: self._on_switch_done(camera, error))
+
+        if self.switcher.switch(cam_id, on_done=on_done):
+            self.combo_camera.configure(state="disabled")
+
+    def _on_switch_done(self, camera, error):
+        if not self.is_running:
+            return
+        if camera:
+            self.camera = camera
+        else:
+            print(f"Camera switch failed: {error}")
+            # 選択を現在配信中のカメラに戻す
+            for cam in self.camera_list:
+                if self.camera and cam['id'] == self.camera.camera_id:
+                    self.camera_var.set(cam['name'])
+        self.combo_camera.configure(state="readonly")
+
+    def _start_warm_pool(self):
+        # 別プロセス構成ではキャプチャプロセスを切り替え時に起動する（ウォームプールなし）
+        if not self.switcher or self.switcher.pool or isinstance(self.switcher, WorkerSender):
+            return
+        pool = WarmCameraPool()
+        self.switcher.pool = pool
+        current = self.camera.camera_id if self.camera else None
+        others = [cam['id'] for cam in self.camera_list if cam['id'] != current]
+        threading.Thread(target=pool.warm, args=(others,), daemon=True).start()
+
+    def _stop_warm_pool(self):
+        if self.switcher and self.switcher.pool:
+            pool = self.switcher.pool
+            self.switcher.pool = None
+            threading.Thread(target=pool.close, daemon=True).start()
+
+    def _on_warm_toggled(self):
+        if not self.is_running:
+            return
+        if self.warm_var.get():
+            self._start_warm_pool()
+        else:
+            self._stop_warm_pool()
+
     def stop_streaming(self):
         if self._stopping:
             return
         self.is_running = False
         self._stopping = True
+        self._stop_recording()
+        if self.switcher:
+            # 以降の切り替え完了ではソースを差し替えない（プールも閉じる）
+            self.switcher.close()
+            self.switcher = None
         
         if self.preview_update_id:
             self.after_cancel(self.preview_update_id)
@@ -318,12 +543,14 @@ class SenderApp(ctk.CTkFrame):
         self.preview_canvas.itemconfig(self.preview_text, text="Camera Preview")
 
         def worker():
+            # 切り替え直後でもサーバーが保持している現在のソースを止める
+            camera = self.server.camera if self.server else self.camera
             if self.server:
                 self.server.stop()
                 self.server = None
-            if self.camera:
-                self.camera.stop()
-                self.camera = None
+            if camera:
+                camera.stop()
+            self.camera = None
             self.master.after(0, self._on_stop_complete)
 
         threading.Thread(target=worker, daemon=True).start()
@@ -333,6 +560,7 @@ class SenderApp(ctk.CTkFrame):
         if not self.is_running and not self._starting:
             self.btn_toggle.configure(state="normal")
             self.combo_camera.configure(state="readonly")
+            self.check_process.configure(state="normal")
             if not self._refreshing:
                 self.btn_refresh.configure(state="normal")
 
@@ -370,8 +598,12 @@ class SenderApp(ctk.CTkFrame):
             self.preview_update_id = self.after(100, self.update_preview)
             return
 
-        frame = self.camera.get_frame_view()
+        # 描画中にキャプチャ側でバッファが再利用されないよう参照を持つ
+        slot = self.camera.acquire_frame()
+        frame = slot.array if slot else None
         if frame is not None:
+            draw_start = time.perf_counter()
+            span = tracing.begin()
             try:
                 # Resize for preview (keep aspect ratio) using cv2 for performance
                 canvas_width = self.preview_canvas.winfo_width()
@@ -400,8 +632,12 @@ class SenderApp(ctk.CTkFrame):
                 x = canvas_width // 2
                 y = canvas_height // 2
                 self.preview_canvas.create_image(x, y, image=self.photo_image, tag="preview")
+                self.stage_times.since('preview', draw_start)
+                tracing.end("preview draw", span, self.camera.frame_seq)
             except Exception as e:
                 print(f"Preview error: {e}")
+        if slot:
+            slot.release()
         
         self.preview_update_id = self.after(30, self.update_preview)
 
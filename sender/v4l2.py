@@ -0,0 +1,149 @@
+import ctypes
+import ctypes.util
+import os
+import re
+import struct
+import threading
+
+# Linux: デバイスを開かずに sysfs からV4L2カメラを列挙する
+SYSFS_ROOT = "/sys/class/video4linux"
+DEV_ROOT = "/dev"
+
+_VIDEO_NODE = re.compile(r"^video(\d+)$")
+
+# inotify (sys/inotify.h)
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+def list_v4l2_devices(sysfs_root=SYSFS_ROOT, dev_root=DEV_ROOT):
+    """V4L2のキャプチャデバイス一覧を [{'id', 'name', 'path'}] で返す
+
+    1台のカメラは映像用とメタデータ用など複数のノードを持つことがあるため、
+    sysfs の index が0のノードだけを採用する。ルートを差し替えれば
+    偽のsysfsツリーに対しても動作する。
+    """
+    try:
+        entries = os.listdir(sysfs_root)
+    except OSError:
+        return []
+
+    devices = []
+    for entry in entries:
+        match = _VIDEO_NODE.match(entry)
+        if not match:
+            continue
+        node = os.path.join(sysfs_root, entry)
+        if _read_attr(node, "index", "0") != "0":
+            continue
+        path = os.path.join(dev_root, entry)
+        if not os.path.exists(path):
+            continue
+        devices.append({
+            "id": int(match.group(1)),
+            "name": _read_attr(node, "name", entry),
+            "path": path,
+        })
+    devices.sort(key=lambda d: d["id"])
+    return devices
+
+
+def _read_attr(node, attr, default):
+    try:
+        with open(os.path.join(node, attr), encoding="utf-8", errors="replace") as f:
+            return f.read().strip() or default
+    except OSError:
+        return default
+
+
+class DeviceWatcher:
+    """/dev の videoN ノードの追加・削除（ホットプラグ）を検出する
+
+    inotify が使えればノンブロッキングで溜まったイベントを読むだけ。
+    使えない環境では videoN ノード名の一覧を比較する。
+    """
+
+    def __init__(self, dev_root=DEV_ROOT):
+        self.dev_root = dev_root
+        self._fd = None
+        self._libc = None
+        self._signature = None
+        self._primed = False
+        self._init_inotify()
+
+    def _init_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return
+            if libc.inotify_add_watch(fd, self.dev_root.encode(), IN_CREATE | IN_DELETE) < 0:
+                os.close(fd)
+                return
+        except (OSError, AttributeError):
+            return
+        self._libc = libc
+        self._fd = fd
+
+    def _node_signature(self):
+        try:
+            return tuple(sorted(n for n in os.listdir(self.dev_root) if _VIDEO_NODE.match(n)))
+        except OSError:
+            return ()
+
+    def changed(self):
+        """前回の呼び出し以降にvideoノードが増減したか（初回はTrue）"""
+        if self._fd is None:
+            signature = self._node_signature()
+            changed = signature != self._signature
+            self._signature = signature
+            return changed
+
+        changed = not self._primed
+        self._primed = True
+        while True:
+            try:
+                data = os.read(self._fd, 4096)
+            except BlockingIOError:
+                break
+            except OSError:
+                return True
+            if not data:
+                break
+            offset = 0
+            while offset + _EVENT_HEADER.size <= len(data):
+                _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                start = offset + _EVENT_HEADER.size
+                name = data[start:start + length].split(b"\0", 1)[0].decode(errors="replace")
+                if _VIDEO_NODE.match(name):
+                    changed = True
+                offset = start + length
+        return changed
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class V4L2CameraCache:
+    """列挙結果をキャッシュし、ホットプラグ時だけ再スキャンする"""
+
+    def __init__(self, sysfs_root=SYSFS_ROOT, dev_root=DEV_ROOT):
+        self.sysfs_root = sysfs_root
+        self.dev_root = dev_root
+        self._watcher = DeviceWatcher(dev_root)
+        self._devices = None
+        self._lock = threading.Lock()
+
+    def get_devices(self, force=False):
+        with self._lock:
+            if force or self._watcher.changed() or self._devices is None:
+                self._devices = list_v4l2_devices(self.sysfs_root, self.dev_root)
+            return list(self._devices)
+
+    def close(self):
+        self._watcher.close()
@@ -0,0 +1,613 @@
+"""キャプチャ・エンコードと配信を別プロセスで動かす構成（任意）
+
+    GUIプロセス ─ 制御(Pipe) ─┬─ キャプチャプロセス: Camera → 共有メモリのリング
+                               └─ 配信プロセス: リング → StreamServer
+    プレビューはGUIプロセスがリングを直接読む。
+
+配信ハンドラのループやTkのコールバックがキャプチャと同じGILを取り合わないため、
+キャプチャ間隔が揺れにくい。GUIプロセスが落ちても配信は続き、視聴者がいなくなってから終了する。
+"""
+import multiprocessing
+import multiprocessing.connection
+import re
+import signal
+import sys
+import threading
+import time
+import uuid
+
+from .buffers import BufferPool, JpegPool, frame_factory
+from .shm import ShmPublisher, host_id
+from utils.network import STREAM_PORT
+from utils.shm_ring import ShmRingReader
+from utils import thread_roles
+
+# 制御プロセスがいなくなった後、視聴者がいない状態がこれだけ続いたら終了（s）
+ORPHAN_GRACE = 30.0
+STATS_INTERVAL = 1.0
+READY_TIMEOUT = 15.0
+# キャプチャプロセスが落ちたら起動し直す。この時間内にこの回数を超えて落ちたら諦めて失敗を通知する
+RESTART_LIMIT = 3
+RESTART_WINDOW = 60.0
+
+
+def _next_generation(ring_name):
+    """解像度変更で作り直されたリングの名前（<base>-<世代>）"""
+    match = re.match(r"(.*)-(\d+)$", ring_name)
+    return f"{match.group(1)}-{int(match.group(2)) + 1}" if match else ring_name
+
+
+class ShmSource:
+    """共有メモリのリングを読むフレームソース（StreamServer のcamera互換）
+
+    JPEGは受け取るたびにプールのバッファへコピーし、生フレームは
+    acquire_frame() が呼ばれたときだけコピーする（同じフレームなら共有）。
+    """
+
+    POLL_INTERVAL = 0.002
+
+    def __init__(self, ring_name, camera_id=None, advertise=True):
+        self.ring_name = ring_name
+        self.camera_id = camera_id
+        # ディスカバリー応答でリングを同じホストの受信側へ案内するか
+        self.advertise = advertise
+        self.width = 0
+        self.height = 0
+        self.fps = 0.0
+        self.frame_seq = 0
+        # キャプチャプロセスから転送される統計
+        self.encode_ms = 0.0
+        self.encoder_name = None
+        self._reader = None
+        self._ring_seq = 0
+        # acquire_frame() でコピーする最新フレームの位置 (reader, リング上の連番)
+        self._ring_frame = (None, 0)
+        self._last_timestamp = None
+        self._jpeg_pool = JpegPool()
+        self._jpeg_slot = None
+        self._frame_pool = BufferPool(frame_factory(1, 1))
+        self._frame_slot = None
+        self._frame_slot_seq = 0
+        self._lock = threading.Lock()
+        self._first_frame = threading.Event()
+        self._listeners = ()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        with self._lock:
+            slots = (self._jpeg_slot, self._frame_slot)
+            self._jpeg_slot = self._frame_slot = None
+            reader, self._reader = self._reader, None
+        for slot in slots:
+            if slot is not None:
+                slot.release()
+        if reader:
+            reader.close()
+
+    def attach(self, ring_name, camera_id=None):
+        """別のリング（カメラ切り替え後のキャプチャプロセス）へ切り替える"""
+        with self._lock:
+            self.ring_name = ring_name
+            if camera_id is not None:
+                self.camera_id = camera_id
+
+    def update_stats(self, stats):
+        self.encode_ms = stats.get("encode_ms", self.encode_ms)
+        self.encoder_name = stats.get("encoder", self.encoder_name)
+
+    def _open(self, name):
+        try:
+            # キャプチャプロセスとは制御プロセスの resource_tracker を共有している
+            reader = ShmRingReader(name, shared_tracker=True)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            old, self._reader = self._reader, reader
+            self._ring_seq = 0
+        if old:
+            old.close()
+        return reader
+
+    def _run(self):
+        thread_roles.assign("capture", "shm-source")
+        while self.running:
+            reader = self._reader
+            if reader is None or reader.name != self.ring_name:
+                reader = self._open(self.ring_name)
+                if reader is None:
+                    time.sleep(0.1)
+                    continue
+            reader.touch()
+            item = reader.read(self._ring_seq)
+            if item is None:
+                if reader.closed:
+                    with self._lock:
+                        # 解像度変更なら次の世代が作られる（切り替え済みなら何もしない）
+                        if self.ring_name == reader.name:
+                            self.ring_name = _next_generation(reader.name)
+                    time.sleep(0.1)
+                else:
+                    time.sleep(self.POLL_INTERVAL)
+                continue
+            seq, timestamp, frame, jpeg = item
+            self._ring_seq = seq
+            self._publish(reader, seq, timestamp, frame.shape, jpeg)
+            del item, frame, jpeg
+
+    def _publish(self, reader, seq, timestamp, shape, jpeg):
+        jpeg_slot = self._jpeg_pool.put(jpeg) if jpeg is not None else None
+        if not reader.valid(seq):
+            # コピー中に上書きされた（このプロセスが追いついていない）
+            if jpeg_slot is not None:
+                jpeg_slot.release()
+            return
+        if self._last_timestamp is not None and timestamp > self._last_timestamp:
+            rate = 1.0 / (timestamp - self._last_timestamp)
+            self.fps = self.fps * 0.9 + rate * 0.1 if self.fps else rate
+        self._last_timestamp = timestamp
+
+        old_jpeg = None
+        with self._lock:
+            if jpeg_slot is not None:
+                old_jpeg, self._jpeg_slot = self._jpeg_slot, jpeg_slot
+            self.height, self.width = shape[:2]
+            self._ring_frame = (reader, seq)
+            self.frame_seq += 1
+        if old_jpeg is not None:
+            old_jpeg.release()
+        self._first_frame.set()
+        if jpeg_slot is not None and self._listeners:
+            view = jpeg_slot.view()
+            for listener in self._listeners:
+                listener(view, timestamp)
+
+    def wait_first_frame(self, timeout=5.0):
+        return self._first_frame.wait(timeout)
+
+    def get_listeners(self):
+        return self._listeners
+
+    def add_listener(self, callback):
+        """受け取ったJPEGごとに callback(jpeg, timestamp) を呼ぶ（jpeg は呼び出し中のみ有効）"""
+        self._listeners = self._listeners + (callback,)
+
+    def remove_listener(self, callback):
+        self._listeners = tuple(l for l in self._listeners if l != callback)
+
+    def get_load(self):
+        if not self.fps:
+            return 0.0
+        return min(1.0, self.encode_ms * self.fps / 1000.0)
+
+    def acquire_frame(self):
+        """最新フレームのコピーを参照付きで返す（使用後に release()、なければNone）"""
+        with self._lock:
+            current = self._frame_slot
+            if current is not None and self._frame_slot_seq == self.frame_seq:
+                return current.retain()
+            reader, seq = self._ring_frame
+            item = reader.read_seq(seq) if reader is not None and reader is self._reader else None
+            if item is None:
+                # 既に上書きされた: 直前のコピーを返す
+                return current.retain() if current is not None else None
+            frame = item[1]
+            slot = self._frame_pool.acquire()
+            if slot.array.shape != frame.shape:
+                h, w = frame.shape[:2]
+                self._frame_pool.reset(frame_factory(w, h))
+                slot.array = slot.pool.factory()
+            slot.array[...] = frame
+            del item, frame
+            if not reader.valid(seq):
+                slot.release()
+                return current.retain() if current is not None else None
+            self._frame_slot, self._frame_slot_seq = slot, self.frame_seq
+            slot.retain()
+        if current is not None:
+            current.release()
+        return slot
+
+    def get_frame_view(self):
+        """プレビュー用（数フレーム後に再利用される。時間のかかる処理には acquire_frame() を使う）"""
+        slot = self.acquire_frame()
+        if slot is None:
+            return None
+        slot.release()
+        return slot.array
+
+    def acquire_jpeg(self):
+        with self._lock:
+            return self._jpeg_slot.retain() if self._jpeg_slot is not None else None
+
+    def get_jpeg_frame_direct(self):
+        with self._lock:
+            return self._jpeg_slot.view().tobytes() if self._jpeg_slot is not None else None
+
+    def shm_status(self):
+        """ディスカバリー応答用: 同じホストの受信側はキャプチャプロセスのリングを直接読める"""
+        if not self.advertise or self._reader is None:
+            return None
+        return {"name": self.ring_name, "host": host_id()}
+
+
+def _init_worker():
+    # Ctrl+C は制御プロセスが受けて停止を指示する。SIGTERM では後始末してから終了
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+
+def _control_loop(conn, handlers, stats, has_viewers):
+    """制御プロセスからのコマンドを処理し、定期的に統計を送る
+
+    制御プロセスがいなくなっても（GUIのクラッシュなど）、視聴者がいる間は動き続ける。
+    """
+    orphan_since = None
+    next_stats = time.monotonic() + STATS_INTERVAL
+    while True:
+        if orphan_since is None:
+            try:
+                if conn.poll(max(0.0, next_stats - time.monotonic())):
+                    command, arg = conn.recv()
+                    if command == "stop":
+                        return
+                    handlers[command](arg)
+                if time.monotonic() >= next_stats:
+                    next_stats += STATS_INTERVAL
+                    conn.send(("stats", stats()))
+            except (EOFError, OSError):
+                print("Control process is gone; streaming continues while there are viewers")
+                orphan_since = time.monotonic()
+            continue
+        time.sleep(STATS_INTERVAL)
+        if has_viewers():
+            orphan_since = time.monotonic()
+        elif time.monotonic() - orphan_since > ORPHAN_GRACE:
+            print("No viewers left, exiting")
+            return
+
+
+def _send(conn, message):
+    try:
+        conn.send(message)
+    except (EOFError, OSError):
+        pass
+
+
+def capture_worker(conn, ring_base, camera_id, encoder="auto", jpeg_options=None, filters=None,
+                   filter_budget=None):
+    """キャプチャプロセス: カメラを開き、フレームとエンコード済みJPEGをリングへ書き込む
+
+    filters はフィルター指定の文字列（スレッドプールを持つパイプラインは渡せないためこのプロセスで作る）。
+    """
+    from .camera import Camera
+    from utils.filters import DEFAULT_BUDGET_MS, FilterPipeline, parse_filters
+
+    _init_worker()
+    pipeline = FilterPipeline(parse_filters(filters), filter_budget or DEFAULT_BUDGET_MS) if filters else None
+    camera = Camera(camera_id=camera_id, encoder=encoder, jpeg_options=jpeg_options, filters=pipeline)
+    publisher = ShmPublisher(ring_base)
+    try:
+        camera.start()
+        publisher.attach(camera)
+        if not camera.wait_first_frame(READY_TIMEOUT):
+            raise RuntimeError(f"Camera {camera_id} produced no frames")
+        conn.send(("ready", {"ring": publisher.name}))
+
+        def stats():
+            encoder = camera.jpeg_encoder
+            return {"fps": camera.fps, "encode_ms": camera.encode_ms,
+                    "encoder": encoder.name if encoder else None, "ring": publisher.name,
+                    "filters": pipeline.describe() if pipeline else None}
+
+        def has_viewers():
+            writer = publisher.writer
+            return writer is not None and writer.has_readers()
+
+        _control_loop(conn, {}, stats, has_viewers)
+    except Exception as e:
+        _send(conn, ("error", str(e)))
+    finally:
+        publisher.close()
+        camera.stop()
+        if pipeline:
+            pipeline.close()
+
+
+def serve_worker(conn, ring_name, camera_id, port, renditions, max_bitrate, client_bitrate, name,
+                 shared_memory=True):
+    """配信プロセス: リングを読んで StreamServer で配信する"""
+    from .server import StreamServer
+
+    _init_worker()
+    source = ShmSource(ring_name, camera_id, advertise=shared_memory)
+    source.start()
+    server = StreamServer(source, port=port, renditions=renditions, max_bitrate=max_bitrate,
+                          client_bitrate=client_bitrate, name=name)
+    try:
+        if not source.wait_first_frame(READY_TIMEOUT):
+            raise RuntimeError("No frames from the capture process")
+        server.start()
+        conn.send(("ready", {"port": port}))
+        handlers = {
+            "attach": lambda arg: source.attach(*arg),
+            "limits": lambda arg: server.set_rate_limits(*arg),
+            "source_stats": source.update_stats,
+        }
+        _control_loop(conn, handlers, server.get_stats, lambda: server.get_client_count() > 0)
+    except Exception as e:
+        _send(conn, ("error", str(e)))
+    finally:
+        server.stop()
+        source.stop()
+
+
+class WorkerSender:
+    """GUI（制御）プロセス側: キャプチャ・配信プロセスを起動・制御し、プレビュー用のソースを持つ
+
+    StreamServer と CameraSwitcher の代わりに使えるよう、camera・get_stats・
+    set_rate_limits・switch・close・stop を同じ形で提供する（ウォームプールはなし）。
+    キャプチャプロセスが落ちたら同じカメラで起動し直す。配信プロセスが落ちた、または起動し直せなかった
+    場合は on_failure(メッセージ) を監視スレッドから呼ぶ（呼び出し側で停止・表示する）。
+    """
+
+    def __init__(self, camera_id, port=STREAM_PORT, renditions=None, max_bitrate=None, client_bitrate=None,
+                 encoder="auto", jpeg_options=None, name="WebCamShare", shared_memory=True, filters=None,
+                 filter_budget=None, on_failure=None):
+        self.camera_id = camera_id
+        self.port = port
+        self.renditions = renditions
+        self.max_bitrate = max_bitrate
+        self.client_bitrate = client_bitrate
+        self.encoder = encoder
+        self.jpeg_options = jpeg_options
+        # キャプチャプロセスで適用するフィルターの指定（"denoise,blur" 形式）と予算（ms）
+        self.filters = filters
+        self.filter_budget = filter_budget
+        self.name = name
+        # shared_memory=False: 同じホストの受信側にキャプチャプロセスのリングを案内しない
+        self.shared_memory = shared_memory
+        self.id = uuid.uuid4().hex[:8]
+        self._context = multiprocessing.get_context("spawn")
+        self._captures = 0
+        self._capture = None
+        self._serve = None
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._switching = False
+        # プレビュー・録画用にGUIプロセスでもリングを読む
+        self.camera = None
+        self.pool = None
+        self.stats = {}
+        self.capture_stats = {}
+        self.on_failure = on_failure
+        # 復旧できなかった子プロセスの異常終了（Noneなら正常）
+        self.error = None
+        self._restarts = []
+        self.closed = False
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """キャプチャ→配信の順に起動し、準備ができるまで待つ（ブロッキング）"""
+        capture, ring = self._start_capture(self.camera_id)
+        self._capture = capture
+        try:
+            process, conn = self._spawn(serve_worker, "webcamshare-serve", ring, self.camera_id, self.port,
+                                        self.renditions, self.max_bitrate, self.client_bitrate, self.name,
+                                        self.shared_memory)
+            self._serve = (process, conn)
+            self._wait_ready(process, conn)
+            self.camera = ShmSource(ring, self.camera_id)
+            self.camera.start()
+        except Exception:
+            self.stop()
+            raise
+        self.running = True
+        self.thread = threading.Thread(target=self._monitor, daemon=True)
+        self.thread.start()
+
+    def _spawn(self, target, name, *args):
+        parent_conn, child_conn = self._context.Pipe()
+        # daemon=False: 制御プロセスが異常終了しても道連れにしない
+        process = self._context.Process(target=target, args=(child_conn,) + args, name=name, daemon=False)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _wait_ready(self, process, conn):
+        if not conn.poll(READY_TIMEOUT):
+            raise RuntimeError(f"{process.name} did not start")
+        try:
+            kind, info = conn.recv()
+        except EOFError:
+            raise RuntimeError(f"{process.name} exited during startup")
+        if kind == "error":
+            raise RuntimeError(info)
+        return info
+
+    def _start_capture(self, camera_id):
+        self._captures += 1
+        ring_base = f"wcs-{self.id}-c{self._captures}"
+        process, conn = self._spawn(capture_worker, "webcamshare-capture", ring_base, camera_id,
+                                    self.encoder, self.jpeg_options, self.filters, self.filter_budget)
+        try:
+            info = self._wait_ready(process, conn)
+        except Exception:
+            self._stop_process(process, conn)
+            raise
+        return (process, conn), info["ring"]
+
+    def _command(self, target, command, arg=None):
+        if target is None:
+            return
+        with self._send_lock:
+            _send(target[1], (command, arg))
+
+    def _stop_process(self, process, conn, timeout=5.0):
+        with self._send_lock:
+            _send(conn, ("stop", None))
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout)
+        conn.close()
+
+    def _monitor(self):
+        """子プロセスの統計を受け取る（キャプチャの統計は配信プロセスにも転送）"""
+        while self.running:
+            targets = [t for t in (self._capture, self._serve) if t is not None]
+            try:
+                ready = multiprocessing.connection.wait([conn for _, conn in targets], timeout=STATS_INTERVAL)
+            except (OSError, ValueError):
+                # 切り替え・停止で閉じられた
+                continue
+            for process, conn in targets:
+                if conn not in ready:
+                    continue
+                try:
+                    kind, info = conn.recv()
+                except (EOFError, OSError):
+                    if self.running:
+                        self._on_exit(process, conn)
+                    continue
+                if kind == "error":
+                    print(f"{process.name} error: {info}")
+                    continue
+                if kind != "stats":
+                    continue
+                if (process, conn) == self._capture:
+                    self.capture_stats = info
+                    source_stats = {"encode_ms": info["encode_ms"], "encoder": info["encoder"]}
+                    if self.camera:
+                        self.camera.update_stats(source_stats)
+                    self._command(self._serve, "source_stats", source_stats)
+                else:
+                    self.stats = info
+
+    def _on_exit(self, process, conn):
+        """子プロセスが落ちた: 監視対象から外し、キャプチャなら起動し直す"""
+        with self._lock:
+            if (process, conn) == self._capture:
+                self._capture = None
+            elif (process, conn) == self._serve:
+                self._serve = None
+            else:
+                # 切り替え・停止で入れ替わった古いプロセス
+                return
+            switching = self._switching
+        process.join(1.0)
+        conn.close()
+        message = f"{process.name} exited unexpectedly (exit code {process.exitcode})"
+        if process.name == "webcamshare-serve":
+            self._fail(message)
+            return
+        print(message)
+        if not switching:
+            # 切り替え中なら新しいキャプチャプロセスがそのまま引き継ぐ
+            self._restart_capture()
+
+    def _restart_capture(self):
+        now = time.monotonic()
+        self._restarts = [t for t in self._restarts if now - t < RESTART_WINDOW] + [now]
+        if len(self._restarts) > RESTART_LIMIT:
+            self._fail(f"Capture process keeps exiting ({RESTART_LIMIT} restarts in {RESTART_WINDOW:.0f} s)")
+            return
+        try:
+            capture, ring = self._start_capture(self.camera_id)
+        except Exception as e:
+            self._fail(f"Could not restart capture: {e}")
+            return
+        with self._lock:
+            if self.closed or not self.running or self._capture is not None:
+                # 停止された、または待っている間に切り替えで別のプロセスになった
+                replaced = True
+            else:
+                replaced = False
+                self._capture = capture
+                self._command(self._serve, "attach", (ring, self.camera_id))
+                self.camera.attach(ring, self.camera_id)
+        if replaced:
+            self._stop_process(*capture)
+        else:
+            print(f"Capture process restarted ({ring})")
+
+    def _fail(self, message):
+        print(message)
+        self.error = message
+        if self.on_failure:
+            self.on_failure(message)
+
+    @property
+    def switching(self):
+        return self._switching
+
+    def switch(self, camera_id, on_done=None):
+        """CameraSwitcher.switch と同じ。新しいキャプチャプロセスの準備ができてから切り替える"""
+        with self._lock:
+            if self._switching or self.closed:
+                return False
+            self._switching = True
+        threading.Thread(target=self._switch_worker, args=(camera_id, on_done), daemon=True).start()
+        return True
+
+    def _switch_worker(self, camera_id, on_done):
+        source = None
+        error = None
+        try:
+            capture, ring = self._start_capture(camera_id)
+            with self._lock:
+                if self.closed:
+                    self._stop_process(*capture)
+                    return
+                old, self._capture = self._capture, capture
+                self._command(self._serve, "attach", (ring, camera_id))
+                self.camera.attach(ring, camera_id)
+                self.camera_id = camera_id
+            if old is not None:
+                # 切り替え中に落ちていれば監視スレッドが片付け済み
+                self._stop_process(*old)
+            source = self.camera
+        except Exception as e:
+            error = e
+        finally:
+            self._switching = False
+            if on_done:
+                on_done(source, error)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+
+    def get_stats(self):
+        return self.stats or None
+
+    def get_client_count(self):
+        return self.stats.get("clients", 0)
+
+    def set_rate_limits(self, max_bitrate=None, client_bitrate=None):
+        self.max_bitrate, self.client_bitrate = max_bitrate, client_bitrate
+        self._command(self._serve, "limits", (max_bitrate, client_bitrate))
+
+    def stop(self):
+        self.running = False
+        self.close()
+        # 配信を先に止め、読み手がいなくなってからキャプチャを止める
+        for target in (self._serve, self._capture):
+            if target is not None:
+                self._stop_process(*target)
+        self._serve = self._capture = None
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.camera:
+            self.camera.stop()
@@ -0,0 +1,271 @@
+"""フレームごとの処理のマイクロベンチマーク
+
+480p / 720p / 1080p / 4K の合成フレームで、コードベース中の毎フレーム処理
+（JPEGエンコード・デコード、プレビュー用の縮小と色変換、仮想カメラ出力の変換、
+StreamClient の multipart 解析、PhotoImage生成、画像フィルターの各実装）を計測し、JSONに保存する。
+
+    python tools/bench_frame_ops.py run                       # 計測して表示
+    python tools/bench_frame_ops.py run --output new.json --filter encode
+    python tools/bench_frame_ops.py run --save                # ベースラインとして保存
+    python tools/bench_frame_ops.py compare old.json new.json # 回帰があれば終了コード1
+    python tools/bench_frame_ops.py compare                   # ベースラインと今回の計測を比較
+
+処理時間はマシンに強く依存するため、ベースライン（tools/baselines/frame_ops.json）はリポジトリに含めない。
+引数なしの compare の前に、比較に使うマシンで一度 run --save を実行しておく（なければ終了コード2）。
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cv2
+import numpy as np
+
+from synthetic import make_test_frame
+
+BASELINE = Path(__file__).resolve().parent / "baselines" / "frame_ops.json"
+
+RESOLUTIONS = {
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "4k": (3840, 2160),
+}
+QUALITIES = (50, 70, 85, 95)
+PREVIEW_SIZE = (640, 360)
+INTERPOLATIONS = {
+    "linear": cv2.INTER_LINEAR,  # cv2.resize の既定
+    "area": cv2.INTER_AREA,
+    "nearest": cv2.INTER_NEAREST,
+}
+CHUNK_SIZES = (16384, 65536, 262144)
+
+
+def measure(func, min_time=0.3, max_iterations=200):
+    """func の1回あたりの所要時間（ms）を繰り返し計測し、中央値とp95を返す"""
+    func()  # ウォームアップ
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < 3 or (time.perf_counter() < deadline and len(samples) < max_iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "iterations": len(samples),
+    }
+
+
+class _FakeStream:
+    """requests のレスポンスの代わりに、用意したバイト列を固定サイズで返す"""
+
+    def __init__(self, data, chunk_size):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    def iter_content(self, chunk_size=None):
+        view = memoryview(self.data)
+        for i in range(0, len(view), self.chunk_size):
+            yield bytes(view[i:i + self.chunk_size])
+
+
+def bench_encoders(frame, label, results):
+    from sender.encoders import JpegOptions, available_encoders
+
+    for encoder in available_encoders():
+        for quality in QUALITIES:
+            options = JpegOptions(quality=quality)
+            jpeg = encoder.encode(frame, options)
+            result = measure(lambda: encoder.encode(frame, options))
+            result["bytes"] = len(jpeg)
+            results[f"encode/{encoder.name}/q{quality}/{label}"] = result
+
+
+def bench_decode(frame, label, results):
+    for quality in QUALITIES:
+        jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+        buf = np.frombuffer(jpeg, np.uint8)
+        results[f"decode/q{quality}/{label}"] = measure(lambda: cv2.imdecode(buf, cv2.IMREAD_COLOR))
+
+
+def bench_preview(frame, label, results):
+    h, w = frame.shape[:2]
+    ratio = min(PREVIEW_SIZE[0] / w, PREVIEW_SIZE[1] / h)
+    size = (int(w * ratio), int(h * ratio))
+    for name, interpolation in INTERPOLATIONS.items():
+        results[f"preview_resize/{name}/{label}"] = measure(
+            lambda: cv2.resize(frame, size, interpolation=interpolation))
+    small = cv2.resize(frame, size)
+    results[f"preview_bgr2rgb/{label}"] = measure(lambda: cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+    # 360p レンディション（RenditionEncoder と同じ INTER_AREA）
+    rendition_size = (int(round(w * 360 / h / 2)) * 2, 360)
+    results[f"rendition_resize/area/{label}"] = measure(
+        lambda: cv2.resize(frame, rendition_size, interpolation=cv2.INTER_AREA))
+
+
+def bench_vcam(frame, label, results):
+    """VirtualCamera.send_frame の変換（1280x720 出力へのリサイズとBGR→RGB）"""
+    def convert():
+        out = frame
+        if out.shape[1] != 1280 or out.shape[0] != 720:
+            out = cv2.resize(out, (1280, 720))
+        return cv2.cvtColor(out, cv2.COLOR_BGR2RGB)
+
+    results[f"vcam_convert/{label}"] = measure(convert)
+    results[f"vcam_bgr2rgb/{label}"] = measure(lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+def bench_parse(frame, label, results, frames_per_run=30):
+    """StreamClient.get_jpeg_frames の multipart 解析（ネットワークなし）"""
+    from receiver.client import StreamClient
+
+    jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+    part = (b"--frame\r\nContent-Type: image/jpeg\r\n"
+            + f"Content-Length: {len(jpeg)}\r\n\r\n".encode() + jpeg + b"\r\n")
+    data = part * frames_per_run
+
+    for chunk_size in CHUNK_SIZES:
+        def parse():
+            client = StreamClient("http://bench/stream.mjpg")
+            client.running = True
+            client.stream = _FakeStream(data, chunk_size)
+            count = sum(1 for _ in client.get_jpeg_frames())
+            assert count == frames_per_run, count
+
+        result = measure(parse)
+        # 1フレームあたりに換算
+        result["median_ms"] = round(result["median_ms"] / frames_per_run, 4)
+        result["p95_ms"] = round(result["p95_ms"] / frames_per_run, 4)
+        results[f"parse/chunk{chunk_size // 1024}k/{label}"] = result
+
+
+def bench_filters(frame, label, results):
+    """utils.filters の各実装（1フレームあたり、横帯分割なし）"""
+    from utils.filters import FILTERS
+
+    h = frame.shape[0]
+    for cls in FILTERS.values():
+        f = cls()
+        for variant in f.variants:
+            results[f"filter/{f.name}/{variant}/{label}"] = measure(
+                lambda: f.apply(frame, variant, (0, h), f.prepare(frame, variant)))
+
+
+def bench_photoimage(frame, label, results, root):
+    from PIL import Image, ImageTk
+
+    h, w = frame.shape[:2]
+    ratio = min(PREVIEW_SIZE[0] / w, PREVIEW_SIZE[1] / h)
+    rgb = cv2.cvtColor(cv2.resize(frame, (int(w * ratio), int(h * ratio))), cv2.COLOR_BGR2RGB)
+    results[f"photoimage/{label}"] = measure(lambda: ImageTk.PhotoImage(Image.fromarray(rgb), master=root))
+
+
+def run(args):
+    root = None
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+    except Exception as e:
+        print(f"PhotoImage benchmark skipped (no display: {e})")
+
+    results = {}
+    groups = [bench_encoders, bench_decode, bench_preview, bench_vcam, bench_parse, bench_filters]
+    for label in args.resolutions.split(","):
+        width, height = RESOLUTIONS[label]
+        frame = make_test_frame(width, height)
+        for group in groups:
+            group(frame, label, results)
+        if root is not None:
+            bench_photoimage(frame, label, results, root)
+    if root is not None:
+        root.destroy()
+
+    if args.filter:
+        results = {k: v for k, v in results.items() if args.filter in k}
+
+    for name, result in results.items():
+        extra = f"  {result['bytes'] // 1024:6d} KB" if "bytes" in result else ""
+        print(f"{name:<40} {result['median_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms{extra}")
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(base, new, threshold):
+    """中央値が threshold を超えて遅くなった項目を回帰として返す"""
+    regressions = []
+    for name, result in sorted(new["results"].items()):
+        old = base["results"].get(name)
+        if not old or not old["median_ms"]:
+            continue
+        change = result["median_ms"] / old["median_ms"] - 1
+        mark = ""
+        if change > threshold:
+            mark = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            mark = "  improved"
+        print(f"{name:<40} {old['median_ms']:9.3f} -> {result['median_ms']:9.3f} ms  {change:+7.1%}{mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--resolutions", default=",".join(RESOLUTIONS))
+    run_parser.add_argument("--filter", help="only keep results whose name contains this")
+    run_parser.add_argument("--output", type=Path, help="write results as JSON")
+    run_parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two result files")
+    compare_parser.add_argument("base", type=Path, nargs="?", default=BASELINE)
+    compare_parser.add_argument("new", type=Path, nargs="?", help="results to check (default: run now)")
+    compare_parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown (0.15 = 15%%)")
+    compare_parser.add_argument("--resolutions", default=",".join(RESOLUTIONS))
+    compare_parser.add_argument("--filter")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        data = run(args)
+        if args.output:
+            args.output.write_text(json.dumps(data, indent=2) + "\n")
+        if args.save:
+            BASELINE.parent.mkdir(parents=True, exist_ok=True)
+            BASELINE.write_text(json.dumps(data, indent=2) + "\n")
+            print(f"Baseline saved to {BASELINE}")
+        return 0
+
+    if not args.base.exists():
+        print(f"FAIL: no baseline at {args.base} (run 'run --save' on this machine first)")
+        return 2
+    base = json.loads(args.base.read_text())
+    new = json.loads(args.new.read_text()) if args.new else run(args)
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f"FAIL: {len(regressions)} regression(s) over {args.threshold:.0%}")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
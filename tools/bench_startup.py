@@ -0,0 +1,77 @@
+"""GUI起動時のimport時間ベンチマーク（起動遅延の回帰検出）
+
+メニュー表示までに必要な `import app` の所要時間を別プロセスで複数回計測し、
+各モード専用の重い依存が読み込まれていないことを確認する。
+
+    python tools/bench_startup.py            # ベースラインと比較
+    python tools/bench_startup.py --save     # 現在の結果をベースラインとして保存
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE = Path(__file__).resolve().parent / "baselines" / "startup.json"
+
+# メニュー表示前に読み込まれてはならないモジュール
+MODE_ONLY_MODULES = ["cv2", "numpy", "requests", "pyvirtualcam", "pythoncom", "pygrabber"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({"ms": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+""" % (MODE_ONLY_MODULES,)
+
+
+def measure(runs):
+    samples = []
+    loaded = set()
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result["ms"])
+        loaded.update(result["loaded"])
+    return samples, sorted(loaded)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs baseline (0.25 = 25%%)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save", action="store_true", help="store the result as the new baseline")
+    args = parser.parse_args()
+
+    samples, loaded = measure(args.runs)
+    median = statistics.median(samples)
+    print(f"import app: median {median:.1f} ms (min {min(samples):.1f}, max {max(samples):.1f}, {args.runs} runs)")
+
+    failures = 0
+    if loaded:
+        print(f"FAIL: mode-only modules imported at startup: {', '.join(loaded)}")
+        failures += 1
+
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({"import_app_ms": round(median, 1)}, indent=2) + "\n")
+        print(f"Baseline saved to {args.baseline}")
+    elif args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())["import_app_ms"]
+        limit = baseline * (1 + args.tolerance)
+        print(f"baseline {baseline:.1f} ms, limit {limit:.1f} ms")
+        if median > limit:
+            print("FAIL: startup import time regressed")
+            failures += 1
+    else:
+        print(f"No baseline at {args.baseline} (run with --save to create one)")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
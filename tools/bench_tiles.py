@@ -0,0 +1,205 @@
+"""タイル差分（?mode=tiles）と通常のMJPEGの帯域・CPU比較
+
+合成シーン（話者だけが動く映像、ホワイトボードへの書き込み、全体が動く映像）を
+連続フレームとして流し、送信側（変化検出＋エンコード）と受信側（デコード＋貼り込み）の
+1フレームあたりの時間、1フレームあたりのバイト数、受信側で復元した映像の画質（PSNR）を比べる。
+ネットワークは使わず、サーバー・クライアントと同じ TileEncoder / TileClient の処理を直接呼ぶ。
+
+    python tools/bench_tiles.py                       # 720p、各シーン150フレーム
+    python tools/bench_tiles.py --resolution 1080p --frames 300 --output tiles.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import cv2
+import numpy as np
+
+from synthetic import make_test_frame
+
+RESOLUTIONS = {
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+}
+FPS = 30
+
+
+def talking_head(width, height, count):
+    """静止した背景の中央で人物（楕円）が少し動く。カメラのノイズ（閾値未満）を毎フレーム加える"""
+    background = make_test_frame(width, height)
+    rng = np.random.default_rng(1)
+    for i in range(count):
+        frame = background.copy()
+        center = (width // 2 + int(20 * np.sin(i / 7)), height // 2 + int(10 * np.sin(i / 5)))
+        cv2.ellipse(frame, center, (width // 10, height // 4), 0, 0, 360, (90, 120, 170), -1)
+        cv2.ellipse(frame, (center[0], center[1] - height // 5), (width // 16, height // 9), 0, 0, 360,
+                    (120, 150, 200), -1)
+        noise = rng.integers(0, 6, size=(height, width, 1), dtype=np.uint8)
+        yield cv2.add(frame, np.repeat(noise, 3, axis=2))
+
+
+def whiteboard(width, height, count):
+    """白い背景に線を1本ずつ書き足していく"""
+    frame = np.full((height, width, 3), 235, dtype=np.uint8)
+    rng = np.random.default_rng(2)
+    point = (width // 4, height // 4)
+    for i in range(count):
+        frame = frame.copy()
+        nxt = (int(np.clip(point[0] + rng.integers(-40, 41), 0, width - 1)),
+               int(np.clip(point[1] + rng.integers(-30, 31), 0, height - 1)))
+        cv2.line(frame, point, nxt, (40, 40, 40), 3, cv2.LINE_AA)
+        point = nxt
+        yield frame
+
+
+def full_motion(width, height, count):
+    """画面全体が毎フレーム変わる（タイル差分がキーフレームに切り替わる場合）"""
+    for i in range(count):
+        yield make_test_frame(width, height, phase=i)
+
+
+SCENES = {
+    "talking-head": talking_head,
+    "whiteboard": whiteboard,
+    "full-motion": full_motion,
+}
+
+
+class _Source:
+    """TileEncoder / RenditionEncoder が参照するカメラの属性だけを持つソース"""
+
+    jpeg_encoder = None
+    jpeg_options = None
+
+    def __init__(self):
+        self.frame_seq = 0
+        self.frame = None
+
+    def get_frame_view(self):
+        return self.frame
+
+
+def _psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return 99.0 if mse == 0 else round(float(10 * np.log10(255 ** 2 / mse)), 2)
+
+
+def _summary(send_ms, receive_ms, sizes, psnr):
+    send_ms.sort()
+    receive_ms.sort()
+    return {
+        "bytes_per_frame": int(statistics.mean(sizes)),
+        "mbps": round(statistics.mean(sizes) * 8 * FPS / 1e6, 3),
+        "send_median_ms": round(statistics.median(send_ms), 3),
+        "send_p95_ms": round(send_ms[int(len(send_ms) * 0.95)], 3),
+        "receive_median_ms": round(statistics.median(receive_ms), 3),
+        "receive_p95_ms": round(receive_ms[int(len(receive_ms) * 0.95)], 3),
+        "psnr_db": round(statistics.mean(psnr), 2),
+    }
+
+
+def bench_mjpeg(frames):
+    """通常のMJPEG: 毎フレーム全体をエンコードしてデコードする"""
+    from sender.renditions import Rendition, RenditionEncoder
+    from receiver.client import StreamClient
+
+    encoder = RenditionEncoder(Rendition("main"))
+    source = _Source()
+    send_ms, receive_ms, sizes, psnr = [], [], [], []
+    for i, frame in enumerate(frames):
+        source.frame, source.frame_seq = frame, i
+        start = time.perf_counter()
+        jpeg = encoder.encode(source, frame, i)
+        send_ms.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        decoded = StreamClient.decode(jpeg)
+        receive_ms.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(jpeg))
+        psnr.append(_psnr(decoded, frame))
+    return _summary(send_ms, receive_ms, sizes, psnr)
+
+
+def bench_tiles(frames):
+    """タイル差分: 1接続ぶんの TileSession で送り、TileClient で貼り込む"""
+    from sender.renditions import Rendition, RenditionEncoder
+    from sender.tiles import TileSession
+    from receiver.tiles import TileClient
+    from utils.network import TILES_HEADER
+
+    tiles = RenditionEncoder(Rendition("main")).tiles()
+    session = TileSession(tiles)
+    client = TileClient("http://bench/stream.mjpg?mode=tiles")
+    source = _Source()
+    send_ms, receive_ms, sizes, psnr = [], [], [], []
+    keyframes = 0
+    for i, frame in enumerate(frames):
+        source.frame, source.frame_seq = frame, i
+        start = time.perf_counter()
+        part = session.next_part(source)
+        send_ms.append((time.perf_counter() - start) * 1000)
+        session.sent(part)
+        body = bytes(part.buffer.view())
+        headers = {"content-type": part.content_type, TILES_HEADER.lower(): part.header}
+        keyframes += part.keyframe
+
+        # 受信側の処理だけを計測する（multipart の解析は通常のMJPEGと同じ）
+        client.get_parts = lambda: iter([(headers, body)])
+        start = time.perf_counter()
+        _, canvas = next(client.read_frames())
+        receive_ms.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(body))
+        psnr.append(_psnr(canvas, frame))
+    result = _summary(send_ms, receive_ms, sizes, psnr)
+    result["keyframes"] = keyframes
+    result["tiles_patched"] = client.tiles_patched
+    result["detect_ms"] = round(tiles.detect_ms, 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--resolution", choices=RESOLUTIONS, default="720p")
+    parser.add_argument("--frames", type=int, default=150, help="frames per scene")
+    parser.add_argument("--scenes", default=",".join(SCENES))
+    parser.add_argument("--output", type=Path, help="write results as JSON")
+    args = parser.parse_args()
+
+    width, height = RESOLUTIONS[args.resolution]
+    results = {}
+    print(f"{'scene':<14} {'mode':<6} {'KB/frame':>9} {'Mbps':>8} {'send ms':>8} {'p95':>7} "
+          f"{'recv ms':>8} {'p95':>7} {'PSNR':>6}")
+    for scene in args.scenes.split(","):
+        frames = list(SCENES[scene](width, height, args.frames))
+        for mode, bench in (("mjpeg", bench_mjpeg), ("tiles", bench_tiles)):
+            result = bench(frames)
+            results[f"{scene}/{mode}"] = result
+            extra = f"  keyframes {result['keyframes']}" if "keyframes" in result else ""
+            print(f"{scene:<14} {mode:<6} {result['bytes_per_frame'] / 1024:9.1f} {result['mbps']:8.2f} "
+                  f"{result['send_median_ms']:8.2f} {result['send_p95_ms']:7.2f} "
+                  f"{result['receive_median_ms']:8.2f} {result['receive_p95_ms']:7.2f} "
+                  f"{result['psnr_db']:6.1f}{extra}")
+
+    if args.output:
+        args.output.write_text(json.dumps({
+            "meta": {
+                "python": platform.python_version(),
+                "opencv": cv2.__version__,
+                "resolution": args.resolution,
+                "frames": args.frames,
+                "platform": platform.platform(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "results": results,
+        }, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+"""ローカル複数インターフェースでのディスカバリー動作確認ハーネス
+
+127.0.0.0/8 の別アドレス（127.0.0.2, 127.0.0.3, ...）を仮想的なNICとして扱い、
+それぞれにServerAnnouncerをバインドして ServerDiscovery の逐次通知と
+既知送信元キャッシュを検証する。Linuxではループバック別名が設定不要で使える。
+
+    python tools/discovery_harness.py --senders 3
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.network import ServerAnnouncer, ServerDiscovery, get_interfaces, get_broadcast_addresses
+from utils.sender_cache import SenderCache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--senders", type=int, default=3)
+    parser.add_argument("--port", type=int, default=18001, help="discovery port used by the harness")
+    parser.add_argument("--timeout", type=float, default=1.0)
+    args = parser.parse_args()
+
+    print("Interfaces:")
+    for iface in get_interfaces():
+        print(f"  {iface['name']:<12} {iface['ip']:<16} {iface['network']:<20} bcast={iface['broadcast']}")
+    print(f"Broadcast targets: {get_broadcast_addresses()}")
+
+    hosts = [f"127.0.0.{i + 2}" for i in range(args.senders)]
+    announcers = [
+        ServerAnnouncer(server_port=8000 + i, bind_host=host, discovery_port=args.port)
+        for i, host in enumerate(hosts)
+    ]
+    for announcer in announcers:
+        announcer.start()
+
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = SenderCache(Path(tmp) / "known_senders.json")
+        try:
+            arrivals = []
+            start = time.monotonic()
+            discovery = ServerDiscovery(timeout=args.timeout, discovery_port=args.port, targets=hosts, cache=cache)
+            found = discovery.discover(on_found=lambda s: arrivals.append(time.monotonic() - start))
+            total = time.monotonic() - start
+
+            found_ips = sorted(s["ip"] for s in found)
+            print(f"Found {len(found)}/{len(hosts)}: {found_ips}")
+            if arrivals:
+                print(f"First result after {arrivals[0] * 1000:.1f} ms (discover returned after {total * 1000:.0f} ms)")
+            if found_ips != sorted(hosts):
+                print("FAIL: not every sender was discovered")
+                failures += 1
+
+            # 保存されたキャッシュだけで（ブロードキャスト先なしで）再検出できること
+            reloaded = SenderCache(cache.path)
+            cached = ServerDiscovery(timeout=args.timeout, discovery_port=args.port, targets=[], cache=reloaded)
+            refound = cached.discover()
+            print(f"Rediscovered from cache: {len(refound)}/{len(hosts)}")
+            if len(refound) != len(hosts):
+                print("FAIL: cache-based rediscovery incomplete")
+                failures += 1
+        finally:
+            for announcer in announcers:
+                announcer.stop()
+
+    print("OK" if not failures else f"{failures} check(s) failed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
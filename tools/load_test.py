@@ -0,0 +1,323 @@
+"""StreamServer の多クライアント負荷試験
+
+合成ソースを配信する StreamServer を別プロセスで起動し、asyncio で N 本の
+MJPEGクライアント（デコードなし）を接続する。N を段階的に増やしながら
+クライアントごとの実効FPS・配信遅延、サーバーのCPU使用率・スレッド数・メモリを計測し、
+保存済みのベースラインを下回れば失敗（終了コード1）とする。
+
+    python tools/load_test.py --clients 1,4,16,32
+    python tools/load_test.py --clients 8 --slow 2 --lossy 2
+    python tools/load_test.py --save          # 現在の結果をベースラインとして保存
+    python tools/load_test.py --baseline my-machine.json --save
+    python tools/load_test.py --clients 8 --contend 2 --thread-roles auto
+
+ベースライン（tools/baselines/load_test.json）は1コアのLinux VMでの参照値で、実効FPSと遅延の上限だけを
+見るため多くの環境でそのまま使える。遅いマシンやCIでは --baseline で別のファイルを指定して --save で作り直す。
+ベースラインがなければ失敗（終了コード2）とする。
+
+slow: フレームごとに --slow-delay 秒待つ（受信が遅いクライアント）
+lossy: フレームごとに --loss-rate の確率で切断し、再接続する
+contend: CPUを使い続けるプロセスを N 個動かす（UIや他のアプリの負荷の代わり）。
+  --thread-roles（utils.thread_roles の指定）の有無で遅延の裾（p99・最大）を比べる
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from synthetic import SyntheticSource, read_tag
+
+BASELINE = Path(__file__).resolve().parent / "baselines" / "load_test.json"
+
+
+def serve(args):
+    """子プロセス: 合成ソースのStreamServerを起動し、標準入力が閉じるまで配信する"""
+    from sender.server import StreamServer
+    from utils import thread_roles
+
+    if args.thread_roles:
+        thread_roles.configure(args.thread_roles)
+    source = SyntheticSource(args.width, args.height, args.fps, args.quality)
+    source.start()
+    server = StreamServer(source, host="127.0.0.1", port=args.port, announce=False)
+    server.start()
+    print("READY", flush=True)
+    sys.stdin.read()
+    server.stop()
+    source.stop()
+
+
+class ProcessMonitor:
+    """サーバープロセスのCPU使用率・スレッド数・RSS（psutil がなければLinuxの /proc）"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        try:
+            import psutil
+            self._process = psutil.Process(pid)
+        except ImportError:
+            self._process = None
+        self._last = (time.monotonic(), self._cpu_seconds())
+
+    def _cpu_seconds(self):
+        if self._process:
+            times = self._process.cpu_times()
+            return times.user + times.system
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, ValueError):
+            return None
+
+    def sample(self):
+        """前回からのCPU使用率(%)、スレッド数、RSS(MB)"""
+        now, cpu = time.monotonic(), self._cpu_seconds()
+        last_time, last_cpu = self._last
+        self._last = (now, cpu)
+        cpu_percent = (cpu - last_cpu) / (now - last_time) * 100 if cpu is not None and last_cpu is not None else None
+
+        if self._process:
+            return cpu_percent, self._process.num_threads(), self._process.memory_info().rss / 1e6
+        threads = rss = None
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        threads = int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        rss = int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return cpu_percent, threads, rss
+
+
+class ClientStats:
+    def __init__(self, kind):
+        self.kind = kind
+        self.frames = 0
+        self.bytes = 0
+        self.last_seq = None
+        self.latencies = []
+        self.reconnects = 0
+        self.errors = 0
+
+
+async def run_client(host, port, path, stats, deadline, slow_delay=0.0, loss_rate=0.0):
+    """1クライアント: multipartをContent-Lengthで読み進め、COMタグから番号と遅延を取る"""
+    while time.monotonic() < deadline:
+        writer = None
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            status = await reader.readuntil(b"\r\n\r\n")
+            if b" 200 " not in status.split(b"\r\n", 1)[0]:
+                raise ConnectionError(status.split(b"\r\n", 1)[0].decode(errors="replace"))
+
+            while time.monotonic() < deadline:
+                header = await reader.readuntil(b"\r\n\r\n")
+                length = None
+                for line in header.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                if length is None:
+                    raise ConnectionError("missing Content-Length")
+                body = await reader.readexactly(length + 2)
+                received = time.time()
+
+                tag = read_tag(body)
+                if tag:
+                    seq, published = tag
+                    # 同じフレームの再送は数えない
+                    if seq != stats.last_seq:
+                        stats.last_seq = seq
+                        stats.frames += 1
+                        stats.latencies.append((received - published) * 1000)
+                stats.bytes += length
+
+                if slow_delay:
+                    await asyncio.sleep(slow_delay)
+                if loss_rate and random.random() < loss_rate:
+                    stats.reconnects += 1
+                    break
+        except (OSError, asyncio.IncompleteReadError, ConnectionError):
+            stats.errors += 1
+            await asyncio.sleep(0.1)
+        finally:
+            if writer:
+                writer.transport.abort()
+
+
+async def run_step(args, clients, monitor):
+    kinds = ["normal"] * clients + ["slow"] * args.slow + ["lossy"] * args.lossy
+    stats = [ClientStats(kind) for kind in kinds]
+    path = "/stream.mjpg" if args.rendition == "main" else f"/stream.mjpg?rendition={args.rendition}"
+    deadline = time.monotonic() + args.warmup + args.duration
+
+    tasks = [asyncio.ensure_future(run_client(
+        "127.0.0.1", args.port, path, s, deadline,
+        slow_delay=args.slow_delay if s.kind == "slow" else 0.0,
+        loss_rate=args.loss_rate if s.kind == "lossy" else 0.0)) for s in stats]
+
+    # ウォームアップ後に計測区間の開始点を記録
+    await asyncio.sleep(args.warmup)
+    start_frames = [s.frames for s in stats]
+    start_latency = [len(s.latencies) for s in stats]
+    monitor.sample()
+    samples = []
+    while time.monotonic() < deadline:
+        await asyncio.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+        samples.append(monitor.sample())
+    await asyncio.gather(*tasks)
+
+    result = {"clients": clients, "kinds": {}}
+    for kind in ("normal", "slow", "lossy"):
+        group = [i for i, s in enumerate(stats) if s.kind == kind]
+        if not group:
+            continue
+        fps = [(stats[i].frames - start_frames[i]) / args.duration for i in group]
+        latencies = sorted(l for i in group for l in stats[i].latencies[start_latency[i]:])
+        result["kinds"][kind] = {
+            "count": len(group),
+            "fps_mean": round(statistics.mean(fps), 2),
+            "fps_min": round(min(fps), 2),
+            "latency_p50_ms": round(latencies[len(latencies) // 2], 2) if latencies else None,
+            "latency_p95_ms": round(latencies[int(len(latencies) * 0.95)], 2) if latencies else None,
+            "latency_p99_ms": round(latencies[int(len(latencies) * 0.99)], 2) if latencies else None,
+            "latency_max_ms": round(latencies[-1], 2) if latencies else None,
+            "reconnects": sum(stats[i].reconnects for i in group),
+            "errors": sum(stats[i].errors for i in group),
+        }
+
+    def avg(values):
+        values = [v for v in values if v is not None]
+        return round(statistics.mean(values), 1) if values else None
+
+    result["server_cpu_percent"] = avg(s[0] for s in samples)
+    result["server_threads"] = max((s[1] for s in samples if s[1] is not None), default=None)
+    result["server_rss_mb"] = avg(s[2] for s in samples)
+    return result
+
+
+def print_result(result):
+    normal = result["kinds"].get("normal", {})
+    line = (f"N={result['clients']:<4} fps mean {normal.get('fps_mean', 0):6.1f} min {normal.get('fps_min', 0):6.1f}  "
+            f"latency p50 {normal.get('latency_p50_ms') or 0:6.1f} p95 {normal.get('latency_p95_ms') or 0:6.1f} "
+            f"p99 {normal.get('latency_p99_ms') or 0:6.1f} max {normal.get('latency_max_ms') or 0:6.1f} ms  "
+            f"cpu {result['server_cpu_percent'] or 0:5.1f}%  threads {result['server_threads'] or 0:4}  "
+            f"rss {result['server_rss_mb'] or 0:6.1f} MB")
+    for kind in ("slow", "lossy"):
+        if kind in result["kinds"]:
+            k = result["kinds"][kind]
+            line += f"\n       {kind:<5} x{k['count']}: fps {k['fps_mean']:.1f}, reconnects {k['reconnects']}"
+    print(line, flush=True)
+
+
+def compare(results, baseline, tolerance):
+    """ベースラインより実効FPSが低い・遅延が大きい段を列挙する"""
+    failures = []
+    for result in results:
+        base = baseline.get(str(result["clients"]))
+        normal = result["kinds"].get("normal")
+        if not base or not normal:
+            continue
+        min_fps = base["fps_min"] * (1 - tolerance)
+        if normal["fps_min"] < min_fps:
+            failures.append(f"N={result['clients']}: fps_min {normal['fps_min']} < {min_fps:.1f}")
+        # 遅延は数msの揺らぎがあるため絶対値の余裕も持たせる
+        max_latency = base["latency_p95_ms"] * (1 + tolerance) + 5.0
+        if normal["latency_p95_ms"] is not None and normal["latency_p95_ms"] > max_latency:
+            failures.append(f"N={result['clients']}: latency_p95 {normal['latency_p95_ms']} ms > {max_latency:.1f} ms")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--clients", default="1,2,4,8,16,32", help="comma separated ramp of normal clients")
+    parser.add_argument("--slow", type=int, default=0, help="additional slow clients per step")
+    parser.add_argument("--slow-delay", type=float, default=0.2, help="seconds a slow client waits per frame")
+    parser.add_argument("--lossy", type=int, default=0, help="additional lossy clients per step")
+    parser.add_argument("--loss-rate", type=float, default=0.02, help="per-frame disconnect probability")
+    parser.add_argument("--duration", type=float, default=5.0, help="measured seconds per step")
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--rendition", default="main")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--quality", type=int, default=85)
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--contend", type=int, default=0, help="busy-loop processes competing for the CPU")
+    parser.add_argument("--thread-roles", metavar="SPEC",
+                        help="thread role spec for the server (see utils/thread_roles.py), e.g. auto")
+    parser.add_argument("--json", type=Path, help="write the results to this file")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--save", action="store_true", help="store the result as the new baseline")
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args)
+
+    child_args = [sys.executable, __file__, "--serve", "--port", str(args.port), "--width", str(args.width),
+                  "--height", str(args.height), "--fps", str(args.fps), "--quality", str(args.quality)]
+    if args.thread_roles:
+        child_args += ["--thread-roles", args.thread_roles]
+    hogs = [subprocess.Popen([sys.executable, "-c", "while True: pass"]) for _ in range(args.contend)]
+    child = subprocess.Popen(child_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        # サーバー側のログ行を読み飛ばしてREADYを待つ
+        for line in child.stdout:
+            if line.strip() == "READY":
+                break
+        else:
+            print("FAIL: server did not start")
+            return 1
+        monitor = ProcessMonitor(child.pid)
+        results = []
+        for clients in (int(n) for n in args.clients.split(",")):
+            result = asyncio.run(run_step(args, clients, monitor))
+            print_result(result)
+            results.append(result)
+    finally:
+        child.stdin.close()
+        try:
+            child.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            child.kill()
+        for hog in hogs:
+            hog.kill()
+            hog.wait()
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.save:
+        baseline = {str(r["clients"]): {"fps_min": r["kinds"]["normal"]["fps_min"],
+                                        "latency_p95_ms": r["kinds"]["normal"]["latency_p95_ms"]}
+                    for r in results if "normal" in r["kinds"]}
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baseline, indent=2) + "\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+    if not args.baseline.exists():
+        print(f"FAIL: no baseline at {args.baseline} (run with --save to create one for this machine)")
+        return 2
+
+    failures = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,117 @@
+"""ベンチマーク・負荷試験用の合成フレームソース
+
+StreamServer が要求するソースのインターフェース（width, height, fps, frame_seq,
+get_jpeg_frame_direct, get_frame_view, get_load, add_listener）を満たす。
+JPEGはあらかじめエンコードしたものを巡回させ、各フレームの SOI 直後に
+COMセグメント "seq=<連番> t=<公開時刻>" を挿入する。受信側はデコードせずに
+フレーム番号と配信遅延を取り出せる。
+"""
+import struct
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils import thread_roles
+
+COM_PREFIX = b"seq="
+
+
+def make_test_frame(width, height, phase=0):
+    """圧縮率が実際の映像に近い合成フレーム（グラデーション＋移動する模様＋ノイズ）"""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (x + phase * 8) % 256
+    frame[..., 1] = y
+    frame[..., 2] = (x[None, :] + y) / 2
+    rng = np.random.default_rng(phase)
+    noise = rng.integers(0, 24, size=(height, width, 1), dtype=np.uint8)
+    frame = cv2.add(frame, np.repeat(noise, 3, axis=2))
+    cv2.circle(frame, ((phase * 37) % width, height // 2), max(8, height // 8), (255, 255, 255), -1)
+    return frame
+
+
+def tag_jpeg(jpeg, seq, timestamp):
+    """SOIの直後にフレーム番号と公開時刻のCOMセグメントを挿入する"""
+    payload = f"seq={seq} t={timestamp:.6f}".encode()
+    return jpeg[:2] + b"\xff\xfe" + struct.pack(">H", len(payload) + 2) + payload + jpeg[2:]
+
+
+def read_tag(data, start=0):
+    """tag_jpeg() で挿入した (seq, timestamp) を読む（なければNone）"""
+    if data[start + 2:start + 4] != b"\xff\xfe":
+        return None
+    length = struct.unpack_from(">H", data, start + 4)[0]
+    payload = bytes(data[start + 6:start + 4 + length])
+    if not payload.startswith(COM_PREFIX):
+        return None
+    seq, _, t = payload.partition(b" t=")
+    return int(seq[len(COM_PREFIX):]), float(t)
+
+
+class SyntheticSource:
+    """指定FPSで新しいフレームを公開する合成ソース"""
+
+    def __init__(self, width=1280, height=720, fps=30.0, quality=85, variants=16):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_seq = 0
+        self.frames = [make_test_frame(width, height, i) for i in range(variants)]
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        self.jpegs = [cv2.imencode(".jpg", f, params)[1].tobytes() for f in self.frames]
+        self._jpeg = None
+        self._frame = None
+        self._listeners = ()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        thread_roles.assign("capture", "synthetic")
+        interval = 1.0 / self.fps
+        next_time = time.perf_counter()
+        while self.running:
+            seq = self.frame_seq + 1
+            i = seq % len(self.jpegs)
+            timestamp = time.time()
+            self._jpeg = tag_jpeg(self.jpegs[i], seq, timestamp)
+            self._frame = self.frames[i]
+            self.frame_seq = seq
+            for listener in self._listeners:
+                listener(self._jpeg, timestamp)
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.perf_counter()
+
+    def get_jpeg_frame_direct(self):
+        return self._jpeg
+
+    def get_frame_view(self):
+        return self._frame
+
+    def get_load(self):
+        return 0.0
+
+    def get_listeners(self):
+        return self._listeners
+
+    def add_listener(self, callback):
+        self._listeners = self._listeners + (callback,)
+
+    def remove_listener(self, callback):
+        self._listeners = tuple(l for l in self._listeners if l != callback)
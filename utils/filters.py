@@ -0,0 +1,305 @@
+"""フレームごとの画像処理（ノイズ除去・背景ぼかし・明るさの正規化）
+
+送信側はエンコード前（Camera）、受信側は仮想カメラへの出力前に FilterPipeline.process() を通す。
+各フィルターは重い順に複数の実装（variant）を持ち、パイプラインは1フレームの処理時間が
+予算（budget_ms）に収まるよう実装を軽いものへ切り替え、それでも足りなければ任意のフィルターを止める。
+余裕が続けば1段ずつ戻す。フレームは横帯に分けてワーカースレッドで並列に処理する。
+
+    python main.py send --filter denoise,blur,brightness --filter-budget 12
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from utils import tracing, thread_roles
+
+# 1フレームのフィルター処理に使ってよい時間（ms）。30fpsの1フレーム（33ms）からキャプチャとエンコードの分を残す
+DEFAULT_BUDGET_MS = 12.0
+# 平均がこの割合を下回る状態が続いたら1段重い実装へ戻す（戻した直後に予算超過にならないよう余裕を見る）
+HEADROOM = 0.7
+# 実装を切り替えた後、平均が落ち着くまで次の切り替えを待つフレーム数
+SETTLE_FRAMES = 15
+# 余裕がこのフレーム数続いたら戻す
+UPGRADE_FRAMES = 60
+
+
+class Filter:
+    """フィルターの基底クラス
+
+    variants は重い（高品質な）順の実装名。optional=False のフィルターは予算が足りなくても
+    最も軽い実装で必ず実行する（背景ぼかしなど、止めると見えてはいけないものが映る処理）。
+    halo は横帯に分けて処理するときに上下に余分に渡す行数（近傍を参照する処理用）。
+    """
+
+    name = ""
+    variants = ()
+    optional = True
+    halo = 0
+
+    def __init__(self):
+        # 実装ごとの1フレームあたりの処理時間（ms、移動平均。未計測はNone）
+        self.cost_ms = [None] * len(self.variants)
+        # 締め切りに間に合わないため、そのフレームだけ飛ばした回数
+        self.deadline_skips = 0
+
+    def splittable(self, variant):
+        """横帯に分けて処理できるか（画像全体の統計やタイルに依存する実装はFalse）"""
+        return True
+
+    def prepare(self, frame, variant):
+        """画像全体を見て決める値を求める（呼び出し元のスレッドで1回だけ）"""
+        return None
+
+    def apply(self, src, variant, rows, state):
+        """src（元画像の rows=(上端, 下端) の行）を処理した画像を返す"""
+        raise NotImplementedError
+
+    def record(self, level, ms):
+        cost = self.cost_ms[level]
+        self.cost_ms[level] = ms if cost is None else cost + (ms - cost) * 0.1
+
+
+class Denoise(Filter):
+    """カメラのノイズ除去（エッジを残すバイラテラル、軽量版は3x3のガウシアン）"""
+
+    name = "denoise"
+    variants = ("bilateral", "gaussian")
+    halo = 3
+
+    def apply(self, src, variant, rows, state):
+        if variant == "bilateral":
+            return cv2.bilateralFilter(src, 5, 30, 5)
+        return cv2.GaussianBlur(src, (3, 3), 0)
+
+
+class BackgroundBlur(Filter):
+    """画面中央の人物（楕円の領域）以外をぼかす
+
+    軽量版は1/4に縮小してぼかし、拡大して合成する（ぼかしの強さはほぼ同じで計算量は約1/16）。
+    """
+
+    name = "blur"
+    variants = ("full", "reduced")
+    optional = False
+    halo = 48
+    SIGMA = 12
+
+    def __init__(self):
+        super().__init__()
+        self._masks = {}
+
+    def _mask(self, width, height):
+        """人物側の重み（1）と背景側の重み（0）を滑らかにつないだマスク"""
+        masks = self._masks.get((width, height))
+        if masks is None:
+            mask = np.zeros((height, width), dtype=np.float32)
+            cv2.ellipse(mask, (width // 2, height * 3 // 5), (width // 4, height * 3 // 5), 0, 0, 360, 1.0, -1)
+            mask = cv2.GaussianBlur(mask, (0, 0), min(width, height) / 20)
+            masks = self._masks[(width, height)] = (mask, 1.0 - mask)
+        return masks
+
+    def prepare(self, frame, variant):
+        h, w = frame.shape[:2]
+        return self._mask(w, h)
+
+    def apply(self, src, variant, rows, state):
+        mask, inverse = state
+        if variant == "full":
+            blurred = cv2.GaussianBlur(src, (0, 0), self.SIGMA)
+        else:
+            h, w = src.shape[:2]
+            small = cv2.resize(src, (max(1, w // 4), max(1, h // 4)), interpolation=cv2.INTER_AREA)
+            blurred = cv2.resize(cv2.GaussianBlur(small, (0, 0), self.SIGMA / 4), (w, h),
+                                 interpolation=cv2.INTER_LINEAR)
+        top, bottom = rows
+        return cv2.blendLinear(src, blurred, mask[top:bottom], inverse[top:bottom])
+
+
+class BrightnessNormalize(Filter):
+    """明るさの正規化（局所的なコントラスト補正のCLAHE、軽量版は全体の明るさを目標へ寄せるゲイン）"""
+
+    name = "brightness"
+    variants = ("clahe", "gain")
+    TARGET = 128.0
+
+    def __init__(self):
+        super().__init__()
+        self._clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        self._gain = 1.0
+
+    def splittable(self, variant):
+        # CLAHEのタイルは画像全体を基準に決まる
+        return variant != "clahe"
+
+    def prepare(self, frame, variant):
+        if variant != "gain":
+            return None
+        # 縮小した画像の平均輝度から求め、急に変わらないよう平滑化する
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (max(1, w // 8), max(1, h // 8)), interpolation=cv2.INTER_AREA)
+        mean = float(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY).mean())
+        gain = min(3.0, max(0.5, self.TARGET / max(mean, 1.0)))
+        self._gain += (gain - self._gain) * 0.1
+        return np.clip(np.arange(256, dtype=np.float32) * self._gain, 0, 255).astype(np.uint8)
+
+    def apply(self, src, variant, rows, state):
+        if variant == "gain":
+            return cv2.LUT(src, state)
+        lab = cv2.cvtColor(src, cv2.COLOR_BGR2LAB)
+        lightness, a, b = cv2.split(lab)
+        return cv2.cvtColor(cv2.merge((self._clahe.apply(lightness), a, b)), cv2.COLOR_LAB2BGR)
+
+
+FILTERS = {cls.name: cls for cls in (Denoise, BackgroundBlur, BrightnessNormalize)}
+
+
+def parse_filters(spec):
+    """"denoise,blur,brightness" 形式の指定からフィルターを作る（書いた順に適用）"""
+    filters = []
+    for name in spec.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in FILTERS:
+            raise ValueError(f"Unknown filter: {name} (choose from {', '.join(FILTERS)})")
+        filters.append(FILTERS[name]())
+    return filters
+
+
+class FilterPipeline:
+    """フィルターを順に適用し、予算に合わせて実装を切り替える
+
+    process() はキャプチャ（または出力）スレッドから呼ぶ。返す画像は次の process() まで有効。
+    """
+
+    def __init__(self, filters, budget_ms=DEFAULT_BUDGET_MS, workers=None):
+        self.filters = list(filters)
+        self.budget_ms = budget_ms
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="filter",
+                                        initializer=thread_roles.assign, initargs=("encode",)) if self.workers > 1 else None
+        # フィルターごとの実装の段階（variants の添字。len(variants) は停止中）
+        self.levels = [0] * len(self.filters)
+        # 統計: 1フレームの処理時間（ms、移動平均）と、予算を超えたフレーム数
+        self.total_ms = 0.0
+        self.frames = 0
+        self.frames_over = 0
+        self._settle = 0
+        self._calm = 0
+        self._scratch = {}
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+    def process(self, frame, seq=None):
+        if not self.filters:
+            return frame
+        start = time.perf_counter()
+        skipped = []
+        for i, f in enumerate(self.filters):
+            level = self.levels[i]
+            if level >= len(f.variants):
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            if f.optional and elapsed + (f.cost_ms[level] or 0.0) > self.budget_ms:
+                # このフレームでは間に合わない（次のフレームには影響しない）
+                f.deadline_skips += 1
+                skipped.append(i)
+                continue
+            stage_start = time.perf_counter()
+            span = tracing.begin()
+            frame = self._run(i, f, f.variants[level], frame)
+            tracing.end(f"filter {f.name}", span, seq)
+            f.record(level, (time.perf_counter() - stage_start) * 1000)
+
+        total = (time.perf_counter() - start) * 1000
+        self.frames += 1
+        if total > self.budget_ms:
+            self.frames_over += 1
+        self.total_ms += (total - self.total_ms) * 0.2
+        self._adapt(skipped)
+        return frame
+
+    def _run(self, index, f, variant, frame):
+        state = f.prepare(frame, variant)
+        h = frame.shape[0]
+        if self._pool is None or not f.splittable(variant) or h < self.workers * 16:
+            return f.apply(frame, variant, (0, h), state)
+
+        out = self._scratch.get(index)
+        if out is None or out.shape != frame.shape:
+            out = self._scratch[index] = np.empty_like(frame)
+
+        def stripe(k):
+            top, bottom = h * k // self.workers, h * (k + 1) // self.workers
+            a, b = max(0, top - f.halo), min(h, bottom + f.halo)
+            out[top:bottom] = f.apply(frame[a:b], variant, (a, b), state)[top - a:bottom - a]
+
+        for future in [self._pool.submit(stripe, k) for k in range(self.workers)]:
+            future.result()
+        return out
+
+    def _adapt(self, skipped):
+        """平均処理時間が予算を超えたら最も重いフィルターを1段軽く、余裕が続けば1段戻す
+
+        平均が予算内でも締め切りで飛ばしたフィルターがあれば、そのフィルターを軽くする
+        （飛ばした分だけ平均が下がり、毎フレーム飛ばし続けることになるため）。
+        """
+        if self._settle:
+            self._settle -= 1
+            return
+        if self.total_ms > self.budget_ms or skipped:
+            self._calm = 0
+            candidates = [(f.cost_ms[level] or 0.0, i) for i, (f, level) in enumerate(zip(self.filters, self.levels))
+                          if (level < len(f.variants) - 1 or (f.optional and level < len(f.variants)))
+                          and (self.total_ms > self.budget_ms or i in skipped)]
+            if candidates:
+                self._change(max(candidates)[1], +1)
+            return
+        if self.total_ms > self.budget_ms * HEADROOM:
+            self._calm = 0
+            return
+        self._calm += 1
+        if self._calm < UPGRADE_FRAMES:
+            return
+        self._calm = 0
+        # 戻したときの増分（前に測った値）が最も小さく、予算内に収まるものを戻す
+        best = None
+        for i, (f, level) in enumerate(zip(self.filters, self.levels)):
+            if level == 0:
+                continue
+            current = f.cost_ms[level] if level < len(f.variants) else 0.0
+            increase = (f.cost_ms[level - 1] or 0.0) - (current or 0.0)
+            if self.total_ms + increase < self.budget_ms * HEADROOM and (best is None or increase < best[0]):
+                best = (increase, i)
+        if best:
+            self._change(best[1], -1)
+
+    def _change(self, index, step):
+        f = self.filters[index]
+        self.levels[index] += step
+        self._settle = SETTLE_FRAMES
+        level = self.levels[index]
+        variant = f.variants[level] if level < len(f.variants) else "off"
+        print(f"Filter {f.name}: {variant} (average {self.total_ms:.1f} ms, budget {self.budget_ms:.1f} ms)")
+
+    def stats(self):
+        """フィルターごとの現在の実装と処理時間"""
+        result = []
+        for f, level in zip(self.filters, self.levels):
+            active = level < len(f.variants)
+            result.append({
+                "name": f.name,
+                "variant": f.variants[level] if active else "off",
+                "cost_ms": (f.cost_ms[level] or 0.0) if active else 0.0,
+                "deadline_skips": f.deadline_skips,
+            })
+        return result
+
+    def describe(self):
+        """統計行用の短い表示（例: "denoise gaussian 0.4ms, blur reduced 2.1ms"）"""
+        return ", ".join(f"{s['name']} {s['variant']}" + (f" {s['cost_ms']:.1f}ms" if s['variant'] != "off" else "")
+                         for s in self.stats())
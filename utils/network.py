@@ -2,12 +2,28 @@ import socket
 import threading
 import json
 import time
+import sys
+import struct
+import ipaddress
 
 # Discovery constants
 DISCOVERY_PORT = 8001
 DISCOVERY_MESSAGE = "WEBCAMSHARE_DISCOVER"
 ANNOUNCE_MESSAGE = "WEBCAMSHARE_ANNOUNCE"
 
+# Stream constants
+STREAM_PORT = 8000
+# リレー経路: 要求元のリレーID / 配信元からこのサーバーまでのID列 / 中継段数
+VIA_HEADER = "X-WebCamShare-Via"
+PATH_HEADER = "X-WebCamShare-Path"
+HOPS_HEADER = "X-WebCamShare-Hops"
+# リレーで加算された滞留時間の累計（パートごと）
+RELAY_DELAY_HEADER = "X-Relay-Delay-Ms"
+# タイル差分ストリーム（?mode=tiles）: パートごとのタイル配置と、キーフレーム要求に使う接続ID
+TILES_HEADER = "X-WebCamShare-Tiles"
+SESSION_HEADER = "X-WebCamShare-Session"
+MAX_RELAY_HOPS = 4
+
 
 def get_local_ip():
     try:
@@ -19,14 +35,160 @@ def get_local_ip():
         s.close()
         return ip
     except Exception:
-        return "127.0.0.1"
+        pass
+    # オフライン（デフォルトルートなし）の場合は実インターフェースから選ぶ
+    for iface in get_interfaces():
+        return iface["ip"]
+    return "127.0.0.1"
+
+
+def _make_interface(name, ip, netmask):
+    """IPとネットマスクからインターフェース情報を組み立てる"""
+    try:
+        network = ipaddress.IPv4Interface(f"{ip}/{netmask}").network
+    except ValueError:
+        return None
+    # /31, /32 (Point-to-Point) にはブロードキャストアドレスがない
+    broadcast = str(network.broadcast_address) if network.prefixlen < 31 else None
+    return {
+        "name": name,
+        "ip": ip,
+        "netmask": netmask,
+        "network": str(network),
+        "broadcast": broadcast,
+    }
+
+
+def _get_interfaces_windows():
+    """Windows: iphlpapi.GetIpAddrTable でIPv4アドレスとネットマスクを取得"""
+    import ctypes
+    from ctypes import wintypes
+
+    class MIB_IPADDRROW(ctypes.Structure):
+        _fields_ = [
+            ("dwAddr", wintypes.DWORD),
+            ("dwIndex", wintypes.DWORD),
+            ("dwMask", wintypes.DWORD),
+            ("dwBCastAddr", wintypes.DWORD),
+            ("dwReasmSize", wintypes.DWORD),
+            ("unused1", ctypes.c_ushort),
+            ("wType", ctypes.c_ushort),
+        ]
+
+    MIB_IPADDR_DISCONNECTED = 0x0008
+    MIB_IPADDR_DELETED = 0x0040
+    ERROR_INSUFFICIENT_BUFFER = 122
+
+    get_table = ctypes.windll.iphlpapi.GetIpAddrTable
+    size = wintypes.ULONG(0)
+    if get_table(None, ctypes.byref(size), False) != ERROR_INSUFFICIENT_BUFFER:
+        return []
+    buf = ctypes.create_string_buffer(size.value)
+    if get_table(buf, ctypes.byref(size), False) != 0:
+        return []
+
+    count = wintypes.DWORD.from_buffer(buf).value
+    rows = (MIB_IPADDRROW * count).from_buffer(buf, ctypes.sizeof(wintypes.DWORD))
+    interfaces = []
+    for row in rows:
+        if row.wType & (MIB_IPADDR_DISCONNECTED | MIB_IPADDR_DELETED):
+            continue
+        # DWORDはネットワークバイトオーダーのままメモリに格納されている
+        ip = socket.inet_ntoa(struct.pack("<I", row.dwAddr))
+        mask = socket.inet_ntoa(struct.pack("<I", row.dwMask))
+        iface = _make_interface(f"if{row.dwIndex}", ip, mask)
+        if iface:
+            interfaces.append(iface)
+    return interfaces
+
+
+def _get_interfaces_linux():
+    """Linux: SIOCGIFADDR / SIOCGIFNETMASK ioctl で各インターフェースを取得"""
+    import fcntl
+
+    SIOCGIFADDR = 0x8915
+    SIOCGIFNETMASK = 0x891B
+
+    interfaces = []
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for _, name in socket.if_nameindex():
+            ifreq = struct.pack("256s", name.encode()[:15])
+            try:
+                ip = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, ifreq)[20:24])
+                mask = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFNETMASK, ifreq)[20:24])
+            except OSError:
+                # IPv4アドレスが割り当てられていない
+                continue
+            iface = _make_interface(name, ip, mask)
+            if iface:
+                interfaces.append(iface)
+    finally:
+        sock.close()
+    return interfaces
+
+
+def _get_interfaces_fallback():
+    """ネットマスクが取得できない環境: ホスト名から解決し /24 を仮定"""
+    interfaces = []
+    try:
+        infos = socket.getaddrinfo(socket.gethostname(), None, socket.AF_INET)
+    except Exception:
+        infos = []
+    for info in infos:
+        ip = info[4][0]
+        if any(iface["ip"] == ip for iface in interfaces):
+            continue
+        iface = _make_interface("host", ip, "255.255.255.0")
+        if iface:
+            interfaces.append(iface)
+    return interfaces
+
+
+def get_interfaces():
+    """有効なIPv4インターフェース（ループバック除く）の一覧を返す
+
+    各要素は name, ip, netmask, network, broadcast を持つ辞書。
+    """
+    interfaces = []
+    try:
+        if sys.platform == "win32":
+            interfaces = _get_interfaces_windows()
+        elif sys.platform.startswith("linux"):
+            interfaces = _get_interfaces_linux()
+    except Exception as e:
+        print(f"Interface enumeration failed: {e}")
+        interfaces = []
+    if not interfaces:
+        interfaces = _get_interfaces_fallback()
+    return [iface for iface in interfaces if not iface["ip"].startswith("127.")]
+
+
+def get_interface_ip_for(peer_ip, interfaces=None):
+    """peer_ip と同じサブネットにあるローカルインターフェースのIPを返す"""
+    if interfaces is None:
+        interfaces = get_interfaces()
+    try:
+        peer = ipaddress.IPv4Address(peer_ip)
+    except ValueError:
+        return None
+    for iface in interfaces:
+        if peer in ipaddress.IPv4Network(iface["network"]):
+            return iface["ip"]
+    return None
 
 
 class ServerAnnouncer:
     """Sender側: サーバーの存在をブロードキャストリクエストに応答して通知"""
     
-    def __init__(self, server_port=8000):
+    def __init__(self, server_port=8000, bind_host='', discovery_port=DISCOVERY_PORT, status_provider=None,
+                 name="WebCamShare"):
         self.server_port = server_port
+        self.name = name
+        # status_provider: 応答に含める能力・負荷情報(dict)を返す関数
+        self.status_provider = status_provider
+        self.bind_host = bind_host
+        self.discovery_port = discovery_port
         self.running = False
         self.thread = None
         self.sock = None
@@ -38,26 +200,38 @@ class ServerAnnouncer:
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(('', DISCOVERY_PORT))
+        self.sock.bind((self.bind_host, self.discovery_port))
         self.sock.settimeout(1.0)
         
         self.thread = threading.Thread(target=self._listen_and_respond, daemon=True)
         self.thread.start()
-        print(f"ServerAnnouncer started on port {DISCOVERY_PORT}")
+        print(f"ServerAnnouncer started on port {self.discovery_port}")
     
     def _listen_and_respond(self):
-        local_ip = get_local_ip()
+        if self.bind_host:
+            default_ip = self.bind_host
+            interfaces = []
+        else:
+            default_ip = get_local_ip()
+            interfaces = get_interfaces()
         while self.running:
             try:
                 data, addr = self.sock.recvfrom(1024)
                 if data.decode() == DISCOVERY_MESSAGE:
-                    response = json.dumps({
+                    # 要求元と同じサブネットのIPを返す（複数NIC環境で到達可能なアドレス）
+                    local_ip = get_interface_ip_for(addr[0], interfaces) or default_ip
+                    response = {
                         "type": ANNOUNCE_MESSAGE,
                         "ip": local_ip,
                         "port": self.server_port,
-                        "name": f"WebCamShare ({local_ip})"
-                    })
-                    self.sock.sendto(response.encode(), addr)
+                        "name": f"{self.name} ({local_ip})"
+                    }
+                    if self.status_provider:
+                        try:
+                            response.update(self.status_provider())
+                        except Exception as e:
+                            print(f"Announcer status error: {e}")
+                    self.sock.sendto(json.dumps(response).encode(), addr)
                     print(f"Responded to discovery request from {addr}")
             except socket.timeout:
                 continue
@@ -77,70 +251,162 @@ class ServerAnnouncer:
         print("ServerAnnouncer stopped")
 
 
-def get_broadcast_addresses():
-    """ローカルネットワークのブロードキャストアドレスを取得"""
-    broadcasts = ['255.255.255.255']  # フォールバック
-    try:
-        local_ip = get_local_ip()
-        if local_ip != "127.0.0.1":
-            # 一般的なサブネットマスク（/24）を仮定
-            parts = local_ip.split('.')
-            if len(parts) == 4:
-                broadcasts.insert(0, f"{parts[0]}.{parts[1]}.{parts[2]}.255")
-    except Exception:
-        pass
+def get_broadcast_addresses(interfaces=None):
+    """各インターフェースのサブネットブロードキャストアドレスを取得"""
+    if interfaces is None:
+        interfaces = get_interfaces()
+    broadcasts = []
+    for iface in interfaces:
+        if iface["broadcast"] and iface["broadcast"] not in broadcasts:
+            broadcasts.append(iface["broadcast"])
+    broadcasts.append('255.255.255.255')  # フォールバック
     return broadcasts
 
 
 class ServerDiscovery:
     """Receiver側: LANでサーバーを検出"""
     
-    def __init__(self, timeout=3.0):
+    def __init__(self, timeout=3.0, discovery_port=DISCOVERY_PORT, targets=None, cache=None):
         self.timeout = timeout
-    
-    def discover(self):
-        """サーバーを検索し、見つかったサーバーのリストを返す"""
+        self.discovery_port = discovery_port
+        # targets: 送信先アドレスの明示指定（Noneなら全サブネットのブロードキャスト）
+        self.targets = targets
+        # cache: 既知の送信元 (SenderCache)。ユニキャストで優先的に問い合わせる
+        self.cache = cache
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """進行中の discover() を早期終了させる"""
+        self._stop_event.set()
+
+    def _probe_targets(self):
+        targets = []
+        if self.cache:
+            # 既知の送信元を先に（ブロードキャストが届かないサブネットでも検出できる）
+            targets.extend(entry["ip"] for entry in self.cache.entries())
+        if self.targets is not None:
+            targets.extend(self.targets)
+        else:
+            targets.extend(get_broadcast_addresses())
+        return list(dict.fromkeys(targets))
+
+    def discover(self, on_found=None):
+        """サーバーを検索し、見つかったサーバーのリストを返す
+
+        on_found を渡すと、応答を受け取るたびに (server) で即座に呼び出す。
+        """
         servers = []
-        seen_ips = set()
+        seen = set()
+        self._stop_event.clear()
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        sock.settimeout(0.5)
+        sock.settimeout(0.1)
         
+        sent_at = {}
         try:
-            # 複数のブロードキャストアドレスに送信
-            broadcast_addrs = get_broadcast_addresses()
-            for addr in broadcast_addrs:
+            for addr in self._probe_targets():
                 try:
-                    sock.sendto(DISCOVERY_MESSAGE.encode(), (addr, DISCOVERY_PORT))
-                    print(f"Discovery sent to {addr}:{DISCOVERY_PORT}")
+                    sock.sendto(DISCOVERY_MESSAGE.encode(), (addr, self.discovery_port))
+                    sent_at[addr] = time.monotonic()
+                    print(f"Discovery sent to {addr}:{self.discovery_port}")
                 except Exception as e:
                     print(f"Failed to send to {addr}: {e}")
+            last_sent = max(sent_at.values(), default=time.monotonic())
             
-            start_time = time.time()
-            while time.time() - start_time < self.timeout:
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline and not self._stop_event.is_set():
                 try:
-                    data, addr = sock.recvfrom(1024)
-                    print(f"Received response from {addr}: {data[:50]}")
+                    data, addr = sock.recvfrom(4096)
+                    received = time.monotonic()
                     response = json.loads(data.decode())
                     if response.get("type") == ANNOUNCE_MESSAGE:
-                        ip = response["ip"]
-                        if ip not in seen_ips:
-                            seen_ips.add(ip)
-                            servers.append({
-                                "ip": ip,
-                                "port": response["port"],
-                                "name": response["name"]
-                            })
-                            print(f"Found server: {response['name']} at {ip}")
+                        key = (response["ip"], response["port"])
+                        if key not in seen:
+                            seen.add(key)
+                            server = {k: v for k, v in response.items() if k != "type"}
+                            # ユニキャスト宛ならその送信時刻、ブロードキャストなら最後の送信時刻から計測
+                            server["rtt_ms"] = round((received - sent_at.get(addr[0], last_sent)) * 1000, 2)
+                            servers.append(server)
+                            print(f"Found server: {server['name']} at {server['ip']}")
+                            if self.cache:
+                                self.cache.add(server)
+                            if on_found:
+                                on_found(server)
                 except socket.timeout:
                     # タイムアウトでも継続して待機
                     continue
-                except json.JSONDecodeError:
+                except ConnectionResetError:
+                    # Windows: 停止中の既知送信元からのICMP Port Unreachable
+                    continue
+                except (json.JSONDecodeError, UnicodeDecodeError, KeyError):
                     continue
                 except Exception as e:
                     print(f"Discovery error: {e}")
                     continue
         finally:
             sock.close()
+            if self.cache:
+                self.cache.save()
         
         return servers
+
+
+# ランキングの基準（受信側の仮想カメラ出力に合わせる）
+TARGET_HEIGHT = 720
+TARGET_FPS = 30
+# ネイティブ解像度のストリームを安定して配信するのに必要な負荷の余裕
+HEADROOM_PER_STREAM = 0.25
+# リレー1段あたりのペナルティ（遅延の増加分）
+RELAY_HOP_PENALTY = 0.1
+
+
+def _default_rendition(server):
+    return {
+        "name": "main",
+        "path": "/stream.mjpg",
+        "height": server.get("height"),
+        "fps": server.get("fps"),
+        "cost": 1.0,
+    }
+
+
+def score_rendition(server, rendition, target_height=TARGET_HEIGHT, target_fps=TARGET_FPS):
+    """期待される受信品質のスコア（大きいほど良い）
+
+    解像度・FPSによる画質、送信側の余裕（1 - load）で配信しきれる割合、
+    RTT によるペナルティを掛け合わせる。余裕が少ない送信元では
+    低解像度レンディションの方が高スコアになる。
+    """
+    height = rendition.get("height") or target_height
+    fps = rendition.get("fps") or target_fps
+    quality = min(1.0, height / target_height) * min(1.0, fps / target_fps)
+
+    headroom = max(0.0, 1.0 - server.get("load", 0.0))
+    needed = HEADROOM_PER_STREAM * rendition.get("cost", 1.0)
+    delivery = min(1.0, headroom / needed) if needed > 0 else 1.0
+
+    rtt_ms = server.get("rtt_ms", 0.0)
+    hops = server.get("relay_hops", 0)
+    return quality * delivery / (1.0 + rtt_ms / 100.0) / (1.0 + RELAY_HOP_PENALTY * hops)
+
+
+def rank_servers(servers, target_height=TARGET_HEIGHT, target_fps=TARGET_FPS, exclude_id=None):
+    """サーバーごとに最適なレンディションを選び、スコア順に並べて返す
+
+    各サーバーには "rendition"（選ばれたレンディション）と "score" を設定する。
+    能力情報を持たない旧バージョンの応答はネイティブ解像度のみとして扱う。
+    exclude_id を経路に含むサーバー（自分のリレーとその下流）は除外する。
+    """
+    ranked = []
+    for server in servers:
+        if exclude_id and exclude_id in server.get("path", []):
+            continue
+        renditions = server.get("renditions") or [_default_rendition(server)]
+        # 切り出しプリセットは画角の一部しか映らないため自動選択の対象外
+        renditions = [r for r in renditions if not r.get("crop")] or renditions
+        best = max(renditions, key=lambda r: score_rendition(server, r, target_height, target_fps))
+        server["rendition"] = best
+        server["score"] = round(score_rendition(server, best, target_height, target_fps), 4)
+        ranked.append(server)
+    ranked.sort(key=lambda s: s["score"], reverse=True)
+    return ranked
@@ -0,0 +1,178 @@
+import mmap
+import queue
+import struct
+import threading
+import time
+from pathlib import Path
+from utils import thread_roles
+
+# セグメントは配信と同じ multipart MJPEG 形式（そのまま再配信・再生できる）
+PART_BOUNDARY = b'--frame\r\n'
+
+# サイドカーインデックス (.idx): マジック + 固定長レコードの列
+INDEX_MAGIC = b'WCSIDX1\x00'
+# timestamp(f64, UNIX秒), パート先頭オフセット(u64), パート長(u32), パートヘッダー長(u32)
+INDEX_RECORD = struct.Struct('<dQII')
+
+
+def get_recordings_dir():
+    """既定の録画保存先（~/Videos/WebCamShare）"""
+    return Path.home() / "Videos" / "WebCamShare"
+
+
+def read_index(path):
+    """インデックスファイルを読み、(timestamp, part_offset, part_length, header_length) のリストを返す"""
+    with open(path, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+                raise ValueError(f"Not a recording index: {path}")
+            body = len(mm) - len(INDEX_MAGIC)
+            usable = body - body % INDEX_RECORD.size  # 書き込み途中の末尾は無視
+            with memoryview(mm) as view:
+                return list(INDEX_RECORD.iter_unpack(view[len(INDEX_MAGIC):len(INDEX_MAGIC) + usable]))
+
+
+class _Segment:
+    """1つのセグメントファイルとそのインデックス"""
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path.with_suffix('.idx')
+        self.file = open(path, 'wb', buffering=1024 * 1024)
+        self.index = open(self.index_path, 'wb')
+        self.index.write(INDEX_MAGIC)
+        self.size = 0
+        self.frames = 0
+        self.started = time.monotonic()
+
+    def close(self):
+        self.file.close()
+        self.index.close()
+
+
+class StreamRecorder:
+    """エンコード済みJPEGをセグメント分割して保存する非同期レコーダー
+
+    write() はキューに積むだけで決してブロックしない。キューが一杯の場合は
+    そのフレームを破棄する（キャプチャ・受信ループをディスクI/Oで止めない）。
+    書き込みスレッドはまとめて取り出したフレームを一括で書き込む。
+    """
+
+    def __init__(self, directory=None, prefix="webcamshare", segment_bytes=256 * 1024 * 1024,
+                 segment_seconds=600, queue_size=64, batch_frames=16):
+        self.directory = Path(directory) if directory else get_recordings_dir()
+        self.prefix = prefix
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.batch_frames = batch_frames
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._segment = None
+        self._segment_count = 0
+        self.running = False
+        self.thread = None
+
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.bytes_written = 0
+        self.segments = []
+
+    def start(self):
+        if self.running:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.thread.start()
+        print(f"Recording to {self.directory}")
+
+    def write(self, jpeg, timestamp=None):
+        """フレームを録画キューに追加（非ブロッキング、溢れたら破棄）"""
+        if not self.running:
+            return
+        if not isinstance(jpeg, bytes):
+            # カメラのプールバッファ（memoryview）は呼び出し後に再利用されるためコピーして保持
+            jpeg = bytes(jpeg)
+        try:
+            self._queue.put_nowait((jpeg, timestamp if timestamp is not None else time.time()))
+        except queue.Full:
+            self.frames_dropped += 1
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        print(f"Recording stopped: {self.frames_written} frames, {self.frames_dropped} dropped")
+
+    def _writer_loop(self):
+        thread_roles.assign("output", "recorder")
+        try:
+            while self.running or not self._queue.empty():
+                try:
+                    batch = [self._queue.get(timeout=0.2)]
+                except queue.Empty:
+                    continue
+                while len(batch) < self.batch_frames:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._write_batch(batch)
+        except OSError as e:
+            # ディスクフル等: 録画だけを止め、配信には影響させない
+            print(f"Recorder error: {e}")
+            self.running = False
+        finally:
+            if self._segment:
+                self._segment.close()
+                self._segment = None
+
+    def _write_batch(self, batch):
+        chunks = []
+        records = []
+        for jpeg, timestamp in batch:
+            segment = self._current_segment()
+            header = (
+                PART_BOUNDARY
+                + b'Content-Type: image/jpeg\r\n'
+                + f'Content-Length: {len(jpeg)}\r\n'.encode()
+                + f'X-Timestamp: {timestamp:.6f}\r\n\r\n'.encode()
+            )
+            part_length = len(header) + len(jpeg) + 2
+            records.append(INDEX_RECORD.pack(timestamp, segment.size, part_length, len(header)))
+            chunks += (header, jpeg, b'\r\n')
+            segment.size += part_length
+            segment.frames += 1
+
+            if self._should_rotate(segment):
+                self._flush(segment, chunks, records)
+                chunks, records = [], []
+                segment.close()
+                self._segment = None
+
+        if self._segment:
+            self._flush(self._segment, chunks, records)
+
+    def _flush(self, segment, chunks, records):
+        segment.file.writelines(chunks)
+        segment.file.flush()
+        # インデックスは本体の後に書く（インデックスが指す範囲は常に書き込み済み）
+        segment.index.write(b''.join(records))
+        segment.index.flush()
+        self.frames_written += len(records)
+        self.bytes_written += sum(len(c) for c in chunks)
+
+    def _should_rotate(self, segment):
+        return (segment.size >= self.segment_bytes
+                or time.monotonic() - segment.started >= self.segment_seconds)
+
+    def _current_segment(self):
+        if self._segment is None:
+            self._segment_count += 1
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            path = self.directory / f"{self.prefix}_{stamp}_{self._segment_count:04d}.mjpg"
+            self._segment = _Segment(path)
+            self.segments.append(path)
+        return self._segment
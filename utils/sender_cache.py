@@ -0,0 +1,78 @@
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+
+def get_config_dir():
+    """ユーザー設定ディレクトリ（%APPDATA%/WebCamShare または ~/.config/webcamshare）"""
+    if sys.platform == "win32":
+        base = os.environ.get("APPDATA") or Path.home() / "AppData" / "Roaming"
+        return Path(base) / "WebCamShare"
+    base = os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config"
+    return Path(base) / "webcamshare"
+
+
+class SenderCache:
+    """最近検出した送信元を永続化し、起動直後に再接続候補として使う"""
+
+    MAX_ENTRIES = 16
+    MAX_AGE = 30 * 24 * 3600  # 30日
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else get_config_dir() / "known_senders.json"
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self._lock:
+            for entry in data if isinstance(data, list) else []:
+                try:
+                    if now - entry["last_seen"] > self.MAX_AGE:
+                        continue
+                    self._entries[(entry["ip"], entry["port"])] = entry
+                except (KeyError, TypeError):
+                    continue
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = list(self._entries.values())
+            self._dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(entries, ensure_ascii=False, indent=2), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Failed to save sender cache: {e}")
+
+    def add(self, server):
+        """検出したサーバーを記録（最終検出時刻を更新）"""
+        entry = {
+            "ip": server["ip"],
+            "port": server["port"],
+            "name": server.get("name", server["ip"]),
+            "last_seen": time.time(),
+        }
+        with self._lock:
+            self._entries[(entry["ip"], entry["port"])] = entry
+            if len(self._entries) > self.MAX_ENTRIES:
+                oldest = min(self._entries, key=lambda k: self._entries[k]["last_seen"])
+                del self._entries[oldest]
+            self._dirty = True
+
+    def entries(self):
+        """最近検出された順のエントリ一覧"""
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda e: e["last_seen"], reverse=True)
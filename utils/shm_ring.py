@@ -0,0 +1,198 @@
+"""同一ホスト内の送受信用の共有メモリ・リングバッファ
+
+送信側が生フレーム（BGR）と、あればエンコード済みJPEGを固定数のスロットへ順に書き込み、
+受信側は最新スロットを numpy のビューとしてコピーなしで読む。
+
+    [ヘッダー 64B][スロット0][スロット1]...
+    スロット = [スロットヘッダー 64B][フレーム領域][JPEG領域]（64B境界に揃える）
+
+スロットヘッダーの連番は書き込み中0にし、書き終えてから設定する（seqlock）。
+読み手は使い終わった後に連番が変わっていないか確認し、上書きされていれば破棄する。
+"""
+import struct
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MAGIC = b"WCSHM\x00\x00\x01"
+VERSION = 1
+# magic, version, slots, frame_capacity, jpeg_capacity, latest_seq, writer_heartbeat, reader_heartbeat, closed
+HEADER = struct.Struct("<8sIIIIQddI")
+HEADER_SIZE = 64
+_LATEST = struct.Struct("<Q")
+_LATEST_OFFSET = 24
+_WRITER_HEARTBEAT_OFFSET = 32
+_READER_HEARTBEAT_OFFSET = 40
+_CLOSED_OFFSET = 48
+_TIME = struct.Struct("<d")
+_FLAG = struct.Struct("<I")
+# seq, timestamp, width, height, jpeg_size
+SLOT_HEADER = struct.Struct("<QdIII")
+SLOT_HEADER_SIZE = 64
+
+DEFAULT_SLOTS = 4
+# これより長く読み手の応答がなければ書き込みを省く（s）
+READER_TIMEOUT = 2.0
+
+
+def _align(n, alignment=64):
+    return (n + alignment - 1) // alignment * alignment
+
+
+class _AttachedSegment(shared_memory.SharedMemory):
+    def __del__(self):
+        try:
+            self.close()
+        except BufferError:
+            # 呼び出し側がまだフレームのビューを持っている（mmapはビューと一緒に解放される）
+            pass
+
+
+def attach_segment(name, shared_tracker=False):
+    """既存の共有メモリに接続する（読み手の終了時にセグメントが削除されないようにする）
+
+    shared_tracker: 書き手と同じ resource_tracker を使うプロセス（同じ親からspawnされた子）。
+    登録は書き手と共通なので、ここで解除すると書き手の登録が消えてしまう。
+    """
+    try:
+        return _AttachedSegment(name=name, track=False)
+    except TypeError:
+        # Python 3.12以前: resource_tracker が接続側でも終了時に unlink してしまう
+        shm = _AttachedSegment(name=name)
+        if shared_tracker:
+            return shm
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+        return shm
+
+
+class ShmRingWriter:
+    """送信側: フレームをリングへ書き込む"""
+
+    def __init__(self, name, width, height, slots=DEFAULT_SLOTS, jpeg_capacity=None):
+        self.name = name
+        self.slots = slots
+        self.frame_capacity = width * height * 3
+        # JPEG領域に収まらないフレームはJPEGなし（jpeg_size=0）で書く
+        self.jpeg_capacity = jpeg_capacity if jpeg_capacity is not None else max(self.frame_capacity // 4, 256 * 1024)
+        self.stride = _align(SLOT_HEADER_SIZE + self.frame_capacity + self.jpeg_capacity)
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER_SIZE + self.stride * slots)
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, slots, self.frame_capacity, self.jpeg_capacity,
+                         0, time.time(), 0.0, 0)
+        self._buf = np.ndarray((self.shm.size,), dtype=np.uint8, buffer=self.shm.buf)
+
+    def fits(self, frame):
+        return frame.nbytes <= self.frame_capacity
+
+    def has_readers(self):
+        """直近に読み手がいたか（いなければ書き込みを省ける）。書き手の生存通知も兼ねる"""
+        now = time.time()
+        _TIME.pack_into(self.shm.buf, _WRITER_HEARTBEAT_OFFSET, now)
+        return now - _TIME.unpack_from(self.shm.buf, _READER_HEARTBEAT_OFFSET)[0] < READER_TIMEOUT
+
+    def write(self, seq, timestamp, frame, jpeg=None):
+        """フレーム（uint8, HxWx3）を書き込む。seq は1以上で単調増加"""
+        offset = HEADER_SIZE + (seq % self.slots) * self.stride
+        data = offset + SLOT_HEADER_SIZE
+        buf = self.shm.buf
+        # 書き込み中は連番0（読み手は不完全なスロットを読まない）
+        SLOT_HEADER.pack_into(buf, offset, 0, 0.0, 0, 0, 0)
+        h, w = frame.shape[:2]
+        self._buf[data:data + frame.nbytes].reshape(frame.shape)[...] = frame
+        jpeg_size = 0
+        if jpeg is not None and len(jpeg) <= self.jpeg_capacity:
+            jpeg_size = len(jpeg)
+            start = data + self.frame_capacity
+            buf[start:start + jpeg_size] = jpeg
+        SLOT_HEADER.pack_into(buf, offset, seq, timestamp, w, h, jpeg_size)
+        _LATEST.pack_into(buf, _LATEST_OFFSET, seq)
+
+    def close(self):
+        """読み手に終了を知らせ、セグメントを削除する"""
+        try:
+            _FLAG.pack_into(self.shm.buf, _CLOSED_OFFSET, 1)
+        except (TypeError, ValueError):
+            pass
+        self._buf = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ShmRingReader:
+    """受信側: 最新フレームをコピーなしで読む"""
+
+    # 書き手の生存通知がこれより古ければ送信側が落ちたとみなす（s）
+    WRITER_TIMEOUT = 5.0
+
+    def __init__(self, name, shared_tracker=False):
+        self.name = name
+        self.shm = attach_segment(name, shared_tracker)
+        magic, version, slots, frame_capacity, jpeg_capacity = HEADER.unpack_from(self.shm.buf, 0)[:5]
+        if magic != MAGIC or version != VERSION:
+            self.shm.close()
+            raise ValueError(f"Not a WebCamShare frame ring: {name}")
+        self.slots = slots
+        self.frame_capacity = frame_capacity
+        self.jpeg_capacity = jpeg_capacity
+        self.stride = _align(SLOT_HEADER_SIZE + frame_capacity + jpeg_capacity)
+
+    @property
+    def latest_seq(self):
+        return _LATEST.unpack_from(self.shm.buf, _LATEST_OFFSET)[0]
+
+    @property
+    def closed(self):
+        """送信側が閉じた、または一定時間応答がない"""
+        if _FLAG.unpack_from(self.shm.buf, _CLOSED_OFFSET)[0]:
+            return True
+        return time.time() - _TIME.unpack_from(self.shm.buf, _WRITER_HEARTBEAT_OFFSET)[0] > self.WRITER_TIMEOUT
+
+    def touch(self):
+        """読み手がいることを書き手に知らせる"""
+        _TIME.pack_into(self.shm.buf, _READER_HEARTBEAT_OFFSET, time.time())
+
+    def read(self, after=0):
+        """after より新しい最新フレームを (seq, timestamp, frame, jpeg) で返す（なければNone）
+
+        frame は共有メモリ上のビュー、jpeg は memoryview（なければNone）。
+        数フレーム後に上書きされるため、使い終わったら valid(seq) で確認する。
+        """
+        seq = self.latest_seq
+        if seq <= after:
+            return None
+        item = self.read_seq(seq)
+        return (seq,) + item if item else None
+
+    def read_seq(self, seq):
+        """指定したフレームを (timestamp, frame, jpeg) で返す（上書き済み・書き込み中ならNone）"""
+        offset = HEADER_SIZE + (seq % self.slots) * self.stride
+        slot_seq, timestamp, w, h, jpeg_size = SLOT_HEADER.unpack_from(self.shm.buf, offset)
+        if slot_seq != seq:
+            return None
+        data = offset + SLOT_HEADER_SIZE
+        frame = np.ndarray((h, w, 3), dtype=np.uint8, buffer=self.shm.buf, offset=data)
+        frame.flags.writeable = False
+        jpeg = None
+        if jpeg_size:
+            start = data + self.frame_capacity
+            jpeg = self.shm.buf[start:start + jpeg_size].toreadonly()
+        return timestamp, frame, jpeg
+
+    def valid(self, seq):
+        """読んだフレームがまだ上書きされていないか"""
+        offset = HEADER_SIZE + (seq % self.slots) * self.stride
+        return SLOT_HEADER.unpack_from(self.shm.buf, offset)[0] == seq
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError:
+            # 呼び出し側がまだビューを持っている（ビューと一緒に解放される）
+            pass
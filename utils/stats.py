@@ -0,0 +1,39 @@
+import time
+
+
+class RateMeter:
+    """累積カウンターの差分から区間ごとのレートを求める"""
+
+    def __init__(self):
+        self._last_time = time.monotonic()
+        self._last = {}
+
+    def rates(self, **counters):
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-6)
+        rates = {name: (value - self._last.get(name, 0)) / elapsed for name, value in counters.items()}
+        self._last_time = now
+        self._last = counters
+        return rates
+
+
+class StageTimes:
+    """処理ステージごとの所要時間（ms）の指数移動平均
+
+    各ステージは1つのスレッドからしか更新しない前提でロックを取らない。
+    """
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.ms = {}
+
+    def record(self, stage, ms):
+        prev = self.ms.get(stage)
+        self.ms[stage] = ms if prev is None else prev + (ms - prev) * self.alpha
+
+    def since(self, stage, start):
+        """perf_counter() の start からの経過時間を記録する"""
+        self.record(stage, (time.perf_counter() - start) * 1000)
+
+    def get(self, stage):
+        return self.ms.get(stage, 0.0)
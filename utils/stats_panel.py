@@ -0,0 +1,88 @@
+import customtkinter as ctk
+from .stats import RateMeter
+from .theme import Theme
+
+
+class StatsPanel(ctk.CTkFrame):
+    """折りたたみ式の性能パネル
+
+    provider(rates) は (項目名, 表示文字列) のリストを返す。rates には
+    provider が counters() で返した累積カウンターの秒あたりの値が入る。
+    展開中だけ interval_ms ごとに更新し、折りたたみ中は何も実行しない。
+    """
+
+    def __init__(self, master, provider, counters=None, title="Performance", interval_ms=1000, columns=2):
+        super().__init__(master, fg_color=Theme.BG_CARD, corner_radius=Theme.RADIUS_SM)
+        self.provider = provider
+        self.counters = counters or (lambda: {})
+        self.title = title
+        self.interval_ms = interval_ms
+        self.columns = columns
+        self.expanded = False
+        self._after_id = None
+        self._meter = None
+
+        self.btn_toggle = ctk.CTkButton(
+            self,
+            text=f"▸  {title}",
+            height=24,
+            anchor="w",
+            font=Theme.FONT_SMALL,
+            fg_color="transparent",
+            hover_color=Theme.BG_INPUT,
+            text_color=Theme.TEXT_SECONDARY,
+            corner_radius=Theme.RADIUS_SM,
+            command=self.toggle
+        )
+        self.btn_toggle.pack(fill="x", padx=Theme.PAD_XS, pady=Theme.PAD_XS)
+
+        self.label_body = ctk.CTkLabel(
+            self,
+            text="",
+            justify="left",
+            anchor="w",
+            font=Theme.FONT_MONO,
+            text_color=Theme.TEXT_PRIMARY
+        )
+
+    def toggle(self):
+        if self.expanded:
+            self.collapse()
+        else:
+            self.expand()
+
+    def expand(self):
+        self.expanded = True
+        self.btn_toggle.configure(text=f"▾  {self.title}")
+        self.label_body.pack(fill="x", padx=Theme.PAD_MD, pady=(0, Theme.PAD_SM))
+        self._meter = RateMeter()
+        self._meter.rates(**self.counters())
+        self._refresh()
+
+    def collapse(self):
+        self.expanded = False
+        self.btn_toggle.configure(text=f"▸  {self.title}")
+        self.label_body.pack_forget()
+        if self._after_id:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _refresh(self):
+        self._after_id = None
+        if not self.expanded:
+            return
+        try:
+            rows = self.provider(self._meter.rates(**self.counters()))
+        except Exception as e:
+            rows = [("error", str(e))]
+        width = max((len(name) for name, _ in rows), default=0)
+        cells = [f"{name:<{width}}  {value:<14}" for name, value in rows]
+        lines = ["   ".join(cells[i:i + self.columns]).rstrip() for i in range(0, len(cells), self.columns)]
+        self.label_body.configure(text="\n".join(lines) or "—")
+        self._after_id = self.after(self.interval_ms, self._refresh)
+
+    def destroy(self):
+        if self._after_id:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        super().destroy()
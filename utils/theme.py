@@ -30,6 +30,7 @@ class Theme:
     FONT_BODY = (FONT_FAMILY, 13)
     FONT_SMALL = (FONT_FAMILY, 11)
     FONT_BUTTON = (FONT_FAMILY, 14, "bold")
+    FONT_MONO = ("Consolas", 11)
     
     # Spacing
     PAD_XS = 4
@@ -0,0 +1,150 @@
+"""スレッドの役割ごとのCPU割り当てと優先度（Linux）
+
+各スレッドは開始時に assign(役割) を呼び、名前（ps/top/トレースで見える）を付け、
+役割に設定された CPU（sched_setaffinity）と nice 値を自分に適用する。
+キャプチャ・エンコード・送受信・出力のホットパスを UI スレッドと別の CPU に置き、
+UI の描画や他のプロセスの負荷でフレームの遅延が伸びないようにする。
+
+指定は "役割=CPU[@nice]" のカンマ区切り（CPU は "2-3" や "0+2+4-5"、省略すると変えない）。
+"auto" は CPU 0 を UI 用に残し、残りの CPU をホットパスへ割り当てて nice を -5 にする
+（CPU が1つなら nice だけ）。負の nice には権限（CAP_SYS_NICE）が要り、なければ警告して続ける。
+
+    python main.py send --thread-roles auto
+    python main.py receive --thread-roles "network=1,output=2-3@-5,ui=0"
+    WEBCAMSHARE_THREAD_ROLES=auto python main.py
+
+設定は環境変数にも書くので、別プロセス構成（sender.workers）の子プロセスにも引き継がれる。
+スレッドと子プロセスは作ったスレッドの CPU と nice を引き継ぐため、メインスレッド（Tk のUIスレッド）
+には役割を適用しない（待ち受け・検出のスレッドや子プロセス、OpenCV のスレッドまで CPU 0 に固定されてしまう）。
+ui の役割はプレビューなどUI用の補助スレッドに適用し、auto ではホットパスを CPU 0 から外すことで UI と分ける。
+"""
+import ctypes
+import ctypes.util
+import os
+import sys
+import threading
+
+ENV_VAR = "WEBCAMSHARE_THREAD_ROLES"
+ROLES = ("capture", "encode", "network", "output", "ui")
+# ホットパス（auto で UI と別の CPU に置き、優先度を上げる役割）
+HOT_ROLES = ("capture", "encode", "network", "output")
+AUTO_NICE = -5
+
+_config = None
+_warned = set()
+_prctl = None
+
+
+def _parse_cpus(text):
+    cpus = set()
+    for part in text.split('+'):
+        first, _, last = part.partition('-')
+        first = int(first)
+        cpus.update(range(first, int(last) + 1) if last else (first,))
+    return cpus
+
+
+def _auto():
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    config = {role: (None, AUTO_NICE) for role in HOT_ROLES}
+    if len(cpus) > 1:
+        config = {role: (set(cpus[1:]), AUTO_NICE) for role in HOT_ROLES}
+        config["ui"] = ({cpus[0]}, None)
+    return config
+
+
+def parse_roles(spec):
+    """指定文字列から {役割: (CPUの集合またはNone, niceまたはNone)} を作る"""
+    spec = (spec or "").strip()
+    if not spec or spec == "off":
+        return {}
+    if spec == "auto":
+        return _auto()
+    config = {}
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        role, sep, value = item.partition('=')
+        role = role.strip()
+        if not sep or role not in ROLES:
+            raise ValueError(f"Invalid thread role: {item!r} (use ROLE=CPUS[@NICE], ROLE in {', '.join(ROLES)})")
+        cpus, _, nice = value.strip().partition('@')
+        try:
+            config[role] = (_parse_cpus(cpus) if cpus else None, int(nice) if nice else None)
+        except ValueError:
+            raise ValueError(f"Invalid thread role: {item!r} (use ROLE=CPUS[@NICE], e.g. network=2-3@-5)")
+    return config
+
+
+def configure(spec):
+    """役割の設定を有効にする（子プロセスにも引き継ぐため環境変数にも書く）"""
+    global _config
+    _config = parse_roles(spec)
+    if spec:
+        os.environ[ENV_VAR] = spec
+    else:
+        os.environ.pop(ENV_VAR, None)
+    return _config
+
+
+def _get_config():
+    global _config
+    if _config is None:
+        try:
+            _config = parse_roles(os.environ.get(ENV_VAR))
+        except ValueError as e:
+            print(f"{ENV_VAR} ignored: {e}")
+            _config = {}
+    return _config
+
+
+def _set_os_thread_name(name):
+    """カーネル側のスレッド名（top -H や /proc/<pid>/task/*/comm に出る。15バイトまで）"""
+    global _prctl
+    if _prctl is None:
+        try:
+            _prctl = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True).prctl
+        except (OSError, AttributeError):
+            _prctl = False
+    if _prctl:
+        # PR_SET_NAME
+        _prctl(15, name.encode()[:15], 0, 0, 0)
+
+
+def assign(role, name=None):
+    """呼び出したスレッドに名前を付け、役割の CPU と nice を適用する（スレッドの先頭で呼ぶ）
+
+    name を省略すると名前は変えない（メインスレッドの名前はプロセス名として ps に出るため）。
+    """
+    linux = sys.platform.startswith("linux")
+    if name:
+        threading.current_thread().name = name
+        if linux:
+            _set_os_thread_name(name)
+    if not linux:
+        return
+    cpus, nice = _get_config().get(role, (None, None))
+    try:
+        if cpus:
+            # pid 0 は呼び出したスレッドだけ（Linux ではスレッド単位）
+            os.sched_setaffinity(0, cpus)
+        if nice is not None:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except OSError as e:
+        if role not in _warned:
+            _warned.add(role)
+            print(f"Thread role {role}: could not apply cpus={sorted(cpus) if cpus else '-'} nice={nice}: {e}")
+
+
+def describe():
+    """統計行用の短い表示（例: "capture 1+2+3@-5, ui 0"）"""
+    parts = []
+    for role, (cpus, nice) in _get_config().items():
+        text = role
+        if cpus:
+            text += " " + "+".join(str(c) for c in sorted(cpus))
+        if nice is not None:
+            text += f"@{nice}"
+        parts.append(text)
+    return ", ".join(parts)
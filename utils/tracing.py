@@ -0,0 +1,129 @@
+"""フレーム処理の区間トレース（Chrome/Perfetto の trace JSON として出力）
+
+環境変数 WEBCAMSHARE_TRACE にファイル名を指定すると記録を有効にし、
+終了時にそのファイルへ書き出す（"1" なら webcamshare-trace-<pid>.json）。
+記録は固定長のリングバッファへの代入だけで、ロックを取らない。
+古いイベントから上書きされるため、常時有効にしても直近の区間だけが残る。
+
+    start = tracing.begin()
+    ...
+    tracing.end("encode", start, seq)
+
+無効時は begin() が0を返し、end() は何もしない。
+"""
+import atexit
+import itertools
+import json
+import os
+import threading
+import time
+
+ENV_VAR = "WEBCAMSHARE_TRACE"
+SIZE_ENV_VAR = "WEBCAMSHARE_TRACE_SIZE"
+DEFAULT_CAPACITY = 65536
+
+
+class Tracer:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.enabled = False
+        self.capacity = capacity
+        self._events = [None] * capacity
+        # next() はGILの下でアトミックなので書き込み位置の確保にロック不要
+        self._counter = itertools.count()
+        self._thread_names = {}
+
+    def enable(self, capacity=None):
+        if capacity and capacity != self.capacity:
+            self.capacity = capacity
+            self._events = [None] * capacity
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self._events = [None] * self.capacity
+        self._counter = itertools.count()
+
+    def begin(self):
+        """区間の開始時刻（無効時は0）"""
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def end(self, name, start, seq=None, cat="frame"):
+        """begin() からの区間を記録する（seq はフレーム番号）"""
+        if not start:
+            return
+        now = time.perf_counter_ns()
+        tid = threading.get_ident()
+        if tid not in self._thread_names:
+            self._thread_names[tid] = threading.current_thread().name
+        self._events[next(self._counter) % self.capacity] = (name, cat, start, now - start, tid, seq)
+
+    def events(self):
+        """記録済みイベントを開始時刻順に返す"""
+        return sorted((e for e in list(self._events) if e is not None), key=lambda e: e[2])
+
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in list(self._thread_names.items())]
+        for name, cat, start, duration, tid, seq in self.events():
+            event = {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": start / 1000,   # μs
+                "dur": duration / 1000,
+                "pid": pid,
+                "tid": tid,
+            }
+            if seq is not None:
+                event["args"] = {"seq": seq}
+            trace.append(event)
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def export(self, path):
+        """Chrome (chrome://tracing) / Perfetto で開けるJSONを書き出す"""
+        data = self.to_chrome_trace()
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        print(f"Trace written to {path} ({len(data['traceEvents'])} events)")
+
+
+tracer = Tracer()
+begin = tracer.begin
+end = tracer.end
+# 終了時の書き出し先（enable() を何度呼んでも登録は1回、書き出すのは最後に指定したパスのみ）
+_export_path = None
+
+
+def enable(path=None, capacity=None):
+    """記録を開始する（path を指定すると終了時に書き出す）"""
+    global _export_path
+    tracer.enable(capacity)
+    if path:
+        if _export_path is None:
+            atexit.register(_export_at_exit)
+        _export_path = path
+
+
+def _export_at_exit():
+    try:
+        tracer.export(_export_path)
+    except OSError as e:
+        print(f"Could not write trace: {e}")
+
+
+def _init_from_env():
+    value = os.environ.get(ENV_VAR)
+    if not value or value == "0":
+        return
+    path = f"webcamshare-trace-{os.getpid()}.json" if value.lower() in ("1", "true", "yes") else value
+    try:
+        capacity = int(os.environ.get(SIZE_ENV_VAR, DEFAULT_CAPACITY))
+    except ValueError:
+        capacity = DEFAULT_CAPACITY
+    enable(path, capacity)
+
+
+_init_from_env()